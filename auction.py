@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 from enum import Enum
 from functools import wraps
 from io import StringIO
-from lib.netprint import img2url_multi
+from lib.netprint import img2url_multi, get_purchase_ledger
 from lxml import etree
 from pathlib import Path
 from PIL import Image
@@ -25,34 +25,349 @@ import requests
 import time
 import urllib.parse
 import itertools
+import atexit
+import contextlib
+import fcntl
 import random
+import sqlite3
+import threading
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import traceback
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 import html5lib
+import urllib3
+
+# メソッドごとのリトライ設定
+RETRY_POLICIES = {
+    # 冪等なリクエストは一時的なエラーならジッター付き指数バックオフで再試行する
+    "GET": {"max_attempts": 4, "multiplier": 2, "max_wait": 60},
+    "HEAD": {"max_attempts": 4, "multiplier": 2, "max_wait": 60},
+    # POST はサーバーに届いていないことが確実な場合のみ再試行する
+    "POST": {"max_attempts": 3, "multiplier": 5, "max_wait": 60},
+}
+
+
+def is_transient_error(exc):
+    """再試行で回復が見込めるエラーか (接続エラー、タイムアウト、429、5xx)"""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return exc.response is not None and (exc.response.status_code == 429 or exc.response.status_code >= 500)
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def is_unsent_error(exc):
+    """リクエストがサーバーに届いていないことが確実なエラーか (接続確立前の失敗)"""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        reason = getattr(exc.args[0], "reason", None)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def retry_request(func, *args, policy=None, should_retry=is_transient_error, on_retry=None, **kwargs):
+    """
+    func をリトライ設定に従って実行する。
+
+    :param policy: RETRY_POLICIES の値 (max_attempts, multiplier, max_wait)
+    :param should_retry: 例外を受け取り再試行するかを返す関数
+    :param on_retry: 再試行の直前に呼ばれる関数 (tenacity の RetryCallState を受け取る)
+    """
+    policy = policy or RETRY_POLICIES["GET"]
+    retrying = Retrying(
+        stop=stop_after_attempt(policy["max_attempts"]),
+        wait=wait_random_exponential(multiplier=policy["multiplier"], max=policy["max_wait"]),
+        retry=retry_if_exception(should_retry),
+        before_sleep=on_retry,
+        reraise=True,
+    )
+    return retrying(func, *args, **kwargs)
+
+
+class RequestStats:
+    """エンドポイントごとのリクエスト数・リトライ数・レイテンシを集計する。"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(method, url):
+        parsed_url = urlparse(url)
+        return f"{method} {parsed_url.netloc}{parsed_url.path}"
+
+    def record(self, endpoint, attempts, latency, ok):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {"requests": 0, "retries": 0, "failures": 0, "latency_total": 0.0, "latency_max": 0.0})
+            stats["requests"] += 1
+            stats["retries"] += attempts - 1
+            stats["failures"] += 0 if ok else 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+
+    def stats(self):
+        with self._lock:
+            rows = [{"endpoint": endpoint, **stats} for endpoint, stats in self._stats.items()]
+        df = pd.DataFrame(rows, columns=["endpoint", "requests", "retries", "failures", "latency_total", "latency_max"])
+        df["latency_mean"] = df["latency_total"] / df["requests"]
+        return df
 
-# リトライデコレーターの設定
-@retry(stop=stop_after_attempt(2), wait=wait_fixed(10))
-def retry_request(func, *args, **kwargs):
-    return func(*args, **kwargs)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        トークンバケット。
+
+        :param rate: 1秒あたりに補充されるトークン数
+        :param burst: バケットの最大容量 (連続して即時に送れるリクエスト数)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff_count = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, tokens=1):
+        """
+        トークンを予約し、送信までに待つべき秒数を返す。
+        トークンは前借り (負の残高) できるため、同時に呼ばれても順番に間隔が空く。
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= tokens
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+
+class RateLimiter:
+    """
+    ホストとエンドポイント種別 (read / write) ごとのトークンバケットでリクエスト間隔を制御する。
+    429 / 5xx / captcha を検知すると該当バケットを指数的にバックオフさせる。
+    """
+
+    READ_METHODS = ("GET", "HEAD", "OPTIONS")
+    # captcha ページへのリダイレクト先 (ホスト名・パスの区切りとしての captcha。クエリ文字列は見ない)
+    CAPTCHA_URL_REGEX = r"(^|[./])captcha([./]|$)"
+    # captcha ページの DOM の目印 (タイトル、または captcha の入力欄)。
+    # スクリプトやフッターに captcha という文字列があるだけの通常のページは対象にしない
+    CAPTCHA_PAGE_REGEX = (
+        r"<title>[^<]*(captcha|画像認証)[^<]*</title>"
+        r"|<input\b[^>]*\bname=[\"']?[^\"'\s>]*captcha"
+    )
+
+    def __init__(self, read_rate=1/3, read_burst=5, write_rate=1/10, write_burst=1,
+                 backoff_base=30, backoff_max=600, host_rates=None,
+                 captcha_url_pattern=CAPTCHA_URL_REGEX, captcha_page_pattern=CAPTCHA_PAGE_REGEX):
+        """
+        :param read_rate: read (GET) の1秒あたりのリクエスト数
+        :param read_burst: read のバースト容量
+        :param write_rate: write (POST等) の1秒あたりのリクエスト数
+        :param write_burst: write のバースト容量
+        :param backoff_base: 最初のバックオフ秒数
+        :param backoff_max: バックオフ秒数の上限
+        :param host_rates: ホストごとの上書き設定 (例: {"contact.auctions.yahoo.co.jp": {"write_rate": 0.05}})
+        :param captcha_url_pattern: captcha ページの URL (ホスト名 + パス) の正規表現
+        :param captcha_page_pattern: captcha ページの HTML の目印の正規表現
+        """
+        self.defaults = {
+            "read_rate": read_rate,
+            "read_burst": read_burst,
+            "write_rate": write_rate,
+            "write_burst": write_burst,
+        }
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.host_rates = host_rates or {}
+        self.captcha_url_regex = re.compile(captcha_url_pattern, re.IGNORECASE)
+        self.captcha_page_regex = re.compile(captcha_page_pattern, re.IGNORECASE)
+        self.buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def classify(self, method):
+        return "read" if method.upper() in self.READ_METHODS else "write"
+
+    def _key(self, method, url):
+        return urlparse(url).netloc, self.classify(method)
+
+    def _bucket(self, key):
+        if key not in self.buckets:
+            host, kind = key
+            conf = {**self.defaults, **self.host_rates.get(host, {})}
+            self.buckets[key] = TokenBucket(conf[f"{kind}_rate"], conf[f"{kind}_burst"])
+            self._stats[key] = {"requests": 0, "tokens": 0, "waits": 0, "wait_seconds": 0.0, "backoffs": 0}
+        return self.buckets[key]
+
+    def acquire(self, method, url, tokens=1):
+        """送信可能になるまで待機する。待機した秒数を返す。"""
+        key = self._key(method, url)
+        with self._lock:
+            wait = self._bucket(key).reserve(tokens)
+            stats = self._stats[key]
+            stats["requests"] += 1
+            stats["tokens"] += tokens
+            if wait > 0:
+                stats["waits"] += 1
+                stats["wait_seconds"] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _is_throttled(self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            return True
+        # リダイレクトの途中も含めて captcha ページに飛ばされたか
+        for url in [r.url for r in response.history] + [response.url]:
+            parsed = urlparse(url)
+            if self.captcha_url_regex.search(parsed.netloc + parsed.path):
+                return True
+        content_type = response.headers.get("Content-Type", "")
+        return "html" in content_type and bool(self.captcha_page_regex.search(response.text))
+
+    def observe(self, response, **kwargs):
+        """レスポンスフック。スロットリングの兆候があればバックオフする。"""
+        key = self._key(response.request.method, response.url)
+        throttled = self._is_throttled(response)
+        with self._lock:
+            bucket = self._bucket(key)
+            if not throttled:
+                bucket.backoff_count = 0
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** bucket.backoff_count)
+            bucket.backoff_count += 1
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+            self._stats[key]["backoffs"] += 1
+        logger.warning(f"バックオフ {delay}秒: {response.status_code} {key[0]} ({key[1]})")
+
+    def stats(self):
+        """ホスト・種別ごとの統計 (リクエスト数、消費トークン、待機回数、待機秒数、バックオフ回数)"""
+        with self._lock:
+            rows = [{"host": host, "kind": kind, **stats} for (host, kind), stats in self._stats.items()]
+        return pd.DataFrame(rows, columns=["host", "kind", "requests", "tokens", "waits", "wait_seconds", "backoffs"])
+
+
+class RequestLedger:
+    """
+    重複POST防止のためのリクエスト台帳 (SQLite, WALモード)。
+    リクエストハッシュをキーに、日時・アカウント・URL・ステータスコード・有効期限を記録する。
+    """
+
+    def __init__(self, db_path="request_ledger.db", ttl=timedelta(days=90)):
+        """
+        :param db_path: SQLite ファイルのパス
+        :param ttl: 記録の有効期限。期限切れのハッシュは再送を許可する
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                request_hash TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                account TEXT,
+                method TEXT,
+                url TEXT,
+                status_code INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_expires_at ON requests (expires_at)")
+        self.purge_expired()
+
+    def claim(self, request_hash, account, method, url):
+        """
+        ハッシュを登録する。既に有効な記録があれば False を返す。
+        確認と登録は1文の UPSERT で行うため、複数プロセスから同時に呼ばれても1つしか成功しない。
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute("""
+                INSERT INTO requests (request_hash, created_at, expires_at, account, method, url, status_code)
+                VALUES (?, ?, ?, ?, ?, ?, NULL)
+                ON CONFLICT(request_hash) DO UPDATE SET
+                    created_at = excluded.created_at,
+                    expires_at = excluded.expires_at,
+                    account = excluded.account,
+                    method = excluded.method,
+                    url = excluded.url,
+                    status_code = NULL
+                WHERE requests.expires_at < excluded.created_at
+            """, (request_hash, now, now + self.ttl.total_seconds(), account, method, url))
+            return cursor.rowcount == 1
+
+    def record(self, request_hash, status_code):
+        """レスポンスのステータスコードを記録する。"""
+        with self._lock:
+            self.conn.execute("UPDATE requests SET status_code = ? WHERE request_hash = ?", (status_code, request_hash))
+
+    def release(self, request_hash):
+        """送信に失敗した登録を取り消し、再送を許可する。"""
+        with self._lock:
+            self.conn.execute("DELETE FROM requests WHERE request_hash = ?", (request_hash,))
+
+    def get(self, request_hash):
+        """有効な記録を辞書で返す。存在しなければ None。"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT request_hash, created_at, expires_at, account, method, url, status_code FROM requests "
+                "WHERE request_hash = ? AND expires_at >= ?", (request_hash, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ["request_hash", "created_at", "expires_at", "account", "method", "url", "status_code"]
+        return dict(zip(keys, row))
+
+    def purge_expired(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM requests WHERE expires_at < ?", (time.time(),))
+
+    def history(self, account=None, limit=100):
+        """直近の記録を DataFrame で返す。"""
+        query = "SELECT * FROM requests"
+        args = []
+        if account is not None:
+            query += " WHERE account = ?"
+            args.append(account)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            df = pd.read_sql_query(query, self.conn, params=args)
+        df["created_at"] = pd.to_datetime(df["created_at"], unit="s")
+        df["expires_at"] = pd.to_datetime(df["expires_at"], unit="s")
+        return df
 
 
 class SafeSession(requests.Session):
-    def __init__(self, cache_dir="/tmp", *args, **kwargs):
+    def __init__(self, ledger=None, rate_limiter=None, account="", *args, **kwargs):
         """
         SafeSessionの初期化。
 
-        :param cache_dir: キャッシュディレクトリのパス
+        :param ledger: 重複POSTを記録する RequestLedger (None の場合はデフォルトのパス)
+        :param rate_limiter: リクエスト間隔を制御する RateLimiter (None の場合はデフォルト設定)
+        :param account: 台帳に記録するアカウント名
         :param target_domains: キャッシュから除外するドメインのリスト
         :param methods_to_cache: キャッシュ対象とするHTTPメソッドのリスト
         """
         super().__init__(*args, **kwargs)
-        self.cache_dir = cache_dir
+        self.ledger = ledger or RequestLedger()
+        self.account = account
         self.target_domains = ["contact.auctions.yahoo.co.jp"]
         self.methods_to_cache = ['POST']
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policies = dict(RETRY_POLICIES)
+        self.idempotent_methods = ['GET', 'HEAD']
+        self.request_stats = RequestStats()
 
-        if not os.path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        # raise_for_status 等の後続フックより先にスロットリングを検知する
+        self.hooks['response'].append(self.rate_limiter.observe)
 
     def _is_target(self, url):
         """
@@ -101,32 +416,70 @@ class SafeSession(requests.Session):
         hash_input = url + params_str + data_str
         return hashlib.sha256(hash_input.encode('utf-8')).hexdigest()
 
+    def _send(self, method, url, request_hash, *args, **kwargs):
+        """
+        1回分の送信。リトライのたびにレート制限の予算を消費する。
+        request_hash が指定された場合は台帳で重複を確認してから送信する。
+        """
+        self.rate_limiter.acquire(method, url)
+        if request_hash is None:
+            return super().request(method, url, *args, **kwargs)
+
+        # 確認と登録を同時に行う
+        if not self.ledger.claim(request_hash, self.account, method, url):
+            raise Exception(f"Duplicate {method} request detected: {url} with params {kwargs.get('params')} and data {kwargs.get('data') or kwargs.get('json')}")
+
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.HTTPError:
+            # サーバーがエラーを返した場合は従来どおり再送を許可する
+            self.ledger.release(request_hash)
+            raise
+        except Exception as e:
+            if is_unsent_error(e):
+                self.ledger.release(request_hash)
+            else:
+                # 届いたか不明な場合は登録を残し、重複送信を防ぐ
+                logger.warning(f"送信結果が不明なため再送を禁止します: {method} {url} ({e})")
+            raise
+
+        # ステータスコードを台帳に記録
+        self.ledger.record(request_hash, response.status_code)
+        logger.info(f"Cached {method} request: {url.replace('https://','')}")
+        return response
+
     def request(self, method, url, *args, **kwargs):
         method_upper = method.upper()
+        policy = self.retry_policies.get(method_upper, self.retry_policies["POST"])
 
+        request_hash = None
         if method_upper in self.methods_to_cache and self._is_target(url):
-            params = kwargs.get('params')
-            data = kwargs.get('data')
-            json_data = kwargs.get('json')
+            request_hash = self._generate_hash(url, kwargs.get('params'), kwargs.get('data'), kwargs.get('json'))
 
-            # ハッシュ生成
-            request_hash = self._generate_hash(url, params, data, json_data)
-            cache_file = os.path.join(self.cache_dir, request_hash)
-
-            if os.path.exists(cache_file):
-                raise Exception(f"Duplicate {method_upper} request detected: {url} with params {params} and data {data or json_data}")
+        if method_upper in self.idempotent_methods:
+            should_retry = is_transient_error
+        elif request_hash is not None:
+            # 台帳上でサーバーに届いていないことが確認できた場合のみ再試行する
+            should_retry = lambda e: is_unsent_error(e) and self.ledger.get(request_hash) is None
+        else:
+            should_retry = is_unsent_error
 
-            # リクエストを実行
-            response = super().request(method, url, *args, **kwargs)
+        attempts = []
+        def on_retry(retry_state):
+            logger.warning(f"リトライ {retry_state.attempt_number}/{policy['max_attempts']}: {method_upper} {url} ({retry_state.outcome.exception()})")
 
-            # ハッシュをキャッシュに保存
-            with open(cache_file, 'w') as f:
-                f.write('processed')
-            logger.info(f"Cached {method_upper} request: {url.replace('https://','')}")
+        def attempt(*args, **kwargs):
+            attempts.append(1)
+            return self._send(method_upper, url, request_hash, *args, **kwargs)
 
+        started_at = time.monotonic()
+        ok = False
+        try:
+            response = retry_request(attempt, *args, policy=policy, should_retry=should_retry, on_retry=on_retry, **kwargs)
+            ok = True
             return response
-        else:
-            return retry_request(super().request, method, url, *args, **kwargs)
+        finally:
+            self.request_stats.record(RequestStats.endpoint(method_upper, url), len(attempts), time.monotonic() - started_at, ok)
 
 
 def initialize_logger(enable_stdout=True, log_file="auction.log"):
@@ -308,6 +661,28 @@ PREVIEW_TEMPLATE = {
 
 }
 
+LISTING_HEADERS = {
+    'accept': '*/*',
+    'accept-language': 'ja,en-US;q=0.9,en;q=0.8',
+    'cache-control': 'no-cache',
+    'origin': 'https://auctions.yahoo.co.jp',
+    'pragma': 'no-cache',
+    'priority': 'u=1, i',
+    'referer': 'https://auctions.yahoo.co.jp/sell/jp/show/submit',
+    'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+    'sec-ch-ua-arch': '"arm"',
+    'sec-ch-ua-full-version-list': '"Google Chrome";v="131.0.6778.71", "Chromium";v="131.0.6778.71", "Not_A Brand";v="24.0.0.0"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-model': '""',
+    'sec-ch-ua-platform': '"macOS"',
+    'sec-ch-ua-platform-version': '"15.1.1"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-origin',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+    'x-requested-with': 'XMLHttpRequest'
+}
+
 # def parse_cookie_string(cookie_string):
 #     """
 #     Parse a cookie string into a dictionary.
@@ -409,27 +784,156 @@ def serialize_cookies(cookies):
     ]
 
 
+class CookieStore:
+    """
+    アカウントごとのクッキー保存先 (cookies/{account}.json)。
+    変更はメモリ上でまとめ、最短 flush_interval 秒ごとと終了時にだけ書き出す (write-behind)。
+    書き出しは一時ファイルに書いてから置き換えるため、途中で落ちても壊れたファイルは残らない。
+
+    設定ファイル (auction_config.yml) の cookies は初回の読み込み元で、以降はこのファイルが優先される。
+    ファイルには元にした設定ファイルの cookies のダイジェストも保存し、
+    強制ログアウト後などに設定ファイルの cookies を貼り替えた場合は、そちらを読み込んでファイルを作り直す。
+    """
+
+    def __init__(self, account, directory="cookies", flush_interval=30):
+        """
+        :param account: アカウント名 (ファイル名に使う)
+        :param directory: 保存先ディレクトリ
+        :param flush_interval: 書き出しの最短間隔 (秒)
+        """
+        self.path = Path(directory) / f"{account}.json"
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = None
+        self._timer = None
+        self._last_flush = 0.0
+        self.num_updates = 0
+        self.num_flushes = 0
+        self.config_digest = None
+        atexit.register(self.flush)
+
+    @staticmethod
+    def digest(cookies_list):
+        """設定ファイルの cookies のダイジェスト (貼り替えの検知に使う)"""
+        data = json.dumps([dict(cookie) for cookie in cookies_list or []], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def load(self, config_cookies=None):
+        """
+        使用するクッキーを返す。
+        保存済みのファイルが同じ設定ファイルの cookies から作られたものならファイルを、
+        設定ファイルの cookies が変わっていれば (またはファイルがなければ) 設定ファイルの cookies を返す。
+
+        :param config_cookies: 設定ファイルの cookies
+        :return: クッキーのリスト (どちらもなければ None)
+        """
+        self.config_digest = self.digest(config_cookies) if config_cookies else None
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if isinstance(saved, list):
+                # ダイジェストを保存する前の形式 (次の書き出しで現在の設定ファイルのダイジェストを保存する)
+                logger.info(f"cookies: loaded {self.path} (legacy format)")
+                return saved
+            if not config_cookies or saved.get("config_digest") == self.config_digest:
+                logger.info(f"cookies: loaded {self.path}")
+                return saved["cookies"]
+            logger.info(f"cookies: config cookies changed, loaded from config file instead of {self.path}")
+        elif config_cookies:
+            logger.info(f"cookies: {self.path} not found, loaded from config file")
+        if not config_cookies:
+            return None
+        # 次の書き出しを待たず、設定ファイルの cookies でファイルを作り直す
+        self.update([dict(cookie) for cookie in config_cookies])
+        self.flush()
+        return config_cookies
+
+    def update(self, cookies_list):
+        """
+        クッキーの変更を記録し、書き出しを予約する。
+
+        :param cookies_list: serialize_cookies の戻り値
+        """
+        with self._lock:
+            self._pending = cookies_list
+            self.num_updates += 1
+            if self._timer is None:
+                delay = max(0.0, self._last_flush + self.flush_interval - time.monotonic())
+                timer = threading.Timer(delay, lambda: self._flush_on_timer(timer))
+                timer.daemon = True
+                self._timer = timer
+                timer.start()
+
+    def _flush_on_timer(self, timer):
+        """タイマーからの書き出し。cancel が間に合わずに動き出した古いタイマーは何もしない。"""
+        with self._lock:
+            if self._timer is timer:
+                self._flush()
+
+    def flush(self):
+        """未書き出しの変更があれば書き出す。"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"config_digest": self.config_digest, "cookies": pending}, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+        self._last_flush = time.monotonic()
+        self.num_flushes += 1
+
+
 FILE_REGEX=r".+/[a-z]+_[0-9a-f]{6}\.jpg$"
+ITEMS_ROOT = "data/items"
 
-def get_original_files(pattern="data/items/*/*.jpg"):
-    """元画像のみを取得し、更新日時が早い順にソート"""
+def get_original_files(pattern="data/items/*/*.jpg", root=None):
+    """
+    元画像のみを取得し、更新日時が早い順にソート
+    :param pattern: glob するパターン (root を指定した場合は使わない)
+    :param root: 指定した場合は glob せず、このルートの InventoryIndex から取得する
+    """
+    if root is not None:
+        return [record["path"] for record in get_inventory(root).query()]
     files = glob.glob(pattern)
     original_files = [file for file in files if re.match(FILE_REGEX, file)]
     # 更新日時でソート
     return sorted(original_files, key=os.path.getmtime, reverse=True)
 
 
-def get_original_files_with_tags(tags, base_pattern="data/items/{}/*.jpg", suffix="sample", drop_missing=False):
+def get_original_files_with_tags(tags, base_pattern="data/items/{}/*.jpg", suffix="sample", drop_missing=False, root=None):
     """
     元画像のみを取得し、更新日時が早い順にソート
     :param tags: マッチさせたいタグのリスト (例: ["a", "b"])
     :param base_pattern: ベースとなるパターン (デフォルトは "data/items/{}/**/*.jpg")
     :param drop_missing: Trueの場合、存在しないファイルやパスを除外する
+    :param root: 指定した場合は base_pattern を使わず、このルートの InventoryIndex から取得する
     """
+    assert isinstance(tags, list), f"tags must be a list, got {type(tags).__name__}: {tags}"
+    if root is not None:
+        base_pattern = os.path.join(root, "{}", "*.jpg")
+    # 返すパスは常に {元画像}_{suffix}.jpg。索引が同じファイルの有無を記録している派生 (sample, submission) だけ
+    # 索引で判定し、それ以外 (label の索引は _label.png を記録している) は従来どおり glob する
+    if root is not None and InventoryIndex.VARIANTS.get(suffix) == f"_{suffix}.jpg":
+        inventory = get_inventory(root)
+        records = inventory.query(tags)
+        file_paths = [inventory.variant_path(record, suffix) for record in records]
+        missing_paths = [path for record, path in zip(records, file_paths) if not record[f"has_{suffix}"]]
+        if drop_missing:
+            return [path for record, path in zip(records, file_paths) if record[f"has_{suffix}"]]
+        assert not missing_paths, f"The following paths do not exist: {missing_paths}"
+        return file_paths
+
     if suffix != "":
         suffix = f"_{suffix}"
 
-    assert isinstance(tags, list), f"tags must be a list, got {type(tags).__name__}: {tags}"
     files = []
     for tag in tags:
         # 各タグごとにパターンを生成してマッチするファイルを取得
@@ -466,34 +970,315 @@ def get_hash(file_path):
         extracted = match.group()
         return extracted
 
+class InventoryIndex:
+    """
+    data/items 以下の画像の索引 (SQLite, WALモード)。
+    タグディレクトリ内の元画像ごとに更新日時・派生ファイル (label/sample/submission) の有無を保持する。
+    同じハッシュが複数のタグにある場合はタグごとに別の行になる。
+    タグディレクトリの更新日時が変わったディレクトリだけを読み直すため、毎回 glob する必要がない。
+    """
+
+    VARIANTS = {
+        "label": "_label.png",
+        "sample": "_sample.jpg",
+        "submission": "_submission.jpg",
+    }
+
+    # items の主キーを (tag, hash) に変えたときに 2 にした。古い索引は作り直す
+    SCHEMA_VERSION = 2
+
+    def __init__(self, root=ITEMS_ROOT, db_path=None):
+        """
+        :param root: タグごとのディレクトリを含むルート
+        :param db_path: SQLite ファイルのパス (None の場合はルートごとに {root}/.inventory.db)
+        """
+        self.root = root
+        if db_path is None:
+            os.makedirs(root, exist_ok=True)
+            db_path = os.path.join(root, ".inventory.db")
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            # 索引はファイルから作り直せるため、スキーマが違う場合は捨てる
+            self.conn.execute("DROP TABLE IF EXISTS items")
+            self.conn.execute("DROP TABLE IF EXISTS dirs")
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                hash TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                has_label INTEGER NOT NULL,
+                has_sample INTEGER NOT NULL,
+                has_submission INTEGER NOT NULL,
+                PRIMARY KEY (tag, hash)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                tag TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_items_tag ON items (tag, mtime)")
+
+    def refresh(self, force=False):
+        """
+        ディレクトリの更新日時を比較し、ファイルの追加・削除・改名があったタグだけを読み直す。
+
+        :param force: True の場合、すべてのタグを読み直す
+        :return: 読み直したタグのリスト
+        """
+        with self._lock:
+            known = dict(self.conn.execute("SELECT tag, mtime_ns FROM dirs").fetchall())
+            current = {}
+            if os.path.isdir(self.root):
+                for entry in os.scandir(self.root):
+                    if entry.is_dir():
+                        current[entry.name] = entry.stat().st_mtime_ns
+
+            rescanned = []
+            for tag, mtime_ns in current.items():
+                if force or known.get(tag) != mtime_ns:
+                    self._scan_tag(tag, mtime_ns)
+                    rescanned.append(tag)
+            for tag in known.keys() - current.keys():
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.execute("DELETE FROM items WHERE tag = ?", (tag,))
+                    self.conn.execute("DELETE FROM dirs WHERE tag = ?", (tag,))
+        return rescanned
+
+    def _scan_tag(self, tag, mtime_ns):
+        directory = os.path.join(self.root, tag)
+        entries = {entry.name: entry for entry in os.scandir(directory) if entry.is_file()}
+        rows = []
+        for name, entry in entries.items():
+            match = re.fullmatch(r"([a-z]+_[0-9a-f]{6})\.jpg", name)
+            if not match:
+                continue
+            h = match.group(1)
+            rows.append((
+                h, tag, os.path.join(directory, name), entry.stat().st_mtime,
+                *(int(f"{h}{ext}" in entries) for ext in self.VARIANTS.values())
+            ))
+        # 同じ秒の中で続けて更新されると更新日時が変わらないことがあるため、直近に更新されたディレクトリは次回も読み直す
+        if time.time_ns() - mtime_ns < 2 * 10**9:
+            mtime_ns = -1
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM items WHERE tag = ?", (tag,))
+            self.conn.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("""
+                INSERT INTO dirs (tag, mtime_ns) VALUES (?, ?)
+                ON CONFLICT(tag) DO UPDATE SET mtime_ns = excluded.mtime_ns
+            """, (tag, mtime_ns))
+
+    def query(self, tags=None, variant=None, exclude=None):
+        """
+        条件に合う元画像を新しい順に返す。
+
+        例: 未出品・未購入で submission がある画像
+            index.query(["a", "b"], variant="submission", exclude=get_purchased() | get_listed())
+
+        :param tags: 対象のタグのリスト (None の場合はすべて)
+        :param variant: 指定した派生ファイル ("label", "sample", "submission") があるものに限る
+        :param exclude: 除外するハッシュの集合
+        :return: {"hash", "tag", "path", "mtime", "has_label", "has_sample", "has_submission"} のリスト
+        """
+        self.refresh()
+        sql = "SELECT hash, tag, path, mtime, has_label, has_sample, has_submission FROM items"
+        conditions, params = [], []
+        if tags is not None:
+            conditions.append(f"tag IN ({','.join('?' * len(tags))})")
+            params.extend(tags)
+        if variant is not None:
+            assert variant in self.VARIANTS, f"unknown variant: {variant}"
+            conditions.append(f"has_{variant} = 1")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY mtime DESC"
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        exclude = exclude or set()
+        columns = ("hash", "tag", "path", "mtime", "has_label", "has_sample", "has_submission")
+        return [dict(zip(columns, row)) for row in rows if row[0] not in exclude]
+
+    def variant_path(self, record, variant):
+        """元画像の記録から派生ファイルのパスを返す。"""
+        return record["path"][:-len(".jpg")] + self.VARIANTS[variant]
+
+
+_inventories = {}
+
+def get_inventory(root=ITEMS_ROOT):
+    """ルートごとに共有される InventoryIndex を返す。"""
+    key = os.path.abspath(root)
+    if key not in _inventories:
+        _inventories[key] = InventoryIndex(root)
+    return _inventories[key]
+
+
 def get_purchased():
-    # JSONファイルが保存されているディレクトリ
-    directory = "./print_qr/"
-    
-    # ユニークなファイルリストを保持するセット
-    unique_files = set()
-    
-    # ディレクトリ内のすべてのJSONファイルを処理
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".json"):  # JSONファイルのみを対象
-            file_path = os.path.join(directory, file_name)
+    """ネットプリントに登録済み (購入済み) の画像のハッシュを返す。"""
+    return get_purchase_ledger().hashes()
+
+class HashJournal:
+    """
+    出品済みハッシュの追記型ジャーナル。
+    1行1ハッシュで追記し ("-" で始まる行は削除)、メモリ上の集合で O(1) の判定を行う。
+    他のプロセスが追記した分はファイルの末尾だけを読み込んで反映する。
+    """
+
+    def __init__(self, path="processed_hashes.txt", fsync=True, compact_ratio=2.0):
+        """
+        :param path: ジャーナルファイルのパス (従来の processed_hashes.txt と同じ形式)
+        :param fsync: Trueの場合、追記のたびに fsync する
+        :param compact_ratio: ジャーナルの行数が集合の要素数のこの倍率を超えたら圧縮する
+        """
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self.hashes = set()
+        self._num_lines = 0
+        self._offset = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self.path.touch(exist_ok=True)
+
+    def _apply(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("-"):
+                self.hashes.discard(line[1:])
+            else:
+                self.hashes.add(line)
+            self._num_lines += 1
+
+    def _refresh(self):
+        """ファイルの変更分を読み込む。"""
+        if self._file is not None:
+            stat = self.path.stat()
+            if stat.st_ino == os.fstat(self._file.fileno()).st_ino and stat.st_size == self._offset:
+                return
+        # 書き込み中の行を読まないよう共有ロックを取る
+        with self._file_lock(fcntl.LOCK_SH):
+            self._read_changes()
+
+    def _read_changes(self):
+        """
+        ファイルの変更分を読み込む (ファイルロックを取得して呼ぶ)。圧縮などで置き換えられていれば全体を読み直す。
+        読んでいるファイルは開いたままにしておくため、置き換え後のファイルに同じ inode 番号が再利用されることはない。
+        """
+        stat = self.path.stat()
+        if self._file is None or stat.st_ino != os.fstat(self._file.fileno()).st_ino or stat.st_size < self._offset:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, "rb")
+            self.hashes = set()
+            self._num_lines = 0
+            self._offset = 0
+        self._file.seek(self._offset)
+        data = self._file.read()
+        self._apply(data.decode("utf-8").splitlines())
+        self._offset += len(data)
+
+    @contextlib.contextmanager
+    def _file_lock(self, operation):
+        """
+        プロセス間のロック。圧縮でファイルが置き換わっても有効なよう、別のロックファイルを使う。
+        """
+        with open(self.lock_path, "w") as f:
+            fcntl.flock(f, operation)
             try:
-                with open(file_path, "r") as f:
-                    data = json.load(f)
-                    if "files" in data:
-                        unique_files.update(data["files"])  # filesをセットに追加
-            except (json.JSONDecodeError, KeyError):
-                pass
-                # print(f"JSONエラーまたはキーエラー: {file_path}")
-    
-    unique_files = [get_hash(i) for i in unique_files if get_hash(i)]
-    # ユニークなファイルリストをソートして出力
-    unique_files = sorted(unique_files)
-    return set(unique_files)
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append(self, line):
+        with self._file_lock(fcntl.LOCK_EX), open(self.path, "ab+") as f:
+            # 従来形式のファイルは末尾に改行がないため補う
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(f"{line}\n".encode("utf-8"))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def __contains__(self, _hash):
+        with self._lock:
+            self._refresh()
+            return _hash in self.hashes
+
+    def snapshot(self):
+        """現在のハッシュ集合のコピーを返す。"""
+        with self._lock:
+            self._refresh()
+            return set(self.hashes)
+
+    def add(self, _hash):
+        with self._lock:
+            self._refresh()
+            if _hash in self.hashes:
+                return
+            self._append(_hash)
+            self._refresh()
+            self._maybe_compact()
+
+    def discard(self, _hash):
+        with self._lock:
+            self._refresh()
+            if _hash not in self.hashes:
+                return
+            self._append(f"-{_hash}")
+            self._refresh()
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._num_lines > max(100, len(self.hashes) * self.compact_ratio):
+            self._compact()
+
+    def compact(self):
+        """ジャーナルを現在の集合だけの内容に書き直す (一時ファイルに書いてから置き換える)。"""
+        with self._lock:
+            self._refresh()
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._file_lock(fcntl.LOCK_EX):
+            # ロック取得までに他のプロセスが追記・圧縮した分を反映する
+            self._read_changes()
+            with open(tmp_path, "wb") as f:
+                f.write("".join(f"{h}\n" for h in sorted(self.hashes)).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        self._refresh()
+
+
+_hash_journals = {}
+
+def get_hash_journal(processed_file="processed_hashes.txt"):
+    """パスごとに共有される HashJournal を返す。"""
+    key = os.path.abspath(processed_file)
+    if key not in _hash_journals:
+        _hash_journals[key] = HashJournal(processed_file)
+    return _hash_journals[key]
+
 
 def get_listed(processed_file="processed_hashes.txt"):
-    hash_file_path = Path(processed_file)
-    return set(hash_file_path.read_text(encoding="utf-8").splitlines()) if hash_file_path.exists() else set()    
+    return get_hash_journal(processed_file).snapshot()
 
 def get_file_exclude(file_paths, processed_hashes=None):
     if processed_hashes is None:
@@ -557,17 +1342,13 @@ def convert_to_div_based_html(description):
     return "".join(html_lines)
 
 def remove(id_to_remove, hash_file_path="processed_hashes.txt"):
-    # ファイルから現在のハッシュセットを読み込む
-    processed_hashes = set(hash_file_path.read_text(encoding="utf-8").splitlines()) if hash_file_path.exists() else set()
+    journal = get_hash_journal(hash_file_path)
     
     # 指定されたIDがセットに含まれるかを確認
-    assert id_to_remove in processed_hashes, f"{id_to_remove} is not in processed_hashes"
-    
-    # IDをセットから削除
-    processed_hashes.remove(id_to_remove)
+    assert id_to_remove in journal, f"{id_to_remove} is not in processed_hashes"
     
-    # ファイルに更新後のハッシュセットを書き込む
-    hash_file_path.write_text("\n".join(processed_hashes), encoding="utf-8")
+    # 削除をジャーナルに追記
+    journal.discard(id_to_remove)
     
     print(f"{id_to_remove} was successfully removed.")
 
@@ -575,6 +1356,16 @@ def remove(id_to_remove, hash_file_path="processed_hashes.txt"):
 # remove("a_fbcecf")
 
 
+def extract_auction_ids(text):
+    """
+    メール本文からオークションIDを抽出する。
+    取引ナビのURL (aid=...) と「オークションID：...」の両方に対応する。
+    """
+    ids = re.findall(r'[?&]aid=([a-z]?\d+)', text)
+    ids += re.findall(r'オークションID\s*[：:]\s*([a-z]?\d+)', text)
+    return list(dict.fromkeys(ids))
+
+
 productname_to_imgid = lambda x: re.search(r'[a-z]+_[a-z0-9]{6}', x).group() if re.search(r'[a-z]+_[a-z0-9]{6}', x) else None
 
 # def get_table(cookies, url, index_col=0, table_class='ItemTable', referer='https://auctions.yahoo.co.jp/user/jp/show/mystatus',):
@@ -681,13 +1472,6 @@ def cache_to_csv(cache_dir="./cache"):
     return decorator
 
 
-def hash_url(url: str) -> str:
-    return hashlib.md5(url.encode('utf-8')).hexdigest()
-
-def cache_path(url: str) -> Path:
-    hashed_url = hash_url(url)
-    return Path(f"./cache/{hashed_url}.json")
-
 def parse_status_from_class(class_name: str) -> TransactionStatus:
     if "current04" in class_name:
         return TransactionStatus.RECEIPT
@@ -699,34 +1483,187 @@ def parse_status_from_class(class_name: str) -> TransactionStatus:
         return TransactionStatus.INITIATED
 
 
+# ステータスごとのキャッシュ有効期間 (秒)。None は無期限
+STATUS_CACHE_TTL = {
+    TransactionStatus.RECEIPT: None,   # 受取連絡済みはこれ以上変化しない
+    TransactionStatus.INITIATED: 60,
+    TransactionStatus.PAYMENT: 60,
+    TransactionStatus.SHIPPING: 0,     # 発送時に最新の crumb が必要なため毎回取得する
+}
+
+
+class TradeStatusStore:
+    """
+    取引ステータスの保存先 (SQLite, WALモード)。
+    ステータス・まとめ取引かどうか・フォームの値・まとめ承認URLを取引ナビURLごとに保持し、
+    ステータスが変化したときだけ書き込んで履歴に残す (フォームの値だけが変わった場合は値だけを書き換える)。
+
+    最終確認日時 (checked_at) は確認のたびに書き込まないようメモリ上だけで保持する。
+    再起動後は最後に書き込んだ日時 (updated_at) を最終確認日時とみなすため、
+    有効期間の判定は実際より古い記録として扱われ、早めに取得し直す側に倒れる。
+    """
+
+    def __init__(self, db_path="trade_status.db"):
+        """
+        :param db_path: SQLite ファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 最終確認日時はキャッシュの有効期限判定にのみ使うため、メモリ上で保持する
+        self._checked_at = {}
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS trade_status (
+                navi TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                is_matome INTEGER NOT NULL,
+                form_values TEXT,
+                matome_accept_url TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS trade_status_history (
+                navi TEXT NOT NULL,
+                status TEXT NOT NULL,
+                is_matome INTEGER NOT NULL,
+                matome_accept_url TEXT,
+                changed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_status_status ON trade_status (status, updated_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_status_history_navi ON trade_status_history (navi, changed_at)")
+
+    def get_many(self, navi_urls, chunk_size=500):
+        """
+        複数の取引ナビURLの記録をまとめて読み込む。
+
+        :return: {navi: {"status", "is_matome", "values", "matome_accept_url", "updated_at", "checked_at"}}
+        """
+        navi_urls = list(navi_urls)
+        records = {}
+        with self._lock:
+            for i in range(0, len(navi_urls), chunk_size):
+                chunk = navi_urls[i:i + chunk_size]
+                rows = self.conn.execute(
+                    "SELECT navi, status, is_matome, form_values, matome_accept_url, updated_at FROM trade_status "
+                    f"WHERE navi IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for navi, status, is_matome, form_values, matome_accept_url, updated_at in rows:
+                    records[navi] = {
+                        "status": TransactionStatus[status],
+                        "is_matome": bool(is_matome),
+                        "values": json.loads(form_values) if form_values else {},
+                        "matome_accept_url": matome_accept_url,
+                        "updated_at": updated_at,
+                        "checked_at": self._checked_at.get(navi, updated_at),
+                    }
+        return records
+
+    def get(self, navi):
+        return self.get_many([navi]).get(navi)
+
+    def put(self, navi, status, is_matome, values, matome_accept_url):
+        """
+        取得結果を記録する。ステータス・まとめ取引・まとめ承認URLのいずれかが変化した場合は書き込んで履歴に残す。
+        フォームの値 (crumb など) だけが変化した場合は、履歴と updated_at はそのままで値だけを書き換える。
+
+        :return: 書き込んだ場合 True
+        """
+        now = time.time()
+        form_values = json.dumps(values, ensure_ascii=False)
+        with self._lock:
+            self._checked_at[navi] = now
+            row = self.conn.execute(
+                "SELECT status, is_matome, matome_accept_url, form_values FROM trade_status WHERE navi = ?", (navi,)
+            ).fetchone()
+            if row is not None and row[:3] == (status.name, int(is_matome), matome_accept_url):
+                if row[3] == form_values:
+                    return False
+                self.conn.execute("UPDATE trade_status SET form_values = ? WHERE navi = ?", (form_values, navi))
+                return True
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.execute("""
+                    INSERT INTO trade_status (navi, status, is_matome, form_values, matome_accept_url, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(navi) DO UPDATE SET
+                        status = excluded.status,
+                        is_matome = excluded.is_matome,
+                        form_values = excluded.form_values,
+                        matome_accept_url = excluded.matome_accept_url,
+                        updated_at = excluded.updated_at
+                """, (navi, status.name, int(is_matome), form_values, matome_accept_url, now))
+                self.conn.execute(
+                    "INSERT INTO trade_status_history (navi, status, is_matome, matome_accept_url, changed_at) VALUES (?, ?, ?, ?, ?)",
+                    (navi, status.name, int(is_matome), matome_accept_url, now)
+                )
+        return True
+
+    def history(self, navi):
+        """指定した取引のステータス変化の履歴を DataFrame で返す。"""
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT * FROM trade_status_history WHERE navi = ? ORDER BY changed_at", self.conn, params=[navi]
+            )
+        df["changed_at"] = pd.to_datetime(df["changed_at"], unit="s")
+        return df
+
+    def stuck(self, status, older_than=timedelta(days=3)):
+        """
+        指定したステータスのまま一定期間以上変化していない取引を返す。
+
+        例: store.stuck(TransactionStatus.PAYMENT, timedelta(days=3))
+        """
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT navi, status, is_matome, matome_accept_url, updated_at FROM trade_status "
+                "WHERE status = ? AND updated_at < ? ORDER BY updated_at",
+                self.conn, params=[status.name, time.time() - older_than.total_seconds()]
+            )
+        df["updated_at"] = pd.to_datetime(df["updated_at"], unit="s")
+        return df
+
+
+def is_status_fresh(record, ttl=None):
+    """
+    TradeStatusStore の記録がステータスごとの有効期間内かを判定する。
+    (再起動後は checked_at が updated_at になるため、実際より古い記録として判定される)
+
+    :param record: TradeStatusStore.get_many の値 (None 可)
+    :param ttl: STATUS_CACHE_TTL を上書きするステータスごとの有効期間
+    """
+    if record is None:
+        return False
+    max_age = {**STATUS_CACHE_TTL, **(ttl or {})}.get(record["status"], 0)
+    return max_age is None or time.time() - record["checked_at"] < max_age
+
+
 def cache_status(func):
     @functools.wraps(func)
-    def wrapper(cookies, url, *args, **kwargs):
-        cache_file = cache_path(url)
-        
+    def wrapper(self, url, *args, refresh=False, ttl=None, **kwargs):
+        """
+        :param refresh: Trueの場合、キャッシュを使わずに取得する
+        :param ttl: STATUS_CACHE_TTL を上書きするステータスごとの有効期間
+        """
         # Check for cached result
-        if cache_file.exists():
-            with open(cache_file, 'r') as f:
-                cached_data = json.load(f)
-            if cached_data['status'] == TransactionStatus.RECEIPT.name:
+        if not refresh:
+            record = self.status_store.get(url)
+            if is_status_fresh(record, ttl):
                 return (
-                    TransactionStatus[cached_data['status']],
-                    cached_data['is_matome'],
-                    cached_data['values'],
-                    cached_data['matome_accept_url'],
+                    record['status'],
+                    record['is_matome'],
+                    record['values'],
+                    record['matome_accept_url'],
                 )
         
         # Call the original function
-        result = func(cookies, url, *args, **kwargs)
+        result = func(self, url, *args, **kwargs)
         
-        # Cache the result
-        with open(cache_file, 'w') as f:
-            json.dump({
-                "status": result[0].name,
-                "is_matome": result[1],
-                "values": result[2],
-                "matome_accept_url": result[3],
-            }, f)
+        # Cache the result (ステータスが変化した場合のみ書き込まれる)
+        self.status_store.put(url, *result)
         
         return result
     
@@ -784,6 +1721,185 @@ def extract_input_values_with_parent_form(soup):
 
 
 
+def find_next_apg(links, apg=None):
+    """リンク (href) の一覧から現在のページより後の最初の apg を返す。"""
+    for href in links:
+        match = re.search(r'apg=(\d+)', href)
+        if match:
+            next_page = int(match.group(1))
+            if apg is None or next_page > apg:
+                return next_page
+    return None
+
+
+def find_last_apg(links):
+    """ページャーのリンク (href) の一覧から最大の apg を返す。"""
+    pages = [int(match.group(1)) for href in links for match in [re.search(r'apg=(\d+)', href)] if match]
+    return max(pages) if pages else None
+
+
+def _cell_text(cell):
+    # pd.read_html と同じ空白の正規化
+    return re.sub(r"[\r\n]+|\s{2,}", " ", "".join(cell.itertext())).strip()
+
+
+def _dedup_columns(columns):
+    """重複した列名を pd.read_html と同じく「列名.1」「列名.2」... に付け替える。"""
+    used = set(columns)
+    counts = Counter()
+    names = []
+    for column in columns:
+        name = column
+        if name in names:
+            # 元から存在する列名とも重ならない番号を付ける
+            while name in used:
+                counts[column] += 1
+                name = f"{column}.{counts[column]}"
+            used.add(name)
+        names.append(name)
+    return names
+
+
+def _parse_price(text):
+    if not isinstance(text, str):
+        return None
+    text = text.replace(",", "").replace("円", "").strip()
+    return int(text) if text else None
+
+
+def parse_item_table(text, apg=None, table_class="ItemTable", return_last_apg=False):
+    """
+    マイオークションのページを lxml で1回だけ解析し、テーブルのDataFrameと次のapgを返す。
+    行を1度だけ走査し、型変換済みの列を直接組み立てる。
+
+    :param text: ページのHTML
+    :param apg: 現在のページ番号
+    :param table_class: 取得するテーブルのクラス名
+    :param return_last_apg: Trueの場合、ページャーから読み取った最終ページのapgも返す
+    :return: DataFrameと次のapg（存在しない場合はNone）
+    """
+    dom = etree.HTML(text.encode("utf-8"), parser=etree.HTMLParser(encoding="utf-8"))
+    if dom is None:
+        return (None, None, None) if return_last_apg else (None, None)
+
+    # 次のページのapgを探す
+    links = dom.xpath("//a/@href")
+    next_apg = find_next_apg(links, apg)
+    last_apg = find_last_apg(links)
+    empty = (None, next_apg, last_apg) if return_last_apg else (None, next_apg)
+
+    # テーブルを取得
+    tables = dom.xpath(f"//table[contains(concat(' ', normalize-space(@class), ' '), ' {table_class} ')]")
+    if not tables:
+        return empty
+    rows = tables[0].xpath("./tr | ./thead/tr | ./tbody/tr | ./tfoot/tr")
+    if not rows:
+        return empty
+
+    columns = _dedup_columns([_cell_text(cell) for cell in rows[0].xpath("./th | ./td")])
+    current_year = datetime.now().year
+    records = []
+    for row in rows[1:]:
+        cells = row.xpath("./th | ./td")
+        if not cells:
+            continue
+        texts = [_cell_text(cell) for cell in cells]
+        hrefs = [next(iter(cell.xpath(".//a/@href")), None) for cell in cells]
+        # 足りないセルは pd.read_html と同じく NaN にする
+        cell_map = {column: (texts[i], hrefs[i]) if i < len(cells) else (math.nan, None) for i, column in enumerate(columns)}
+
+        record = {column: value for column, (value, _) in cell_map.items()}
+        if "商品名" in cell_map and not isinstance(record["商品名"], str): record["商品名"] = None
+        if "現在価格" in cell_map: record["現在価格"] = _parse_price(cell_map["現在価格"][0])
+        if "最高落札価格" in cell_map: record["最高落札価格"] = _parse_price(cell_map["最高落札価格"][0])
+        if "終了日時" in cell_map:
+            end_text = cell_map["終了日時"][0]
+            record["終了日時"] = datetime.strptime(f"{current_year}年{end_text}", "%Y年%m月%d日 %H時%M分") if isinstance(end_text, str) and end_text else None
+        if "落札者" in cell_map:
+            winner_href = cell_map["落札者"][1]
+            record["落札者"] = winner_href.split("userID=")[-1] if winner_href else None
+        record["imgid"] = productname_to_imgid(record.get("商品名") or "")
+        record["imgids"] = [record["imgid"]] if record["imgid"] else []
+        if "最新のメッセージ" in cell_map:
+            record["navi"] = cell_map["最新のメッセージ"][1]
+            if not isinstance(record["最新のメッセージ"], str): record["最新のメッセージ"] = None
+        records.append(record)
+
+    if not records:
+        return empty
+    if return_last_apg:
+        return pd.DataFrame(records), next_apg, last_apg
+    return pd.DataFrame(records), next_apg
+
+
+def parse_item_table_legacy(text, apg=None, index_col=0, table_class="ItemTable"):
+    """従来の BeautifulSoup + pd.read_html による解析 (parse_item_table との比較用)"""
+    soup = BeautifulSoup(text, 'html.parser')
+
+    # 次のページのapgを探す
+    next_apg = None
+    for a_tag in soup.find_all('a', href=True):
+        match = re.search(r'apg=(\d+)', a_tag['href'])
+        if match:
+            next_page = int(match.group(1))
+            if apg is None or next_page > apg:
+                next_apg = next_page
+                break
+
+    # テーブルを取得
+    try:
+        tables = pd.read_html(StringIO(text), attrs={'class': table_class}, flavor='bs4', extract_links="body", index_col=index_col, header=0)
+    except ValueError:
+        return None, next_apg
+
+    df_tmp = tables[0].dropna(how="all")
+    df_tmp = df_tmp.reset_index()
+
+    # DataFrameを辞書形式に変換
+    data = df_tmp.to_dict(orient="records")
+    
+    df_tmp = pd.DataFrame([{key[0]: value for key, value in record.items()} for record in data])
+    current_year = datetime.now().year
+    
+    # 列ごとの整形処理
+    df_tmp['商品ID'] = df_tmp['商品ID'].apply(lambda x: x[0][0] if isinstance(x, tuple) and isinstance(x[0], tuple) else x[0])
+    df_tmp['商品名'] = df_tmp['商品名'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
+    df_tmp['imgid'] = df_tmp['商品名'].apply(productname_to_imgid)
+    df_tmp['imgids'] = df_tmp['imgid'].apply(lambda x: [x] if x else [])
+    if "ウォッチリスト" in df_tmp: df_tmp['ウォッチリスト'] = df_tmp['ウォッチリスト'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
+    if "現在価格" in df_tmp: df_tmp['現在価格'] = df_tmp['現在価格'].apply(lambda x: int(x[0].replace(" 円", "")) if isinstance(x, tuple) and x[0] else None)
+    if "最高落札価格" in df_tmp: df_tmp['最高落札価格'] = df_tmp['最高落札価格'].apply(lambda x: int(x[0].replace(" 円", "")) if isinstance(x, tuple) and x[0] else None)
+    if "終了日時" in df_tmp: df_tmp['終了日時'] = df_tmp['終了日時'].apply(lambda x: datetime.strptime(f"{current_year}年{x[0]}", "%Y年%m月%d日 %H時%M分") if isinstance(x, tuple) and x[0] else None)
+    if "落札者" in df_tmp: df_tmp['落札者'] = df_tmp['落札者'].apply(lambda x: x[1].split("userID=")[-1] if isinstance(x, tuple) and x[1] else None)
+    if "最新のメッセージ" in df_tmp: df_tmp['navi'] = df_tmp['最新のメッセージ'].apply(lambda x: x[1] if isinstance(x, tuple) else None)
+    if "最新のメッセージ" in df_tmp: df_tmp['最新のメッセージ'] = df_tmp['最新のメッセージ'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
+    
+    return df_tmp, next_apg
+
+
+def compare_item_table_parsers(text, apg=None):
+    """
+    保存したHTMLに対して新旧の解析結果を比較し、一致しない列名のリストを返す。
+
+    :param text: マイオークションのページのHTML
+    :param apg: 現在のページ番号
+    """
+    df_new, next_new = parse_item_table(text, apg=apg)
+    df_old, next_old = parse_item_table_legacy(text, apg=apg)
+    assert next_new == next_old, f"次のapgが一致しません: {next_new} != {next_old}"
+    if df_new is None or df_old is None:
+        assert df_new is None and df_old is None, "片方のみテーブルが見つかりました"
+        return []
+    columns = ["商品ID", "商品名", "imgid", "imgids", "現在価格", "最高落札価格", "終了日時", "落札者", "navi", "最新のメッセージ"]
+    mismatched = []
+    for column in columns:
+        if column not in df_old and column not in df_new:
+            continue
+        if column not in df_old or column not in df_new or df_old[column].tolist() != df_new[column].tolist():
+            mismatched.append(column)
+    return mismatched
+
+
 def display_images_in_single_row(files):
     """
     画像を1行1枚ずつJupyter Notebook上に表示する。
@@ -814,21 +1930,113 @@ def display_images_in_single_row(files):
 
 from urllib.parse import urlparse
 
+class ListingSession:
+    """
+    複数件の出品をまとめて行うためのセッション。
+    - 説明文を含むプレビューのフォーム値は1回だけ組み立てる
+    - reuse_static: 共通の添付画像 (サイズ表など) を一定時間ごとに1回だけアップロードして使い回す
+    - prefetch: 出品プレビュー・出品の通信中に、次の商品のフォーム取得と画像アップロードを先行して行う
+
+    reuse_static と prefetch は、別の img_crumb でアップロードした画像や、
+    次の出品フォームを開いた後の出品中のフォーム・crumb が有効なままかを実際の出品で確認できるまで既定では無効にする。
+    アカウントの設定 (auction_config.yml) の listing_session で有効にできる。
+    """
+
+    def __init__(self, trade, static_files=("material/size.jpg",), static_ttl=3600, reuse_static=False, prefetch=False):
+        """
+        :param trade: YahooAuctionTrade
+        :param static_files: 全商品に共通で添付する画像のパス
+        :param static_ttl: 共通画像を再アップロードするまでの秒数 (reuse_static の場合)
+        :param reuse_static: True の場合、共通画像のアップロード結果を static_ttl 秒の間使い回す
+        :param prefetch: True の場合、現在の商品の出品中に次の商品の prepare_listing を実行する
+        """
+        self.trade = trade
+        self.static_files = list(static_files)
+        self.static_ttl = static_ttl
+        self.reuse_static = reuse_static
+        self.prefetch = prefetch
+        self._static_images = None
+        self._static_uploaded_at = 0.0
+        self._static_lock = threading.Lock()
+        self.preview_base = PREVIEW_TEMPLATE.copy()
+        self.preview_base.update({
+            'Description': trade.description_rte,
+            'Description_rte': trade.description_rte,
+        })
+
+    def get_static_images(self, headers, img_crumb):
+        """共通画像のアップロード結果を返す。reuse_static の場合は期限切れの場合のみアップロードし直す。"""
+        if not self.reuse_static:
+            return [self.trade.post_img(path, headers, img_crumb).json()["images"][0] for path in self.static_files]
+        with self._static_lock:
+            if self._static_images is None or time.monotonic() - self._static_uploaded_at > self.static_ttl:
+                self._static_images = [
+                    self.trade.post_img(path, headers, img_crumb).json()["images"][0] for path in self.static_files
+                ]
+                self._static_uploaded_at = time.monotonic()
+            return self._static_images
+
+    def listing_many(self, configs):
+        """
+        get_listing_config の結果を順に出品し、(config, 結果) を出品のたびに返すジェネレータ。
+        prefetch の場合、次の商品の prepare_listing は現在の商品の submit_listing と並行して実行する。
+        """
+        submit_keys = ["duration", "closing_hour", "start_price", "end_price"]
+        configs = list(configs)
+        if not configs:
+            return
+
+        if not self.prefetch:
+            for config in configs:
+                prepared = self.trade.prepare_listing(config["file_path"], config.get("category", 2084047414), self)
+                kwargs = {k: config[k] for k in submit_keys if k in config}
+                yield config, self.trade.submit_listing(prepared, config["title_name"], listing_session=self, **kwargs)
+            return
+
+        def prepare(config):
+            return executor.submit(self.trade.prepare_listing, config["file_path"], config.get("category", 2084047414), self)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_prepared = prepare(configs[0])
+            try:
+                for i, config in enumerate(configs):
+                    prepared = next_prepared.result()
+                    if i + 1 < len(configs):
+                        next_prepared = prepare(configs[i + 1])
+                    kwargs = {k: config[k] for k in submit_keys if k in config}
+                    result = self.trade.submit_listing(prepared, config["title_name"], listing_session=self, **kwargs)
+                    yield config, result
+            finally:
+                next_prepared.cancel()
+
+
 class YahooAuctionTrade:
     def __init__(self, account, config_file="auction_config.yml"):
         self.config_file = config_file
         self.__config, self.__yaml = load_config(self.config_file)
         self.__account = account
         self.account_config = self.__config["accounts"][account]
-        initial_cookies = parse_cookie_string(self.account_config["cookies"])
+        # クッキーはアカウントごとのファイルに保存する (未保存か設定ファイルの cookies が変わった場合は設定ファイルの値を使う)
+        self.cookie_store = CookieStore(account, **self.account_config.get("cookie_store", {}))
+        initial_cookies = parse_cookie_string(self.cookie_store.load(self.account_config.get("cookies")))
         self.tags = self.account_config["tags"]
         self.description_rte = convert_to_div_based_html(self.account_config["description"])
         assert all([tag in self.__config for tag in self.tags]), "タグが一致しません"
 
-        self.session = SafeSession()
+        self.session = SafeSession(
+            rate_limiter=RateLimiter(**self.account_config.get("rate_limit", {})),
+            account=account,
+        )
         self.session.cookies.update(initial_cookies)
         self.session.max_redirects = 2
         self._temp_cookies = self.session.cookies.copy()
+        self._cookie_lock = threading.Lock()
+        self._closed_df = None
+        self._closed_fetched_at = None
+        self._closed_max_pages = None
+        self._closed_limit = None
+        self.status_store = TradeStatusStore()
+        self.listing_session = ListingSession(self, **self.account_config.get("listing_session", {}))
 
         # リクエスト後のフックを登録
         self.session.hooks['response'].append(self.after_request)
@@ -842,24 +2050,27 @@ class YahooAuctionTrade:
 
         response.raise_for_status()
 
-        # ステータスコードごとの処理
-        if response.status_code < 300:
-            time.sleep(15)
-        else:
-            pass
+        # リクエスト間隔は SafeSession の RateLimiter が制御する
         self.cookie_update()
 
     def is_cookie_updated(self):
         return self._temp_cookies != self.session.cookies
 
     def cookie_update(self):
+        with self._cookie_lock:
+            self._cookie_update()
+
+    def _cookie_update(self):
         if self.is_cookie_updated():
-            logger.info("update cookie")
-            self.__config, self.__yaml = load_config(self.config_file)
-            self.__config["accounts"][self.__account]["cookies"] = serialize_cookies(self.session.cookies)
-            save_config(self.config_file, self.__config, self.__yaml)
+            logger.debug("update cookie")
+            # 書き出しは CookieStore がまとめて行う
+            self.cookie_store.update(serialize_cookies(self.session.cookies))
             self._temp_cookies = self.session.cookies.copy()
-            logger.info(f"is_cookie_updated: {self.is_cookie_updated()}")
+
+    def flush_cookies(self):
+        """未保存のクッキーをすぐに書き出す。"""
+        self.cookie_update()
+        self.cookie_store.flush()
 
 
     def post_img(self, file_path, headers, img_crumb, ):
@@ -912,30 +2123,19 @@ class YahooAuctionTrade:
         return config
     
 
-    def listing(self, file_path, title_name, category = 2084047414, duration = 2, closing_hour = 21, start_price=100, end_price=990, adult=None, title=None, _hash=None):
-        description_rte = self.description_rte
-        # ヘッダー情報
-        headers = {
-            'accept': '*/*',
-            'accept-language': 'ja,en-US;q=0.9,en;q=0.8',
-            'cache-control': 'no-cache',
-            'origin': 'https://auctions.yahoo.co.jp',
-            'pragma': 'no-cache',
-            'priority': 'u=1, i',
-            'referer': 'https://auctions.yahoo.co.jp/sell/jp/show/submit',
-            'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-            'sec-ch-ua-arch': '"arm"',
-            'sec-ch-ua-full-version-list': '"Google Chrome";v="131.0.6778.71", "Chromium";v="131.0.6778.71", "Not_A Brand";v="24.0.0.0"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-model': '""',
-            'sec-ch-ua-platform': '"macOS"',
-            'sec-ch-ua-platform-version': '"15.1.1"',
-            'sec-fetch-dest': 'empty',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-site': 'same-origin',
-            'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-            'x-requested-with': 'XMLHttpRequest'
-        }
+    def listing(self, file_path, title_name, category = 2084047414, duration = 2, closing_hour = 21, start_price=100, end_price=990, adult=None, title=None, _hash=None, listing_session=None):
+        prepared = self.prepare_listing(file_path, category, listing_session)
+        return self.submit_listing(prepared, title_name, duration, closing_hour, start_price, end_price, listing_session)
+
+    def prepare_listing(self, file_path, category=2084047414, listing_session=None):
+        """
+        出品フォームを開いて crumb を取得し、画像をアップロードする (出品の前半)。
+        共通の添付画像は listing_session でアップロード済みのものを使い回す。
+
+        :return: submit_listing に渡す辞書
+        """
+        listing_session = listing_session or self.listing_session
+        headers = LISTING_HEADERS
 
         # オークション新規ページを開く
         url = f"https://auctions.yahoo.co.jp/sell/jp/show/submit?category={category}"
@@ -956,7 +2156,26 @@ class YahooAuctionTrade:
         # 画像アップロード
         response=self.post_img(file_path, headers, img_crumb )
         thumb_response = self.get_thumbnail(response.json()["images"][0]["url"], headers, img_crumb)
-        response_size=self.post_img('material/size.jpg', headers, img_crumb )
+        static_images = listing_session.get_static_images(headers, img_crumb)
+
+        return {
+            "file_path": file_path,
+            "category": category,
+            "md5": md5,
+            ".crumb": _crumb,
+            "dtl_img_crumb": dtl_img_crumb,
+            "thumbNail": thumb_response.json()["thumbnail"],
+            "images": [response.json()["images"][0]] + static_images,
+        }
+
+    def submit_listing(self, prepared, title_name, duration=2, closing_hour=21, start_price=100, end_price=990, listing_session=None):
+        """
+        prepare_listing の結果を使って出品プレビューと出品を行う (出品の後半)。
+        """
+        listing_session = listing_session or self.listing_session
+        headers = LISTING_HEADERS
+        file_path = prepared["file_path"]
+        category = prepared["category"]
 
         # 出品プレビュー
         current_time = datetime.now()
@@ -965,19 +2184,11 @@ class YahooAuctionTrade:
         closing_ymd = end_time.strftime('%Y-%m-%d')
         data_update ={
             'category'       : category,
-            'md5'            : md5,
-            '.crumb'         : _crumb,
-            'dtl_img_crumb'  : dtl_img_crumb,
-            'thumbNail'      : thumb_response.json()["thumbnail"],
-            'ImageFullPath1' : response.json()["images"][0]["url"],
-            'ImageWidth1'    : response.json()["images"][0]["width"],
-            'ImageHeight1'   : response.json()["images"][0]["height"],
-            'ImageFullPath2' : response_size.json()["images"][0]["url"],
-            'ImageWidth2'    : response_size.json()["images"][0]["width"],
-            'ImageHeight2'   : response_size.json()["images"][0]["height"],
+            'md5'            : prepared["md5"],
+            '.crumb'         : prepared[".crumb"],
+            'dtl_img_crumb'  : prepared["dtl_img_crumb"],
+            'thumbNail'      : prepared["thumbNail"],
             'Title'          : title_name,
-            'Description'    : description_rte,
-            'Description_rte': description_rte, 
             'Duration'       : duration,
             'ClosingTime'    : closing_hour,
             'ClosingYMD'     : closing_ymd,
@@ -986,7 +2197,11 @@ class YahooAuctionTrade:
             'StartPrice'     : start_price,
             'BidOrBuyPrice'  : end_price,
         }
-        preview_data = PREVIEW_TEMPLATE.copy()
+        for i, image in enumerate(prepared["images"], start=1):
+            data_update[f'ImageFullPath{i}'] = image["url"]
+            data_update[f'ImageWidth{i}'] = image["width"]
+            data_update[f'ImageHeight{i}'] = image["height"]
+        preview_data = listing_session.preview_base.copy()
         preview_data.update(data_update)
         headers_prev = headers.copy()
         headers_prev["content-type"] = "application/x-www-form-urlencoded"
@@ -1020,7 +2235,7 @@ class YahooAuctionTrade:
         headers_submit["content-type"] = "application/x-www-form-urlencoded"
         url="https://auctions.yahoo.co.jp/sell/jp/config/submit"
         response_submit = self.session.post(url, headers=headers_submit, data=data_submit)
-        assert response_submit.status_code == 200, f"リクエスト失敗: {response.status_code}"
+        assert response_submit.status_code == 200, f"リクエスト失敗: {response_submit.status_code}"
         
         # 出品結果の確認
         soup = BeautifulSoup(response_submit.text, "html.parser")
@@ -1036,7 +2251,7 @@ class YahooAuctionTrade:
         return response_submit
 
 
-    def get_table(self, url, index_col=0, table_class='ItemTable', referer='https://auctions.yahoo.co.jp/user/jp/show/mystatus', apg=None):
+    def get_table(self, url, index_col=0, table_class='ItemTable', referer='https://auctions.yahoo.co.jp/user/jp/show/mystatus', apg=None, legacy=False, return_last_apg=False):
         """
         Yahoo!オークションのページからテーブルデータを取得し、次ページのapgを返す。
     
@@ -1046,6 +2261,8 @@ class YahooAuctionTrade:
         :param table_class: 取得するテーブルのクラス名
         :param referer: ヘッダーのリファラー設定
         :param apg: 現在のページ番号
+        :param legacy: Trueの場合、従来の BeautifulSoup + pd.read_html で解析する (比較用)
+        :param return_last_apg: Trueの場合、最終ページのapgも返す (legacy では常にNone)
         :return: DataFrameと次のapg（存在しない場合はNone）
         """
         # `apg` が指定されていればURLに追加
@@ -1078,84 +2295,107 @@ class YahooAuctionTrade:
         # ページを取得
         response = self.session.get(url, headers=headers)
         assert response.status_code == 200, f"リクエスト失敗: {response.status_code}"
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-    
-        # 次のページのapgを探す
-        next_apg = None
-        for a_tag in soup.find_all('a', href=True):
-            match = re.search(r'apg=(\d+)', a_tag['href'])
-            if match:
-                next_page = int(match.group(1))
-                if apg is None or next_page > apg:
-                    next_apg = next_page
-                    break
-    
-        # テーブルを取得
-        try:
-            tables = pd.read_html(StringIO(response.text), attrs={'class': table_class}, flavor='bs4', extract_links="body", index_col=index_col, header=0)
-        except ValueError:
-            return None, next_apg
-    
-        df_tmp = tables[0].dropna(how="all")
-        df_tmp = df_tmp.reset_index()
-    
-        # DataFrameを辞書形式に変換
-        data = df_tmp.to_dict(orient="records")
-        
-        df_tmp = pd.DataFrame([{key[0]: value for key, value in record.items()} for record in data])
-        current_year = datetime.now().year
-        
-        # 列ごとの整形処理
-        df_tmp['商品ID'] = df_tmp['商品ID'].apply(lambda x: x[0][0] if isinstance(x, tuple) and isinstance(x[0], tuple) else x[0])
-        df_tmp['商品名'] = df_tmp['商品名'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
-        df_tmp['imgid'] = df_tmp['商品名'].apply(productname_to_imgid)
-        df_tmp['imgids'] = df_tmp['imgid'].apply(lambda x: [x] if x else [])
-        if "ウォッチリスト" in df_tmp: df_tmp['ウォッチリスト'] = df_tmp['ウォッチリスト'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
-        if "現在価格" in df_tmp: df_tmp['現在価格'] = df_tmp['現在価格'].apply(lambda x: int(x[0].replace(" 円", "")) if isinstance(x, tuple) and x[0] else None)
-        if "最高落札価格" in df_tmp: df_tmp['最高落札価格'] = df_tmp['最高落札価格'].apply(lambda x: int(x[0].replace(" 円", "")) if isinstance(x, tuple) and x[0] else None)
-        if "終了日時" in df_tmp: df_tmp['終了日時'] = df_tmp['終了日時'].apply(lambda x: datetime.strptime(f"{current_year}年{x[0]}", "%Y年%m月%d日 %H時%M分") if isinstance(x, tuple) and x[0] else None)
-        if "落札者" in df_tmp: df_tmp['落札者'] = df_tmp['落札者'].apply(lambda x: x[1].split("userID=")[-1] if isinstance(x, tuple) and x[1] else None)
-        if "最新のメッセージ" in df_tmp: df_tmp['navi'] = df_tmp['最新のメッセージ'].apply(lambda x: x[1] if isinstance(x, tuple) else None)
-        if "最新のメッセージ" in df_tmp: df_tmp['最新のメッセージ'] = df_tmp['最新のメッセージ'].apply(lambda x: x[0] if isinstance(x, tuple) else None)
-        
-        return df_tmp, next_apg
+
+        if legacy:
+            df, next_apg = parse_item_table_legacy(response.text, apg=apg, index_col=index_col, table_class=table_class)
+            return (df, next_apg, None) if return_last_apg else (df, next_apg)
+        return parse_item_table(response.text, apg=apg, table_class=table_class, return_last_apg=return_last_apg)
     
-    def fetch_all_pages(self, url, index_col=0, start_apg=1, max_pages=None):
+    def fetch_all_pages(self, url, index_col=0, start_apg=1, max_pages=None, seen_ids=None, max_workers=3):
         """
         指定されたURLから全てのページ、または最大ページ数までのテーブルデータを取得し、結合する。
+        ページャーから残りのページ番号が分かれば、並列数を制限して先読みする
+        (リクエスト間隔は SafeSession の RateLimiter が制御する)。
     
         :param cookies: リクエストに使用するクッキー
         :param url: ベースURL
         :param index_col: テーブルのインデックス列（デフォルト: 0）
         :param start_apg: 開始するページ番号（デフォルト: 1）
         :param max_pages: 最大ページ数（デフォルト: None。指定がない場合、全ページを取得）
+        :param seen_ids: 取得済みの商品IDの集合。指定した場合、既知の行に到達した時点で取得を打ち切り、
+                         それより前の新しい行だけを返す（打ち切り判定のため先読みはしない）
+        :param max_workers: 先読みの最大並列数
         :return: 全ページのデータを結合したDataFrame
         """
-        combined_df = pd.DataFrame()
+        frames = []
         current_apg = start_apg
+        last_apg = None
         fetched_pages = 0
-    
-        while current_apg is not None:
-            # 最大ページ数に達したら終了
-            if max_pages is not None and fetched_pages >= max_pages:
-                # logger.info(f"Reached the maximum number of pages: {max_pages}")
+
+        def remaining():
+            return None if max_pages is None else max_pages - fetched_pages
+
+        while current_apg is not None and remaining() != 0:
+            # 既知の範囲 (current_apg〜last_apg) をまとめて取得する
+            if seen_ids is None and last_apg is not None and last_apg > current_apg:
+                end_apg = last_apg if remaining() is None else min(last_apg, current_apg + remaining() - 1)
+                pages = list(range(current_apg, end_apg + 1))
+            else:
+                pages = [current_apg]
+
+            if len(pages) == 1:
+                results = [self.get_table(url, index_col=index_col, apg=current_apg, return_last_apg=True)]
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = list(executor.map(
+                        lambda page: self.get_table(url, index_col=index_col, apg=page, return_last_apg=True), pages
+                    ))
+            fetched_pages += len(pages)
+
+            reached_seen = False
+            next_apg = None
+            for df, page_next_apg, page_last_apg in results:
+                if df is not None:
+                    if seen_ids is not None:
+                        is_seen = df["商品ID"].isin(seen_ids)
+                        if is_seen.any():
+                            df = df.iloc[:is_seen.values.argmax()]
+                            reached_seen = True
+                    frames.append(df)
+                if page_last_apg is not None:
+                    last_apg = max(last_apg or 0, page_last_apg)
+                next_apg = page_next_apg
+                if reached_seen:
+                    break
+
+            if reached_seen or next_apg is None or next_apg <= pages[-1]:
                 break
-    
-            # logger.info(f"Fetching page {url} {current_apg}...")
-            df, next_apg = self.get_table(url, index_col=index_col, apg=current_apg)
-            
-            if df is not None:
-                combined_df = pd.concat([combined_df, df], ignore_index=True)
-            
             current_apg = next_apg
-            fetched_pages += 1
-    
-        return combined_df
+
+        frames = [df for df in frames if len(df) > 0]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
     
-    def get_closed_df(self, max_pages=2):
+    def get_closed_df(self, max_pages=2, incremental=False, refresh_interval=3600):
+        """
+        落札済み一覧を取得する。
+
+        :param max_pages: 最大ページ数
+        :param incremental: Trueの場合、前回取得した一覧に含まれない新しい行だけを取得して前回の結果の先頭に追加し、
+                            全件を取得したときと同じ行数 (max_pages 分) に切り詰める。
+                            Falseの場合は全件を取得し直し、前回の結果を置き換える
+        :param refresh_interval: incremental でも、前回の全件取得からこの秒数が過ぎていれば全件を取得し直す
+                                 (既に取得した行の状態の変化を反映するため)
+        """
         url="https://auctions.yahoo.co.jp/closeduser/jp/show/mystatus?select=closed&hasWinner=1"
-        return self.fetch_all_pages(url, index_col=0, max_pages=max_pages)
+        now = time.monotonic()
+        if (not incremental or self._closed_df is None or len(self._closed_df) == 0
+                or self._closed_max_pages != max_pages or now - self._closed_fetched_at >= refresh_interval):
+            self._closed_df = self.fetch_all_pages(url, index_col=0, max_pages=max_pages)
+            self._closed_fetched_at = now
+            self._closed_max_pages = max_pages
+            # max_pages 分の行数。全ページを取得した場合は切り詰めない
+            self._closed_limit = None if max_pages is None else len(self._closed_df)
+            return self._closed_df.copy()
+
+        new_df = self.fetch_all_pages(url, index_col=0, max_pages=max_pages, seen_ids=set(self._closed_df["商品ID"]))
+        logger.info(f"新しい落札: {len(new_df)} 件")
+        if len(new_df) > 0:
+            self._closed_df = pd.concat([new_df, self._closed_df], ignore_index=True)
+            if self._closed_limit is not None:
+                self._closed_df = self._closed_df.iloc[:self._closed_limit]
+        return self._closed_df.copy()
 
     @cache_status
     def get_status(self, url):
@@ -1217,6 +2457,34 @@ class YahooAuctionTrade:
     
 
 
+    def resolve_statuses(self, navi_urls, max_workers=4, refresh=False, ttl=None):
+        """
+        複数の取引ナビURLのステータスを並列に取得する (リクエスト間隔は RateLimiter が制御する)。
+
+        :param navi_urls: 取引ナビURLのリスト
+        :param max_workers: 最大並列数
+        :param refresh: Trueの場合、キャッシュを使わずに取得する
+        :param ttl: ステータスごとのキャッシュ有効期間 (STATUS_CACHE_TTL の上書き)
+        :return: navi, status, status_value, is_matome, values, matome_accept_url 列を持つDataFrame
+        """
+        navi_urls = list(dict.fromkeys(navi_urls))
+
+        # キャッシュはまとめて読み込み、有効期限切れのものだけ取得する
+        records = {} if refresh else self.status_store.get_many(navi_urls)
+        results = {
+            url: (record["status"], record["is_matome"], record["values"], record["matome_accept_url"])
+            for url, record in records.items() if is_status_fresh(record, ttl)
+        }
+        stale_urls = [url for url in navi_urls if url not in results]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results.update(zip(stale_urls, executor.map(lambda url: self.get_status(url, refresh=True), stale_urls)))
+
+        df = pd.DataFrame([results[url] for url in navi_urls], columns=["status", "is_matome", "values", "matome_accept_url"])
+        df.insert(0, "navi", navi_urls)
+        df.insert(2, "status_value", df["status"].map(lambda x: x.value).astype("Int64"))
+        df["is_matome"] = df["is_matome"].astype(bool)
+        return df
+
     def get_matome_imgids(self, original_url: str, ):
         """
         Replace `/seller/top` in the URL with `/bundle/list` and make a GET request.
@@ -1665,7 +2933,7 @@ class YahooAuctionTrade:
 
     def accept_omatome(self, url):
         logger.info(f"まとめ承認します {url}")
-        status, is_matome, values, matome_accept_url = self.get_status(url)
+        status, is_matome, values, matome_accept_url = self.get_status(url, refresh=True)
         if matome_accept_url:
             values1 = self.get_ship_preview(matome_accept_url)
             time.sleep(10)
@@ -1680,17 +2948,42 @@ class YahooAuctionTrade:
             return False
 
 
-    def ship(self, gift_image_candidates=None, gift_threshold=1000):
+    def ship_paid(self, mail_body, gift_image_candidates=None, gift_threshold=1000):
+        """
+        支払い完了メールの本文からオークションIDを取り出し、その落札者の取引だけを発送する。
+        落札者が特定できない場合は全件を対象にした ship() にフォールバックする。
+
+        :param mail_body: 支払い完了メールの本文
+        """
+        auction_ids = extract_auction_ids(mail_body)
+        trades = self.get_closed_df(incremental=True)
+        buyers = trades.loc[trades["商品ID"].isin(auction_ids), "落札者"].dropna().unique().tolist() if len(trades) else []
+        if not buyers:
+            logger.warning(f"落札者を特定できないため全件を確認します: {auction_ids}")
+            return self.ship(gift_image_candidates, gift_threshold)
+
+        for buyer in buyers:
+            self.ship(gift_image_candidates, gift_threshold, buyer=buyer, trades=trades)
+
+    def ship(self, gift_image_candidates=None, gift_threshold=1000, buyer=None, trades=None):
+        """
+        発送可能な取引にプリントコードを送信し、発送連絡を行う。
+
+        :param buyer: 指定した場合、その落札者の取引 (まとめ取引を含む) だけを最新のステータスで処理する
+        :param trades: 落札済み一覧 (None の場合は取得する)
+        """
         # 売却済み一覧
-        logger.info(f"発送処理開始")
-        trades = self.get_closed_df()
+        logger.info(f"発送処理開始" + (f": {buyer}" if buyer else ""))
+        if trades is None:
+            trades = self.get_closed_df(incremental=buyer is not None)
 
         df = trades.copy()
         # 不要な列を削除し、状態を更新
         df = df.drop(columns=['取引', '操作', "選択"])
         df = df.dropna(subset=['navi'])
-        df['status'], df['is_matome'], df["values"], df["matome_accept_url"] = zip(*df['navi'].apply(lambda url: self.get_status(url)))
-        df['status_value'] = df['status'].apply(lambda x: x.value if hasattr(x, 'name') else x)
+        if buyer is not None:
+            df = df[df['落札者'] == buyer]
+        df = df.join(self.resolve_statuses(df['navi'].tolist(), refresh=buyer is not None).set_index('navi'), on='navi')
         df2 = df[df['status'] != TransactionStatus.RECEIPT]
 
 
@@ -1892,24 +3185,31 @@ class YahooAuctionTrade:
         return df
 
     def _listing_safe(self, file_paths, processed_file="processed_hashes.txt"):
+        started_at = time.monotonic()
+        num_listed = 0
         try:
-            hash_file_path = Path(processed_file)
-            processed_hashes = set(hash_file_path.read_text(encoding="utf-8").splitlines()) if hash_file_path.exists() else set()
+            journal = get_hash_journal(processed_file)
         
-            for file_path in file_paths:
-                config = self.get_listing_config(file_path)
-                res = self.listing(**config)
-                processed_hashes.add(config["_hash"])
-                hash_file_path.write_text("\n".join(processed_hashes), encoding="utf-8")
+            configs = [self.get_listing_config(file_path) for file_path in file_paths]
+            for config, res in self.listing_session.listing_many(configs):
+                journal.add(config["_hash"])
+                num_listed += 1
         except Exception as e:
             logger.error("出品中に例外が発生しました:\n" + traceback.format_exc())
+        finally:
+            elapsed = time.monotonic() - started_at
+            if num_listed:
+                logger.info(
+                    f"出品件数: {num_listed} 件, {elapsed:.0f} 秒 ({num_listed * 3600 / elapsed:.1f} 件/時, "
+                    f"prefetch={self.listing_session.prefetch}, reuse_static={self.listing_session.reuse_static})"
+                )
 
     def listing_auto(self, num=None):
         if num is None:
             num = self.account_config["listing_num"]
     
         logger.info(f"自動出品処理開始: {num} 件")
-        file_paths = get_original_files_with_tags(self.tags)
+        file_paths = get_original_files_with_tags(self.tags, root=ITEMS_ROOT)
         file_paths = get_file_exclude(file_paths, (get_purchased()|get_listed()))
         # display_resized_images_horizontally(file_paths[:20], max_images_per_row=10)
         
@@ -1928,7 +3228,9 @@ def calculate_chunks_length(total_length, max_size=23):
 
 def generate_message(img_paths, navi_list, gift_list=[]):
     # assert len(gift_list)==0, "プレゼント画像は未実装です"
-    qrcode_image = img2url_multi(img_paths, gift_list=gift_list)
+    # 購入台帳には主取引の落札者を記録する
+    buyer = parse_qs(urlparse(navi_list[0]).query).get("bid", [None])[0] if navi_list else None
+    qrcode_image = img2url_multi(img_paths, gift_list=gift_list, buyer=buyer)
     print_manual_image = "https://s3.ap-northeast-1.amazonaws.com/yat.ss/usage2.png"
     
     # まとめメッセージを条件によって定義
@@ -1998,17 +3300,20 @@ def register_db(client, df):
     if len(df) == 0:
         logger.error("売上データがありません")
         return
-    for index, row in df.iterrows():
-        tags = {
-            "product_id": index,  # 商品IDをタグとして設定
-            "account": row["account"],  # 商品IDをタグとして設定
-        }
-        fields = {
-            "sales": row["売上"],             # 売上
-            "payment_amount": row["決済金額"],  # 決済金額
-            "system_fee": row["落札システム利用料"],  # 落札システム利用料
-        }
-        timestamp = pd.to_datetime(row["取扱日"])
-        response = client.write("sales_test2", fields, tags, timestamp)
+    # 1回の書き込みで DataFrame 全体を登録する
+    records = pd.DataFrame({
+        "product_id": df.index,  # 商品IDをタグとして設定
+        "account": df["account"].values,
+        "sales": df["売上"].values,             # 売上
+        "payment_amount": df["決済金額"].values,  # 決済金額
+        "system_fee": df["落札システム利用料"].values,  # 落札システム利用料
+        "timestamp": pd.to_datetime(df["取扱日"]).values,
+    })
+    response = client.write_dataframe(
+        "sales_test2", records,
+        tag_columns=["product_id", "account"],
+        field_columns=["sales", "payment_amount", "system_fee"],
+        time_column="timestamp",
+    )
     logger.info(f"{len(df)} 件の売上データを登録しました")
     return response
\ No newline at end of file
@@ -1,11 +1,11 @@
 import os, fcntl, schedule, time, argparse
-from lib.auction import get_original_files, logger, YahooAuctionTrade
+from lib.auction import get_original_files, logger, YahooAuctionTrade, ITEMS_ROOT
 from lib.image_filters import process_images
 
 LOCKFILE = "/tmp/daily_task.lock"
 
 def daily_task(accounts):
-    process_images(get_original_files(), override=False)
+    process_images(get_original_files(root=ITEMS_ROOT), override=False)
     for account in accounts:
         logger.info(f"Processing account: {account}")
         YahooAuctionTrade(account).listing_auto()
@@ -1,102 +1,155 @@
 from lib.ymail import IMAPNewMailCheckerByUID
-from lib.auction import YahooAuctionTrade, logger, get_original_files_with_tags, get_file_exclude
+from lib.auction import YahooAuctionTrade, logger, get_inventory, get_purchased, get_listed
 import re
+import traceback
 from lib.auction import register_db
 from lib.influxdb import client
 from datetime import datetime
 import time
 import sys
 import argparse
+import threading
+import schedule
 
-# 引数を解析
-parser = argparse.ArgumentParser(description="Yahoo Auction Mail Checker")
-parser.add_argument("account", help="Yahooアカウント")
-parser.add_argument("-n", type=int, default=0, help="include_last_n の指定 (デフォルトは0)")
-args = parser.parse_args()
-
-account = args.account
-include_last_n = args.n
-
-yat = YahooAuctionTrade(account)
-EMAIL = yat.account_config["email"]
-PASSWORD = yat.account_config["password"]
-
-checker = IMAPNewMailCheckerByUID(
-    email_address=EMAIL,
-    password=PASSWORD,
-    poll_interval=600,
-    mailbox="yahoo_auction_callback",
-)
-
-# def on_test(mail_msg):
-#     logger.info(f"{account} ==== テスト ====")
-#     logger.info(f"{account} UID: {mail_msg.uid}")
-#     logger.info(f"{account} 件名: {mail_msg.subject}")
-#     logger.info(f"{account} date: {mail_msg.date}")
-#     logger.info(f"{account} test start")
-#     time.sleep(10)
-#     logger.info(f"{account} test complete")
-
-# checker.register_callback(
-#     callback=on_test
-# )
-
-def on_filter_matched_auction(mail_msg):
-    logger.info(f"{account} ==== 支払い完了 ====")
-    logger.info(f"{account} UID: {mail_msg.uid}")
-    logger.info(f"{account} 件名: {mail_msg.subject}")
-    logger.info(f"{account} date: {mail_msg.date}")
-    
-    file_paths = get_original_files_with_tags(yat.tags, suffix="submission", drop_missing=True)
-    assert file_paths != 0
-    if account == "shunn_wanda":
-        gift_image_candidates = get_file_exclude(file_paths)
-        assert len(gift_image_candidates) > 20
-    else:
-        gift_image_candidates = None
-
-    ret = yat.ship(gift_image_candidates)
-    df = yat.get_sales(datetime.now().strftime("%Y%m"))
-    register_db(client, df)
-
-checker.register_callback(
-    subject_pattern=r'支払いが完了しました',
-    from_pattern = r'^auction-master@mail\.yahoo\.co\.jp$',
-    callback=on_filter_matched_auction
-)
+# 全件の発送確認 (メールの取りこぼし対策) を行う間隔
+RECONCILE_INTERVAL_HOURS = 6
 
 def extract_links_from_body(mail_body: str):
     pattern = r'https://contact\.auctions\.yahoo\.co\.jp/seller/[^ \n]*'
     links = re.findall(pattern, mail_body)
     return links
 
-def on_matome(mail_msg):
-    logger.info(f"{account} ==== まとめ取引 ====")
-    urls = extract_links_from_body(mail_msg.body)
-    assert len(urls)==1, mail_msg.body
-    ret = yat.accept_omatome(urls[0])
-
-checker.register_callback(
-    subject_pattern=r'まとめ依頼',
-    from_pattern = r'^auction-master@mail\.yahoo\.co\.jp$',
-    # body_pattern = "yahoo",
-    callback=on_matome
-)
-
-import traceback
-
-def mail_polling():
-    logger.info(f"{account} ポーリング開始 (include_last_n={include_last_n})")
-    try:
-        checker.run(include_last_n=include_last_n)
-    except Exception as e:
-        # 例外発生時のログ出力
-        logger.error("ポーリング中に例外が発生しました:\n" + traceback.format_exc())
-        return
 
-mail_polling()
-logger.info(f"{account} ポーリングを終了しました")
+class AccountPoller:
+    """
+    1アカウント分のメール監視と発送処理をまとめたクラス。
+    メールのコールバックは IMAPNewMailCheckerByUID のワーカーで実行されるため、メール監視を止めない。
+    支払い完了の処理はアカウントごとに1つずつ、まとめ依頼の承認はそれとは別に実行する。
+    """
+
+    def __init__(self, account, poll_interval=600, executor=None):
+        """
+        :param account: Yahooアカウント
+        :param poll_interval: メールの確認間隔 (秒)
+        :param executor: 定期発送確認などを実行する Executor (None の場合はその場で実行する)
+        """
+        self.account = account
+        self.executor = executor
+        self.yat = YahooAuctionTrade(account)
+        self.ship_lock = threading.Lock()
+        self.checker = IMAPNewMailCheckerByUID(
+            email_address=self.yat.account_config["email"],
+            password=self.yat.account_config["password"],
+            poll_interval=poll_interval,
+            mailbox="yahoo_auction_callback",
+        )
+
+        # def on_test(mail_msg):
+        #     logger.info(f"{account} ==== テスト ====")
+        #     logger.info(f"{account} UID: {mail_msg.uid}")
+        #     logger.info(f"{account} 件名: {mail_msg.subject}")
+        #     logger.info(f"{account} date: {mail_msg.date}")
+        #     logger.info(f"{account} test start")
+        #     time.sleep(10)
+        #     logger.info(f"{account} test complete")
+
+        # self.checker.register_callback(
+        #     callback=on_test
+        # )
+
+        self.checker.register_callback(
+            subject_pattern=r'支払いが完了しました',
+            from_pattern = r'^auction-master@mail\.yahoo\.co\.jp$',
+            callback=self.on_filter_matched_auction,
+            name="payment",
+        )
+        self.checker.register_callback(
+            subject_pattern=r'まとめ依頼',
+            from_pattern = r'^auction-master@mail\.yahoo\.co\.jp$',
+            # body_pattern = "yahoo",
+            callback=self.on_matome,
+            name="matome",
+        )
+
+    def submit(self, func, *args, **kwargs):
+        """executor があれば投入し、なければその場で実行する。例外はログに残す。"""
+        def run():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                logger.error(f"{self.account} {func.__name__} で例外が発生しました:\n" + traceback.format_exc())
+                raise
+        if self.executor is None:
+            return run()
+        return self.executor.submit(run)
+
+    def get_gift_image_candidates(self):
+        if self.account == "shunn_wanda":
+            # 未出品・未購入で submission がある画像を索引から取得する
+            inventory = get_inventory()
+            records = inventory.query(self.yat.tags, variant="submission", exclude=get_purchased() | get_listed())
+            gift_image_candidates = [inventory.variant_path(record, "submission") for record in records]
+            assert len(gift_image_candidates) > 20
+        else:
+            gift_image_candidates = None
+        return gift_image_candidates
+
+    def on_filter_matched_auction(self, mail_msg):
+        logger.info(f"{self.account} ==== 支払い完了 ====")
+        logger.info(f"{self.account} UID: {mail_msg.uid}")
+        logger.info(f"{self.account} 件名: {mail_msg.subject}")
+        logger.info(f"{self.account} date: {mail_msg.date}")
+
+        with self.ship_lock:
+            # 支払った落札者の取引だけを発送する
+            ret = self.yat.ship_paid(mail_msg.body, self.get_gift_image_candidates())
+        df = self.yat.get_sales(datetime.now().strftime("%Y%m"))
+        register_db(client, df)
+
+    def on_matome(self, mail_msg):
+        logger.info(f"{self.account} ==== まとめ取引 ====")
+        urls = extract_links_from_body(mail_msg.body)
+        assert len(urls)==1, mail_msg.body
+        ret = self.yat.accept_omatome(urls[0])
+
+    def reconcile(self):
+        logger.info(f"{self.account} ==== 定期発送確認 ====")
+        try:
+            with self.ship_lock:
+                self.yat.ship(self.get_gift_image_candidates())
+        except Exception:
+            logger.error("定期発送確認中に例外が発生しました:\n" + traceback.format_exc())
+
+    def mail_polling(self, include_last_n=0, retry_failed=False):
+        logger.info(f"{self.account} ポーリング開始 (include_last_n={include_last_n})")
+        try:
+            self.checker.run(include_last_n=include_last_n, retry_failed=retry_failed)
+        except Exception as e:
+            # 例外発生時のログ出力
+            logger.error("ポーリング中に例外が発生しました:\n" + traceback.format_exc())
+            return
+
+
+def run_reconcile_schedule(poller):
+    schedule.every(RECONCILE_INTERVAL_HOURS).hours.do(poller.reconcile)
+    while True:
+        schedule.run_pending()
+        time.sleep(60)
+
+
+if __name__ == "__main__":
+    # 引数を解析
+    parser = argparse.ArgumentParser(description="Yahoo Auction Mail Checker")
+    parser.add_argument("account", help="Yahooアカウント")
+    parser.add_argument("-n", type=int, default=0, help="include_last_n の指定 (デフォルトは0、直近 n 件で失敗した処理も再実行する)")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗したすべてのコールバックを再実行する")
+    args = parser.parse_args()
+
+    poller = AccountPoller(args.account)
+    threading.Thread(target=run_reconcile_schedule, args=(poller,), daemon=True).start()
+    poller.mail_polling(include_last_n=args.n, retry_failed=args.retry_failed)
+    logger.info(f"{args.account} ポーリングを終了しました")
 
 
 # PYTHONPATH=. nohup python lib/auction_polling.py shunn_wanda -n 4 &
-# PYTHONPATH=. nohup python lib/auction_polling.py yeqzz34475 -n 1&
\ No newline at end of file
+# PYTHONPATH=. nohup python lib/auction_polling.py yeqzz34475 -n 1&
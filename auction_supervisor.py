@@ -0,0 +1,139 @@
+from lib.auction import logger, load_config, get_original_files, ITEMS_ROOT
+from lib.auction_polling import AccountPoller, RECONCILE_INTERVAL_HOURS
+from lib.image_filters import process_images
+from lib.ymail import wait_for_new_mail
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import schedule
+import threading
+import time
+import traceback
+
+
+class Supervisor:
+    """
+    すべてのアカウントを1プロセスで動かすクラス。
+    アカウントごとに YahooAuctionTrade (RateLimiter はアカウントの rate_limit 設定) を1つ持ち、
+    発送用の Executor をアカウントごとに分けるため、あるアカウントの遅い ship() が他のアカウントを待たせない。
+    出品は全アカウントで1つの Executor を使い、アカウントごとに順に行う
+    (出品済み・購入済みの画像の一覧は出品の開始時に読むため、並行するとタグが重なるアカウントで同じ画像を出品してしまう)。
+    メールの監視は1つのスレッドで全アカウントの IDLE をまとめて待つ (IDLE 非対応のサーバーはポーリング)。
+    再接続できなくなったアカウントは監視から外し、poll_interval 秒ごとに再接続を試みる。
+    """
+
+    def __init__(self, accounts=None, config_file="auction_config.yml", poll_interval=600):
+        """
+        :param accounts: 対象のアカウント (None の場合は設定ファイルのすべてのアカウント)
+        :param config_file: 設定ファイルのパス
+        :param poll_interval: メールの確認間隔 (秒)
+        """
+        if accounts is None:
+            config, _ = load_config(config_file)
+            accounts = list(config["accounts"])
+        self.poll_interval = poll_interval
+        self.pollers = {}
+        for account in accounts:
+            ship_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{account}-ship")
+            self.pollers[account] = AccountPoller(account, poll_interval=poll_interval, executor=ship_executor)
+        self.listing_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="listing")
+
+    def reconcile_all(self):
+        for poller in self.pollers.values():
+            poller.submit(poller.reconcile)
+
+    def listing_all(self):
+        """画像を一度だけ処理してから、各アカウントの出品を順に行う (発送・メール監視とは別のスレッドで実行する)。"""
+        self.listing_executor.submit(self._listing)
+
+    def _listing(self):
+        try:
+            # メール監視などのスレッドが動いているプロセスから fork しないよう、画像処理は spawn で起動する
+            process_images(get_original_files(root=ITEMS_ROOT), override=False, mp_context="spawn")
+        except Exception:
+            logger.error("画像処理中に例外が発生しました:\n" + traceback.format_exc())
+        for account, poller in self.pollers.items():
+            logger.info(f"Processing account: {account}")
+            try:
+                poller.yat.listing_auto()
+            except Exception:
+                logger.error(f"{account} 出品中に例外が発生しました:\n" + traceback.format_exc())
+
+    def run_schedule(self, listing_at="00:00"):
+        schedule.every(RECONCILE_INTERVAL_HOURS).hours.do(self.reconcile_all)
+        schedule.every().day.at(listing_at).do(self.listing_all)
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+
+    def mail_polling(self, include_last_n=0, retry_failed=False):
+        active = []
+        for account, poller in self.pollers.items():
+            logger.info(f"{account} ポーリング開始 (include_last_n={include_last_n})")
+            if poller.checker.start(include_last_n=include_last_n, retry_failed=retry_failed):
+                active.append(poller)
+            else:
+                logger.error(f"{account} メールサーバーに接続できませんでした")
+
+        # 再接続できなかったアカウントは監視から外し、poll_interval 秒ごとに再接続を試みる
+        suspended = {}  # poller -> 次に再接続を試みる時刻
+        try:
+            targets = list(active)
+            while active or suspended:
+                now = time.monotonic()
+                resumed = [poller for poller, retry_at in suspended.items() if retry_at <= now]
+                for poller in resumed:
+                    del suspended[poller]
+                    active.append(poller)
+                for poller in targets + resumed:
+                    try:
+                        if not poller.checker.poll_once():
+                            logger.error(
+                                f"{poller.account} メールサーバーに再接続できないため監視を止めます "
+                                f"({self.poll_interval} 秒後に再接続を試みます)"
+                            )
+                            active.remove(poller)
+                            suspended[poller] = time.monotonic() + self.poll_interval
+                        elif poller in resumed:
+                            logger.info(f"{poller.account} メールサーバーに再接続し、監視を再開しました")
+                    except Exception:
+                        logger.error(f"{poller.account} ポーリング中に例外が発生しました:\n" + traceback.format_exc())
+                checkers = {poller.checker: poller for poller in active}
+                if checkers and all(checker.supports_idle() for checker in checkers):
+                    timeout = min(checker.idle_timeout for checker in checkers)
+                else:
+                    timeout = self.poll_interval
+                if suspended:
+                    timeout = max(0, min(timeout, min(suspended.values()) - time.monotonic()))
+                notified = wait_for_new_mail(list(checkers), timeout)
+                # 通知があったアカウントだけを確認し、タイムアウトした場合は全アカウントを確認する
+                targets = [checkers[checker] for checker in notified] if notified else list(active)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for poller in self.pollers.values():
+                poller.checker.stop()
+            # 出品中のものが終わってから Cookie を書き出す
+            self.listing_executor.shutdown(wait=True)
+            for poller in self.pollers.values():
+                poller.checker.dispatcher.shutdown(wait=True)
+                poller.executor.shutdown(wait=True)
+                poller.yat.flush_cookies()
+
+    def run(self, include_last_n=0, listing_at="00:00", retry_failed=False):
+        threading.Thread(target=self.run_schedule, args=(listing_at,), daemon=True).start()
+        self.mail_polling(include_last_n=include_last_n, retry_failed=retry_failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Yahoo Auction Supervisor")
+    parser.add_argument("accounts", nargs="*", help="対象のアカウント (省略時は設定ファイルのすべてのアカウント)")
+    parser.add_argument("-n", type=int, default=0, help="include_last_n の指定 (デフォルトは0、直近 n 件で失敗した処理も再実行する)")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗したすべてのコールバックを再実行する")
+    parser.add_argument("--listing-at", default="00:00", help="毎日の出品開始時刻 (デフォルトは00:00)")
+    args = parser.parse_args()
+
+    supervisor = Supervisor(args.accounts or None)
+    supervisor.run(include_last_n=args.n, listing_at=args.listing_at, retry_failed=args.retry_failed)
+
+
+# PYTHONPATH=. nohup python lib/auction_supervisor.py -n 1 &
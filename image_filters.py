@@ -1,9 +1,13 @@
 from PIL import Image as PILImage, ImageDraw, ImageFilter, ImageFont, Image
 
 import numpy as np
+import cv2
+import logging
 import os
 import matplotlib.pyplot as plt
 
+logger = logging.getLogger(__name__)
+
 
 class LabelImageNotFoundError(Exception):
     pass
@@ -17,12 +21,15 @@ class ResolutionError(Exception):
     pass
 
 
+DEFAULT_LABEL_COLORS = {
+    "1": (0, 255, 0, 255),    # 男性器
+    "4": (255, 0, 255, 255),   # アナル
+    "5": (0, 0, 255, 255),   # 女性器
+}
+
+
 class MyImage:
-    def __init__(self, image_path, label_colors={
-        "1": (0, 255, 0, 255),    # 男性器
-        "4": (255, 0, 255, 255),   # アナル
-        "5": (0, 0, 255, 255),   # 女性器
-    }, tolerance=2, aspect_ratio_tolerance=1e-1, padding=0, skip_resolution_check=False):
+    def __init__(self, image_path, label_colors=DEFAULT_LABEL_COLORS, tolerance=2, aspect_ratio_tolerance=1e-1, padding=0, skip_resolution_check=False, padding_shape="square"):
         self.image_path = image_path
         self.original_image = PILImage.open(image_path).convert("RGBA")
         self.image = self.original_image.copy()
@@ -33,6 +40,8 @@ class MyImage:
         self.label_masks = {}  # 色ごとのマスクを保持
         self.saved_file_path = None
         self.skip_resolution_check = skip_resolution_check
+        # リサイズ済みのラベル画像と色ごとのマスク (derive したインスタンスと共有する)
+        self._label_cache = {}
 
         # 解像度チェック
         if not skip_resolution_check:
@@ -42,7 +51,7 @@ class MyImage:
             raise LabelImageNotFoundError(f"Label image not found for {image_path}")
 
         self._check_aspect_ratio()
-        self._generate_label_masks(padding=padding)
+        self._generate_label_masks(padding=padding, padding_shape=padding_shape)
         self.filters_applied = []
 
     def _check_resolution(self):
@@ -76,78 +85,179 @@ class MyImage:
                 f"Aspect ratio mismatch: label({label_aspect:.6f}) vs image({image_aspect:.6f})"
             )
 
-    def _generate_label_masks(self, padding=0):
+    def _generate_label_masks(self, padding=0, padding_shape="square"):
         """各ラベル色に対応するマスクを生成"""
-        label_resized = self.label_image.resize(self.image.size)
-        label_array = np.array(label_resized)
-    
-        # 各ラベル色に対してマスクを生成
+        # まだマスクを作っていない色だけをまとめて1回で分類する (derive したインスタンスとキャッシュを共有)
+        missing = []
+        for color in self.label_colors.values():
+            rgb = tuple(color[:3])
+            if ("mask", rgb, self.tolerance) not in self._label_cache and rgb not in missing:
+                missing.append(rgb)
+        for start in range(0, len(missing), 8):
+            self._classify_label_colors(missing[start:start + 8])
+
+        combined_mask = None
         for label_name, color in self.label_colors.items():
-            target_color = np.array(color[:3])
-            diff = np.abs(label_array[..., :3] - target_color)
-            mask = np.all(diff <= self.tolerance, axis=-1).astype(np.uint8) * 255
-            
-            # マスクを PIL Image として保存
-            label_mask = PILImage.fromarray(mask, mode="L")
-            
+            mask = self._label_cache[("mask", tuple(color[:3]), self.tolerance)]
+
             # パディング処理
             if padding > 0:
-                label_mask = self._expand_mask(label_mask, padding)
-                
+                label_mask = self._expand_mask(PILImage.fromarray(mask, mode="L"), padding, padding_shape)
+                mask = np.asarray(label_mask)
+            else:
+                label_mask = PILImage.fromarray(mask, mode="L")
             self.label_masks[label_name] = label_mask
 
+            if combined_mask is None:
+                combined_mask = mask.copy()
+            else:
+                combined_mask |= mask
+
         # 全てのマスクを統合した総合マスク (後方互換性のため)
-        combined_mask = np.zeros(mask.shape, dtype=np.uint8)
-        for mask in self.label_masks.values():
-            combined_mask |= np.array(mask)
+        if combined_mask is None:
+            combined_mask = np.zeros((self.image.height, self.image.width), dtype=np.uint8)
         self.label_mask = PILImage.fromarray(combined_mask, mode="L")
 
-    def _expand_mask(self, mask, padding):
+    def _get_label_array(self):
+        """画像サイズに合わせたラベル画像の RGB 配列 (色が混ざらないよう最近傍で拡大縮小する)"""
+        if "label_array" not in self._label_cache:
+            label_image = self.label_image
+            if label_image.size != self.image.size:
+                label_image = label_image.resize(self.image.size, PILImage.NEAREST)
+            self._label_cache["label_array"] = np.asarray(label_image.convert("RGB"))
+        return self._label_cache["label_array"]
+
+    def _classify_label_colors(self, colors):
         """
-        マスク領域を指定されたパディング量で拡張します。
-        
+        ラベル画像の各画素を1回の走査でラベル番号 (uint8) に分類し、色ごとのマスクをキャッシュする
+
+        チャンネルごとに「その値が許容誤差内に入る色」のビットを引く表を作り、
+        3チャンネルのビットの AND で色を決める (色ごとの差分計算は行わない)。
+        許容範囲が重なる場合は先に指定した色を優先する。
+        色ごとのマスクは (色数, 高さ, 幅) の1つの配列から切り出したビューで、読み取り専用として扱う。
+
+        Args:
+            colors (list): 分類する RGB のタプルのリスト (最大8色)。
+        """
+        assert len(colors) <= 8, "A single pass can classify up to 8 colors."
+        label_array = self._get_label_array()
+
+        values = np.arange(256)
+        bits = None
+        for channel in range(3):
+            table = np.zeros(256, dtype=np.uint8)
+            for i, color in enumerate(colors):
+                table[np.abs(values - color[channel]) <= self.tolerance] |= 1 << i
+            if bits is None:
+                bits = table[label_array[..., channel]]
+            else:
+                bits &= table[label_array[..., channel]]
+
+        # 立っているビットのうち最下位のもの + 1 をラベル番号とする (0 は背景)
+        first_bit = np.zeros(256, dtype=np.uint8)
+        for value in range(1, 256):
+            first_bit[value] = (value & -value).bit_length()
+        label_index = first_bit[bits]
+
+        masks = np.empty((len(colors),) + label_index.shape, dtype=np.uint8)
+        np.equal(label_index, np.arange(1, len(colors) + 1, dtype=np.uint8)[:, None, None], out=masks.view(bool))
+        masks *= 255
+        for i, color in enumerate(colors):
+            self._label_cache[("mask", color, self.tolerance)] = masks[i]
+
+    def _expand_mask(self, mask, padding, shape="square"):
+        """
+        マスク領域を指定されたパディング量で拡張します (モルフォロジーの膨張)。
+        マスク外の各画素からマスクまでの距離を距離変換で求めてしきい値処理するため、
+        処理時間はパディング量によらない。
+
         Args:
             mask (PIL.Image): ラベルのマスク画像。
             padding (int): 拡張するピクセル数。
-        
+            shape (str): 構造要素の形。"square" は (2 * padding + 1) 四方の正方形、
+                "ellipse" は半径 padding の円。
+
         Returns:
             PIL.Image: 拡張されたマスク画像。
         """
-        # マスク画像を NumPy 配列に変換
-        mask_array = np.array(mask)
-        
-        # NumPy 配列で膨張処理を実行
-        structure = np.ones((2 * padding + 1, 2 * padding + 1), dtype=np.uint8)
-        expanded_array = np.where(
-            mask_array > 0, 1, 0
-        )  # バイナリ化
-        expanded_array = np.pad(expanded_array, padding, mode="constant", constant_values=0)
-        expanded_array = np.clip(
-            np.convolve(expanded_array.flatten(), structure.flatten(), "same").reshape(expanded_array.shape), 
-            0, 1,
-        ).astype(np.uint8)
-
-        # 元のマスクサイズに戻す
-        expanded_array = expanded_array[
-            padding:-padding or None, padding:-padding or None
-        ]
+        if shape == "square":
+            # チェビシェフ距離 (正方形の構造要素と等価)
+            distance_type, mask_size = cv2.DIST_C, 3
+        elif shape == "ellipse":
+            # ユークリッド距離 (円の構造要素と等価)
+            distance_type, mask_size = cv2.DIST_L2, cv2.DIST_MASK_PRECISE
+        else:
+            raise ValueError(f"Unknown padding shape: {shape}")
+
+        # マスク画像を NumPy 配列に変換し、マスク外を 1 とする
+        outside = (np.asarray(mask) == 0).astype(np.uint8)
+
+        # マスクまでの距離がパディング量以下の画素をマスクに含める
+        distance = cv2.distanceTransform(outside, distance_type, mask_size)
+        expanded_array = (distance <= padding).astype(np.uint8) * 255
+
         # PIL Image に戻して返す
-        return PILImage.fromarray((expanded_array * 255).astype(np.uint8), mode="L")
+        return PILImage.fromarray(expanded_array, mode="L")
+
+    def derive(self, label_colors=None, padding=0, padding_shape="square"):
+        """
+        デコード済みの画像・ラベル画像・色ごとのマスクを共有し、
+        ラベル色とパディングだけを変えた新しいインスタンスを返す (ファイルは読み直さない)
+
+        Args:
+            label_colors (dict or None): 使用するラベル色。None の場合は既定のラベル色。
+            padding (int): マスクを拡張するピクセル数。
+            padding_shape (str): マスクを拡張する構造要素の形 ("square" または "ellipse")。
+
+        Returns:
+            MyImage: フィルタ適用前の状態の新しいインスタンス。
+        """
+        new_instance = self.__class__.__new__(self.__class__)
+        new_instance.image_path = self.image_path
+        new_instance.original_image = self.original_image
+        new_instance.image = self.original_image
+        new_instance.label_colors = label_colors or DEFAULT_LABEL_COLORS
+        new_instance.tolerance = self.tolerance
+        new_instance.aspect_ratio_tolerance = self.aspect_ratio_tolerance
+        new_instance.label_image = self.label_image
+        new_instance.label_masks = {}
+        new_instance.saved_file_path = None
+        new_instance.skip_resolution_check = self.skip_resolution_check
+        new_instance._label_cache = self._label_cache
+        new_instance._generate_label_masks(padding=padding, padding_shape=padding_shape)
+        new_instance.filters_applied = []
+        return new_instance
+
+    def _copy_with_current_state(self, copy_image=False, copy_masks=False):
+        """
+        現在の状態を引き継いだ新しいインスタンスを生成 (コピーオンライト)
+        画像とマスクは既定では参照を共有し、フィルタがその場で書き換える場合だけコピーする
+
+        Args:
+            copy_image (bool): True の場合、画像をコピーする。
+            copy_masks (bool): True の場合、色ごとのマスクと総合マスクをコピーする。
 
-    def _copy_with_current_state(self):
-        """現在の状態をコピーした新しいインスタンスを生成"""
+        Returns:
+            MyImage: 新しいインスタンス。
+        """
         new_instance = self.__class__.__new__(self.__class__)  # __init__ を呼び出さず新しいインスタンスを生成
         new_instance.image_path = self.image_path
         new_instance.original_image = self.original_image
-        new_instance.image = self.image.copy()
+        new_instance.image = self.image.copy() if copy_image else self.image
         new_instance.label_colors = self.label_colors
         new_instance.tolerance = self.tolerance
         new_instance.aspect_ratio_tolerance = self.aspect_ratio_tolerance
         new_instance.label_image = self.label_image
-        new_instance.label_masks = {k: v.copy() for k, v in self.label_masks.items()}
-        new_instance.label_mask = self.label_mask.copy() if self.label_mask else None
+        if copy_masks:
+            new_instance.label_masks = {k: v.copy() for k, v in self.label_masks.items()}
+            new_instance.label_mask = self.label_mask.copy() if self.label_mask else None
+        else:
+            # dict 自体は複製し、要素の差し替えが元のインスタンスに波及しないようにする
+            new_instance.label_masks = dict(self.label_masks)
+            new_instance.label_mask = self.label_mask
         new_instance.filters_applied = self.filters_applied.copy()
         new_instance.saved_file_path = self.saved_file_path
+        new_instance._label_cache = self._label_cache
         return new_instance
 
     def get_mask(self, label_name):
@@ -155,8 +265,14 @@ class MyImage:
         return self.label_masks.get(label_name)
 
     def apply_filter(self, filter_instance):
-        """フィルタを適用"""
-        new_image = self._copy_with_current_state()
+        """
+        フィルタを適用
+        フィルタが宣言した書き込み対象 (mutates_image / mutates_masks) だけをコピーしてから渡す
+        """
+        new_image = self._copy_with_current_state(
+            copy_image=getattr(filter_instance, "mutates_image", True),
+            copy_masks=getattr(filter_instance, "mutates_masks", True),
+        )
         filter_instance.apply(new_image)
         new_image.filters_applied.append(filter_instance.__class__.__name__)
         return new_image
@@ -261,9 +377,85 @@ class MyImage:
         return related_files
 
 class Filter:
+    """
+    フィルタの基底クラス
+    apply では image_instance.image や label_masks の要素を新しいオブジェクトに差し替え、
+    受け取ったオブジェクト自体は書き換えない (画像とマスクは他のインスタンスと共有されている)。
+    その場で書き換える (paste, ImageDraw.Draw(image_instance.image) など) フィルタは
+    mutates_image / mutates_masks を True にすると、apply_filter が事前にコピーを作る。
+    """
+    mutates_image = False
+    mutates_masks = False
+
     def apply(self, image_instance):
         raise NotImplementedError("Filter subclasses must implement the apply method.")
 
+
+class FilterGraph:
+    """
+    1つの元画像から複数の派生画像を作るフィルタのグラフ
+    元画像とラベル画像のデコード・色ごとのマスクの生成は1回だけ行い、各ブランチで共有する
+
+    例:
+        graph = FilterGraph() \
+            .branch("submission", [FanzaMosaicFilter()], label_colors={"1": (0, 255, 0, 255)}) \
+            .branch("sample", [WatermarkFilter(), ResizeFilter(500)], padding=3)
+        graph.run("data/items/a/a_123abc.jpg")
+    """
+
+    def __init__(self):
+        self.branches = []
+
+    def branch(self, suffix, filters, label_colors=None, padding=0, padding_shape="square"):
+        """
+        ブランチを追加する
+
+        Args:
+            suffix (str): 保存するファイルのサフィックス。
+            filters (list): 順に適用する Filter のリスト。
+            label_colors (dict or None): このブランチで使うラベル色。None の場合は既定のラベル色。
+            padding (int): このブランチのマスクを拡張するピクセル数。
+            padding_shape (str): このブランチのマスクを拡張する構造要素の形 ("square" または "ellipse")。
+
+        Returns:
+            self: メソッドチェーンを可能にするために self を返します。
+        """
+        self.branches.append({
+            "suffix": suffix,
+            "filters": filters,
+            "label_colors": label_colors or DEFAULT_LABEL_COLORS,
+            "padding": padding,
+            "padding_shape": padding_shape,
+        })
+        return self
+
+    def run(self, image_path, skip_if_exists=False, **kwargs):
+        """
+        元画像を1回だけ読み込み、すべてのブランチを実行して保存する
+
+        Args:
+            image_path (str): 元画像のパス。
+            skip_if_exists (bool): True の場合、保存先が既に存在するブランチは保存しない。
+            kwargs: MyImage に渡す引数 (tolerance, skip_resolution_check など)。
+
+        Returns:
+            dict: サフィックスごとの保存先のパス。
+        """
+        # すべてのブランチのラベル色のマスクをまとめて作る
+        label_colors = {}
+        for branch in self.branches:
+            label_colors.update(branch["label_colors"])
+        source = MyImage(image_path, label_colors=label_colors, padding=0, **kwargs)
+
+        saved = {}
+        for branch in self.branches:
+            image = source.derive(label_colors=branch["label_colors"], padding=branch["padding"], padding_shape=branch["padding_shape"])
+            for filter_instance in branch["filters"]:
+                image = image.apply_filter(filter_instance)
+            image.save(branch["suffix"], skip_if_exists=skip_if_exists)
+            saved[branch["suffix"]] = image.saved_file_path
+        return saved
+
 import os
 import random
 import numpy as np
@@ -278,6 +470,8 @@ class YoloDatasetFilter(Filter):
     元画像 + 変形画像をYOLO形式アノテーション付きで保存するフィルタ。
     最後に得られた画像(矩形描画済み)をimage_instance.imageに書き戻す。
     """
+    mutates_image = False
+    mutates_masks = False
 
     def __init__(
         self,
@@ -591,6 +785,9 @@ class YoloDatasetFilter(Filter):
 
 
 class WhiteFillRectFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, font_path="./material/Gidole-Regular.ttf", font_size=30, line_thickness=3):
         self.font_path = font_path
         self.font_size = font_size
@@ -671,6 +868,9 @@ class WhiteFillRectFilter(Filter):
 
 
 class FillLabelFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, fill_color=(255, 0, 255, 255)):
         self.fill_color = fill_color
 
@@ -679,6 +879,9 @@ class FillLabelFilter(Filter):
         image_instance.image = PILImage.composite(fill_image, image_instance.image, image_instance.label_mask)
 
 class ResizeFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, max_dimension=1000):
         """
         指定された最大辺の長さに基づいて画像をリサイズします。
@@ -712,6 +915,9 @@ class ResizeFilter(Filter):
         )
 
 class LabelBlurFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, radius=5, mask_blur_radius=10):
         """
         Args:
@@ -741,6 +947,9 @@ from PIL import Image as PILImage, ImageDraw, ImageFilter
 import numpy as np
 
 class FanzaMosaicFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, mosaic_size_ratio=0.01, resample_method=PILImage.NEAREST):
         """
         Args:
@@ -798,6 +1007,9 @@ class FanzaMosaicFilter(Filter):
 
     
 class MosaicFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, ratio=0.1, resample_method=PILImage.NEAREST):
         """
         Args:
@@ -854,6 +1066,9 @@ class MosaicFilter(Filter):
 
         return mosaic
 class WatermarkFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, text="Sample", font_path="./material/Gidole-Regular.ttf", alpha=0.3, size=15):
         self.text = text
         self.font_path = font_path
@@ -905,6 +1120,9 @@ class WatermarkFilter(Filter):
 
 import glob
 import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 from tqdm import tqdm
 from PIL import PngImagePlugin
 import shutil
@@ -913,47 +1131,98 @@ import shutil
 LARGE_ENOUGH_NUMBER = 100
 PngImagePlugin.MAX_TEXT_CHUNK = LARGE_ENOUGH_NUMBER * (1024**2)
 
-def process_images(file_list, override=False):
-    """画像に対してフィルタを順に適用し、保存する"""
-    for file_path in tqdm(file_list, desc="Processing Images", unit="file"):
-        # 派生ファイルが存在する場合はスキップ
-        is_exists = MyImage._get_related_files(file_path, skip_suffix=["submission", "sample"])
-        if is_exists is None and not override:
-            continue
+def build_production_graph():
+    """出品に使う派生画像 (submission, sample) のフィルタのグラフ"""
+    submission_label_colors = {
+        "1": (0, 255, 0, 255),    # 男性器
+        "5": (0, 0, 255, 255),   # 女性器
+    }
+    # サンプル画像
+    # .branch("sample", [MosaicFilter(ratio=0.004), WatermarkFilter(size=10), ResizeFilter(500)])
+    return FilterGraph() \
+        .branch("submission", [FanzaMosaicFilter(mosaic_size_ratio=0.003, resample_method=PILImage.BOX)],
+                label_colors=submission_label_colors, padding=0) \
+        .branch("sample", [WhiteFillRotatedRectExpandedFilter(expand_px=80), WatermarkFilter(size=10), ResizeFilter(500)],
+                padding=3)
+
+def process_image(file_path, override=False):
+    """
+    1ファイル分の派生画像 (submission, sample) を作成して保存する
+    プロセスプールから呼び出すため、画像ではなく処理結果だけを返す
 
-        # 画像をロード
+    :return: "skipped" (作成済み), "processed", "deleted" (解像度不足で ./deleted に移動)
+    """
+    # 派生ファイルが存在する場合はスキップ
+    is_exists = MyImage._get_related_files(file_path, skip_suffix=["submission", "sample"])
+    if is_exists is None and not override:
+        return "skipped"
+
+    # 画像を1回だけロードし、submission と sample を作る
+    try:
+        build_production_graph().run(file_path)
+    except ResolutionError as e:
+        logger.warning(str(e))
+        move_related_files(file_path, "./deleted")
+        return "deleted"
+    return "processed"
+
+def process_images(file_list, override=False, max_workers=None, mp_context=None):
+    """
+    画像に対してフィルタを順に適用し、保存する
 
-        try:
-            label_colors = {
-                "1": (0, 255, 0, 255),    # 男性器
-                "5": (0, 0, 255, 255),   # 女性器
-            }
-
-            image = MyImage(file_path, padding=0, label_colors=label_colors)
-            # フィルタを順に適用して保存
-            image.apply_filter(FanzaMosaicFilter(mosaic_size_ratio=0.003, resample_method=PILImage.BOX)) \
-                .save("submission")
-
-            # サンプル画像
-            # image.apply_filter(MosaicFilter(ratio=0.004)) \
-            #      .apply_filter(WatermarkFilter(size=10)) \
-            #      .apply_filter(ResizeFilter(500)) \
-            #      .save("sample")
-            image = MyImage(file_path, padding=3)
-            image.apply_filter(WhiteFillRotatedRectExpandedFilter(expand_px=80)) \
-                .apply_filter(WatermarkFilter(size=10)) \
-                .apply_filter(ResizeFilter(500)) \
-                .save("sample")
-            
-            del image
-        except ResolutionError as e:
-            print(e)
-            move_related_files(file_path, "./deleted")
+    :param max_workers: プロセス数 (None の場合は CPU 数、1 の場合はこのプロセスで順に処理する)
+    :param mp_context: プロセスの起動方法 ("spawn", "forkserver" など。None の場合は既定)。
+        スレッドが動いているプロセスから呼ぶ場合は、ロックを引き継いだ子プロセスが止まらないよう "spawn" を指定する
+    :return: 処理結果ごとの件数 (例: {"processed": 10, "skipped": 100})
+    """
+    results = Counter()
+    # 作成済みのファイルはプロセスに渡す前に除く (process_image 側でも同じ確認をする)
+    skip_suffix = ["submission", "sample"]
+    file_list = list(file_list)
+    pending = [
+        file_path for file_path in file_list
+        if override or MyImage._get_related_files(file_path, skip_suffix=skip_suffix) is not None
+    ]
+    results["skipped"] = len(file_list) - len(pending)
+    file_list = pending
+    if max_workers is None:
+        # コンテナなどで使える CPU が制限されている場合はその数に合わせる
+        max_workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    max_workers = max(1, min(max_workers, len(file_list)))
+
+    errors = []
+    if max_workers == 1:
+        for file_path in tqdm(file_list, desc="Processing Images", unit="file"):
+            try:
+                results[process_image(file_path, override)] += 1
+            except Exception as e:
+                # 1ファイルの失敗で他のファイルの処理を止めない (プロセスプールの場合と同じ)
+                results["error"] += 1
+                errors.append((file_path, e))
+    else:
+        if isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context)
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = {executor.submit(process_image, file_path, override): file_path for file_path in file_list}
+            # 進捗はすべてのプロセスの分をまとめて1つのバーで表示する
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing Images", unit="file"):
+                try:
+                    results[future.result()] += 1
+                except Exception as e:
+                    # 1ファイルの失敗で他のファイルの処理を止めない
+                    results["error"] += 1
+                    errors.append((futures[future], e))
+    for file_path, e in errors:
+        logger.error(f"Failed to process {file_path}: {e!r}")
+    return dict(results)
 
 from PIL import Image as PILImage
 from PIL import ImageFilter, ImageChops
 
 class WhiteFillBlurFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, blur_radius=5):
         """
         Args:
@@ -1008,6 +1277,9 @@ from PIL import ImageFilter, ImageChops
 import cv2
 
 class WhiteFillBlurFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, blur_radius=5, expand_px=3):
         """
         Args:
@@ -1053,6 +1325,9 @@ from PIL import Image as PILImage
 from PIL import ImageChops
 
 class WhiteFillBlurFilterCV2(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, blur_sigma=5, expand_px=3):
         """
         Args:
@@ -1109,6 +1384,9 @@ import cv2
 from PIL import Image as PILImage
 
 class WhiteFillRotatedRectFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def apply(self, image_instance):
         if not image_instance.label_mask:
             print("No label mask available for WhiteFillRotatedRectFilter.")
@@ -1144,6 +1422,9 @@ import cv2
 from PIL import Image as PILImage
 
 class WhiteFillRotatedRectExpandedFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, expand_px=5):
         """
         Args:
@@ -1183,7 +1464,7 @@ class WhiteFillRotatedRectExpandedFilter(Filter):
         for cnt in contours:
             rotated_rect = cv2.minAreaRect(cnt)
             box = cv2.boxPoints(rotated_rect)
-            box = np.int0(box)  # 整数化
+            box = np.intp(box)  # 整数化
             cv2.fillPoly(img_array, [box], (255, 255, 255))
 
         # 7) 結果をPILに戻して反映
@@ -1195,6 +1476,9 @@ import cv2
 from PIL import Image as PILImage
 
 class WhiteFillRotatedRectExpandedFilter(Filter):
+    mutates_image = False
+    mutates_masks = False
+
     def __init__(self, expand_px=5):
         """
         Args:
@@ -1235,7 +1519,7 @@ class WhiteFillRotatedRectExpandedFilter(Filter):
 
             # (4) boxPoints() で四隅の座標を取得 → 整数化
             box_expanded = cv2.boxPoints(rect_expanded)
-            box_expanded = np.int0(box_expanded)
+            box_expanded = np.intp(box_expanded)
 
             # (5) fillPoly() で塗りつぶし
             cv2.fillPoly(img_array, [box_expanded], (0, 0, 0))
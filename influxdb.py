@@ -1,15 +1,119 @@
 import pandas as pd
 import requests
 import datetime
+import atexit
+import gzip
+import logging
+import threading
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def escape_key(value):
+    """
+    measurement 以外のキー (タグキー・タグの値・フィールドキー) をラインプロトコル用にエスケープする
+    """
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+def _escape_keys(series):
+    return (
+        series.astype(str)
+        .str.replace("\\", "\\\\", regex=False)
+        .str.replace(",", "\\,", regex=False)
+        .str.replace("=", "\\=", regex=False)
+        .str.replace(" ", "\\ ", regex=False)
+    )
+
+def _format_field_values(series):
+    """フィールドの値を型に応じて文字列にする (数値はそのまま、文字列はダブルクォートで囲む)"""
+    if pd.api.types.is_bool_dtype(series):
+        return series.map({True: "true", False: "false"})
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(str)
+    escaped = series.astype(str).str.replace("\\", "\\\\", regex=False).str.replace('"', '\\"', regex=False)
+    return '"' + escaped + '"'
+
+def _join_parts(parts, sep=","):
+    """欠損 (空文字) を除いて列ごとの "key=value" を結合する"""
+    joined = parts[0]
+    for part in parts[1:]:
+        separator = pd.Series(sep, index=joined.index).where((joined != "") & (part != ""), "")
+        joined = joined + separator + part
+    return joined
+
+def to_line_protocol(df, measurement, tag_columns=(), field_columns=None, time_column=None):
+    """
+    DataFrame を列単位の処理でラインプロトコルの行のリストに変換する
+
+    :param df: 変換する DataFrame (index は列として扱いたい場合は reset_index しておく)
+    :param measurement: measurement 名
+    :param tag_columns: タグにする列
+    :param field_columns: フィールドにする列 (None の場合はタグと時刻以外のすべての列)
+    :param time_column: 時刻の列 (None の場合はサーバーの受信時刻)
+    :return: ラインプロトコルの行のリスト (フィールドがすべて欠損の行は除く)
+    """
+    if len(df) == 0:
+        return []
+    tag_columns = list(tag_columns)
+    if field_columns is None:
+        field_columns = [c for c in df.columns if c not in tag_columns and c != time_column]
+
+    measurement = str(measurement).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+    lines = pd.Series(measurement, index=df.index)
+
+    if tag_columns:
+        tag_parts = [
+            (escape_key(c) + "=" + _escape_keys(df[c])).where(df[c].notna() & (df[c].astype(str) != ""), "")
+            for c in tag_columns
+        ]
+        tag_set = _join_parts(tag_parts)
+        lines = lines + ("," + tag_set).where(tag_set != "", "")
+
+    field_parts = [
+        (escape_key(c) + "=" + _format_field_values(df[c])).where(df[c].notna(), "")
+        for c in field_columns
+    ]
+    field_set = _join_parts(field_parts)
+    lines = lines + " " + field_set
+
+    if time_column is not None:
+        timestamps = pd.to_datetime(df[time_column])
+        if hasattr(timestamps.dt, "as_unit"):
+            # pandas 2 以降は解像度が ns とは限らないため揃える
+            timestamps = timestamps.dt.as_unit("ns")
+        lines = lines + (" " + timestamps.astype("int64").astype(str)).where(timestamps.notna(), "")
+
+    return lines[field_set != ""].tolist()
 
 
 class InfluxDBClient:
-    def __init__(self, url, token, org, bucket):
+    def __init__(self, url, token, org, bucket, batch_size=5000, flush_interval=10, gzip_level=5):
+        """
+        :param batch_size: この行数がたまったら書き込む
+        :param flush_interval: バッファに行があるとき、最長この秒数で書き込む
+        :param gzip_level: 書き込みの gzip 圧縮レベル (0 の場合は圧縮しない)
+        """
         self.url = url
         self.token = token
         self.org = org
         self.bucket = bucket
         self.headers = {"Authorization": f"Token {token}"}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.gzip_level = gzip_level
+
+        # 接続を使い回す
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers.update(self.headers)
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._timer = None
+        self.num_requests = 0
+        atexit.register(self.flush)
 
     def _convert_timestamp(self, timestamp):
         """
@@ -20,31 +124,97 @@ class InfluxDBClient:
         raise ValueError("Invalid timestamp format. Must be pandas.Timestamp.")
 
     def write(self, measurement, fields, tags=None, timestamp=None):
-        tags = tags or {}
-        tag_set = ','.join([f"{k}={v}" for k, v in tags.items()])
-        field_set = ','.join([f"{k}={v}" for k, v in fields.items()])
-        
-        # タイムスタンプを変換
+        """1件だけ書き込む (まとめて書き込む場合は write_dataframe を使う)"""
+        row = {**(tags or {}), **fields}
+        df = pd.DataFrame([row])
         if timestamp is not None:
-            timestamp = self._convert_timestamp(timestamp)
-        # print(timestamp)
-        data = f"{measurement},{tag_set} {field_set} {timestamp}"
+            df["_time"] = [pd.Timestamp(self._convert_timestamp(timestamp))]
+        lines = to_line_protocol(
+            df, measurement, tag_columns=list(tags or {}), field_columns=list(fields),
+            time_column="_time" if timestamp is not None else None
+        )
+        try:
+            return self._post(lines)
+        except requests.RequestException as error:
+            return error
+
+    def write_dataframe(self, measurement, df, tag_columns=(), field_columns=None, time_column=None, flush=True):
+        """
+        DataFrame をまとめて書き込む
+
+        :param flush: True の場合はすぐに書き込む。False の場合はバッファにためて、
+                      batch_size 行か flush_interval 秒ごとに書き込む
+        :return: flush=True の場合は最後の書き込みのレスポンス
+        """
+        lines = to_line_protocol(df, measurement, tag_columns, field_columns, time_column)
+        self.add_lines(lines)
+        if flush:
+            return self.flush()
+
+    def add_lines(self, lines):
+        """ラインプロトコルの行をバッファに追加する"""
+        with self._lock:
+            self._buffer.extend(lines)
+            full = len(self._buffer) >= self.batch_size
+            if not full:
+                self._schedule_flush()
+        if full:
+            self.flush()
+
+    def _schedule_flush(self):
+        """バッファに行があれば flush_interval 秒後の書き込みを予約する (self._lock を取得して呼ぶ)"""
+        if self._buffer and self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        """タイマーからの書き込み (失敗はスレッドの外に伝わらないためログに残す)"""
+        try:
+            self.flush()
+        except (AssertionError, requests.RequestException) as error:
+            logger.error(f"InfluxDB への書き込みに失敗しました。{len(self._buffer)} 行を {self.flush_interval} 秒後に再送します: {error}")
+
+    def flush(self):
+        """
+        バッファの行を batch_size 行ずつ書き込む
+
+        書き込みに失敗した場合は、送れなかった行をバッファの先頭に戻して
+        flush_interval 秒後の再送を予約してから例外を送出する
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._buffer = self._buffer, []
+        response = None
+        for i in range(0, len(lines), self.batch_size):
+            try:
+                response = self._post(lines[i:i + self.batch_size])
+            except BaseException:
+                with self._lock:
+                    self._buffer[:0] = lines[i:]
+                    self._schedule_flush()
+                raise
+        return response
+
+    def _post(self, lines):
+        if not lines:
+            return None
         params = {
             "org": self.org,
             "bucket": self.bucket,
             "precision": "ns"  # ナノ秒精度を指定
         }
-        try:
-            response = requests.post(
-                f"{self.url}/api/v2/write",
-                params=params,
-                data=data,
-                headers=self.headers
-            )
-            assert response.status_code == 204, f"Failed to write data: {response.text}"
-            return response
-        except requests.RequestException as error:
-            return error
+        data = "\n".join(lines).encode("utf-8")
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.gzip_level:
+            data = gzip.compress(data, compresslevel=self.gzip_level)
+            headers["Content-Encoding"] = "gzip"
+        response = self.session.post(f"{self.url}/api/v2/write", params=params, data=data, headers=headers)
+        self.num_requests += 1
+        assert response.status_code == 204, f"Failed to write data: {response.text}"
+        return response
 
     def execute_flux(self, flux_script):
         """
@@ -61,7 +231,7 @@ class InfluxDBClient:
             "type": "flux"
         }
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.session.post(url, headers=headers, json=data)
             # ステータスコードとレスポンスを確認
             response.raise_for_status()
             return response
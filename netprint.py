@@ -5,6 +5,11 @@ import requests
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 import os
 import json
+import re
+import sqlite3
+import threading
+import time
+import pandas as pd
 
 
 
@@ -347,7 +352,144 @@ def edit_present_qrcode(qr_data, user_code, expire_date):
     
     return gradient
 
-def img2url_present(files):
+class PurchaseLedger:
+    """
+    購入 (ネットプリント登録) された画像の台帳 (SQLite, WALモード)。
+    画像のハッシュ・ユーザー番号・有効期限・落札者・登録日時を保持し、
+    購入済みハッシュの集合をメモリ上に持って他のプロセスが書き込んだときだけ読み直す。
+    """
+
+    def __init__(self, db_path="purchases.db", legacy_dir="./print_qr"):
+        """
+        Args:
+            db_path (str): SQLite ファイルのパス。
+            legacy_dir (str): 移行元の JSON が保存されているディレクトリ。初回のみ取り込む。
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._data_version = None
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS purchases (
+                hash TEXT NOT NULL,
+                file TEXT NOT NULL,
+                usercode TEXT NOT NULL,
+                expire_at TEXT,
+                buyer TEXT,
+                purchased_at REAL NOT NULL,
+                PRIMARY KEY (usercode, file)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_hash ON purchases (hash)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_dir:
+            self.migrate(legacy_dir)
+
+    def record(self, files, usercode, expire_at=None, buyer=None, purchased_at=None):
+        """
+        1つのユーザー番号で登録したファイルを記録する。
+
+        Args:
+            files (list): 登録した画像のパス。
+            usercode (str): ネットプリントのユーザー番号。
+            expire_at (str): 有効期限 (レスポンスの deleteAt)。
+            buyer (str): 落札者。
+        """
+        purchased_at = time.time() if purchased_at is None else purchased_at
+        rows = [
+            (h, file, usercode, expire_at, buyer, purchased_at)
+            for file in files if (h := extract_hash(file))
+        ]
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO purchases (hash, file, usercode, expire_at, buyer, purchased_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            if self._hashes is not None:
+                self._hashes.update(row[0] for row in rows)
+
+    def hashes(self):
+        """購入済みハッシュの集合を返す。"""
+        with self._lock:
+            # data_version は他の接続がコミットしたときだけ変わる
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._hashes is None or data_version != self._data_version:
+                self._hashes = {h for (h,) in self.conn.execute("SELECT DISTINCT hash FROM purchases")}
+                self._data_version = data_version
+            return set(self._hashes)
+
+    def history(self, buyer=None):
+        """購入履歴を登録日時順の DataFrame で返す。"""
+        sql = "SELECT * FROM purchases"
+        params = []
+        if buyer is not None:
+            sql += " WHERE buyer = ?"
+            params.append(buyer)
+        with self._lock:
+            df = pd.read_sql_query(sql + " ORDER BY purchased_at", self.conn, params=params)
+        df["purchased_at"] = pd.to_datetime(df["purchased_at"], unit="s")
+        return df
+
+    def migrate(self, directory="./print_qr"):
+        """
+        img2url_multi が保存してきた JSON を取り込む。取り込み済みの場合は何もしない。
+
+        Returns:
+            int: 取り込んだ JSON の数。
+        """
+        with self._lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_print_qr'").fetchone()
+        if done or not os.path.isdir(directory):
+            return 0
+
+        num_migrated = 0
+        for file_name in os.listdir(directory):
+            if not file_name.endswith(".json"):
+                continue
+            file_path = os.path.join(directory, file_name)
+            try:
+                with open(file_path, "r") as f:
+                    data = json.load(f)
+                files = data["files"]
+            except (json.JSONDecodeError, KeyError):
+                continue
+            try:
+                expire_at = data["response_data"]["files"][0]["deleteAt"]
+            except (KeyError, IndexError, TypeError):
+                expire_at = None
+            usercode = os.path.splitext(file_name)[0]
+            self.record(files, usercode, expire_at, purchased_at=os.path.getmtime(file_path))
+            num_migrated += 1
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_print_qr', ?)", (str(time.time()),)
+            )
+        return num_migrated
+
+
+def extract_hash(file_path):
+    match = re.search(r"[a-z]+_[0-9a-f]{6}", file_path)
+    if match:
+        return match.group()
+
+
+_purchase_ledger = None
+
+def get_purchase_ledger():
+    """プロセス内で共有される PurchaseLedger を返す。"""
+    global _purchase_ledger
+    if _purchase_ledger is None:
+        _purchase_ledger = PurchaseLedger()
+    return _purchase_ledger
+
+
+def img2url_present(files, buyer=None):
     assert len(files) < 24
     auth_token = authenticate()
     token = auth_token["authToken"]
@@ -377,6 +519,7 @@ def img2url_present(files):
     json_file_name = os.path.join(save_dir, f"{usercode}.json")
     with open(json_file_name, 'w', encoding='utf-8') as json_file:
         json.dump(json_data, json_file, ensure_ascii=False, indent=4)
+    get_purchase_ledger().record(files, usercode, expire_date, buyer)
     
     # QRコード画像をアップロード
     r = upload_image_to_s3(new_image)
@@ -585,7 +728,7 @@ class HippoError(Exception):
     """Imghippo API エラーを表す例外"""
     pass
 
-def img2url_multi(file_lists, gift_list=[]):
+def img2url_multi(file_lists, gift_list=[], buyer=None):
     filess, gift_labels = split_list(file_lists, gift_list)
     qr_datas, usercodes, expire_dates = [], [], []
     for files in filess:
@@ -618,6 +761,7 @@ def img2url_multi(file_lists, gift_list=[]):
         json_file_name = os.path.join(save_dir, f"{usercode}.json")
         with open(json_file_name, 'w', encoding='utf-8') as json_file:
             json.dump(json_data, json_file, ensure_ascii=False, indent=4)
+        get_purchase_ledger().record(files, usercode, expire_date, buyer)
 
     # QRコード編集
     new_image = edit_qrcodes(qr_datas, usercodes, expire_dates[0], gifts=gift_labels)
@@ -0,0 +1,167 @@
+"""
+image_filters のメモリ・速度のベンチマーク (本番サイズの合成画像で計測する)。
+
+    python tests/bench_image_filters.py rss     # 本番のフィルタグラフ (build_production_graph) のピーク RSS (コピーオンライト / 毎回コピー)
+    python tests/bench_image_filters.py labels  # ラベルマスク生成の速度 (以前の実装 / 現在の実装) と差分画素数
+    python tests/bench_image_filters.py dilation  # マスク膨張の速度 (パディング量・構造要素の形ごと、小さいパディングは以前の実装とも比較)
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image as PILImage
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from conftest import synthetic_item, write_item  # noqa: E402  (lib パッケージの登録も行う)
+
+PRODUCTION_SIZE = (4000, 3000)  # 12M 画素 (高さ, 幅)
+
+
+def production_item(directory, label_scale=2):
+    height, width = PRODUCTION_SIZE
+    return write_item(directory, *synthetic_item(height, width, label_scale=label_scale))
+
+
+def _rss_mb(field):
+    """/proc/self/status の VmRSS / VmHWM (MB)。取得できない環境では ru_maxrss を返す。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_chain(image_path, copy_every_step):
+    """
+    build_production_graph のブランチ (submission, sample) を途中の結果も保持して実行し、
+    チェーン中のピーク RSS の増分 (MB) を返す。
+    """
+    from lib.image_filters import MyImage, build_production_graph
+
+    graph = build_production_graph()
+    if copy_every_step:
+        # 以前の apply_filter と同じく、フィルタごとに画像とマスクをすべてコピーする
+        for branch in graph.branches:
+            for filter_instance in branch["filters"]:
+                filter_instance.mutates_image = filter_instance.mutates_masks = True
+    label_colors = {}
+    for branch in graph.branches:
+        label_colors.update(branch["label_colors"])
+    source = MyImage(image_path, label_colors=label_colors)
+    try:
+        # ピーク RSS (VmHWM) をリセットする
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    base = _rss_mb("VmRSS")
+    images = [source]
+    for branch in graph.branches:
+        images.append(source.derive(label_colors=branch["label_colors"], padding=branch["padding"], padding_shape=branch["padding_shape"]))
+        for filter_instance in branch["filters"]:
+            images.append(images[-1].apply_filter(filter_instance))
+    return _rss_mb("VmHWM") - base
+
+
+def bench_rss():
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = production_item(directory)
+        for mode in ("copy-on-write", "copy-every-step"):
+            # 計測が混ざらないよう、モードごとに別のプロセスで実行する
+            output = subprocess.run(
+                [sys.executable, __file__, "_rss", image_path, mode],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            print(f"rss {mode}: chain peak +{float(output.strip().splitlines()[-1]):.0f} MB")
+
+
+def legacy_label_masks(image):
+    """以前の _generate_label_masks と同じ手順 (bicubic で拡大、色ごとに abs/all、マスクを OR) でマスクを作る"""
+    label_array = np.array(image.label_image.resize(image.image.size))
+    masks = {}
+    for label_name, color in image.label_colors.items():
+        diff = np.abs(label_array[..., :3] - np.array(color[:3]))
+        masks[label_name] = np.all(diff <= image.tolerance, axis=-1).astype(np.uint8) * 255
+    combined_mask = np.zeros(label_array.shape[:2], dtype=np.uint8)
+    for mask in masks.values():
+        combined_mask |= np.array(PILImage.fromarray(mask, mode="L"))
+    return masks, combined_mask
+
+
+def current_label_masks(image):
+    image._label_cache.clear()
+    image.label_masks = {}
+    image._generate_label_masks()
+    return {name: np.asarray(mask) for name, mask in image.label_masks.items()}, np.asarray(image.label_mask)
+
+
+def _best_of(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_labels(repeat=3):
+    from lib.image_filters import MyImage
+
+    with tempfile.TemporaryDirectory() as directory:
+        image = MyImage(production_item(directory), skip_resolution_check=True)
+        legacy_time, (legacy_masks, legacy_combined) = _best_of(lambda: legacy_label_masks(image), repeat)
+        current_time, (current_masks, current_combined) = _best_of(lambda: current_label_masks(image), repeat)
+        print(f"labels legacy:  {legacy_time * 1000:.0f} ms")
+        print(f"labels current: {current_time * 1000:.0f} ms")
+        # 差分は bicubic 補間で境界の色が混ざった画素 (以前の実装の誤検出・検出漏れ)
+        for name in legacy_masks:
+            differing = int(np.count_nonzero(legacy_masks[name] != current_masks[name]))
+            print(f"labels diff {name}: {differing} px")
+        print(f"labels diff combined: {int(np.count_nonzero(legacy_combined != current_combined))} px")
+
+
+def legacy_expand_mask(mask_array, padding):
+    """以前の _expand_mask と同じ手順 (平坦化した1次元の畳み込み) でマスクを膨張する"""
+    structure = np.ones((2 * padding + 1, 2 * padding + 1), dtype=np.uint8)
+    expanded_array = np.pad(np.where(mask_array > 0, 1, 0), padding, mode="constant", constant_values=0)
+    expanded_array = np.clip(
+        np.convolve(expanded_array.flatten(), structure.flatten(), "same").reshape(expanded_array.shape),
+        0, 1,
+    ).astype(np.uint8)
+    return expanded_array[padding:-padding or None, padding:-padding or None] * 255
+
+
+def bench_dilation(paddings=(3, 30, 300), legacy_paddings=(3,), repeat=3):
+    from lib.image_filters import MyImage
+
+    with tempfile.TemporaryDirectory() as directory:
+        image = MyImage(production_item(directory), skip_resolution_check=True)
+        mask = image.label_mask
+        for padding in paddings:
+            for shape in ("square", "ellipse"):
+                elapsed, _ = _best_of(lambda: image._expand_mask(mask, padding, shape), repeat)
+                print(f"dilation p={padding} {shape}: {elapsed * 1000:.0f} ms")
+            if padding in legacy_paddings:
+                elapsed, _ = _best_of(lambda: legacy_expand_mask(np.asarray(mask), padding), 1)
+                print(f"dilation p={padding} legacy: {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if command == "_rss":
+        print(rss_chain(sys.argv[2], sys.argv[3] == "copy-every-step"))
+    else:
+        if command in ("rss", "all"):
+            bench_rss()
+        if command in ("labels", "all"):
+            bench_labels()
+        if command in ("dilation", "all"):
+            bench_dilation()
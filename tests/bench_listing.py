@@ -0,0 +1,57 @@
+"""
+ListingSession の出品件数/時を、通信をスリープで置き換えた疑似的な出品で比較する。
+実際の Yahoo に対する数値ではない (実際の出品の件数/時は auction.log の「出品件数」の行に mode つきで出る)。
+
+    python tests/bench_listing.py [件数]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest  # noqa: F401  (lib パッケージの登録)
+
+# 1回の通信にかかる秒数 (仮の値。実際の値に合わせて変更する) を SCALE 倍して待つ
+LATENCY = {"form": 0.6, "upload": 1.2, "thumbnail": 0.4, "static": 0.8, "preview": 0.9, "submit": 1.1}
+SCALE = 0.02
+
+
+def wait(kind):
+    time.sleep(LATENCY[kind] * SCALE)
+
+
+class FakeTrade:
+    description_rte = "<div>description</div>"
+
+    def post_img(self, file_path, headers, img_crumb):
+        wait("static")
+        return type("Response", (), {"json": lambda self: {"images": [{"url": file_path}]}})()
+
+    def prepare_listing(self, file_path, category, listing_session):
+        wait("form")
+        wait("upload")
+        wait("thumbnail")
+        return {"images": listing_session.get_static_images({}, "crumb")}
+
+    def submit_listing(self, prepared, title_name, listing_session=None, **kwargs):
+        wait("preview")
+        wait("submit")
+        return True
+
+
+def items_per_hour(num, **kwargs):
+    from lib.auction import ListingSession
+    session = ListingSession(FakeTrade(), **kwargs)
+    configs = [{"file_path": f"{i}.jpg", "title_name": "title"} for i in range(num)]
+    started = time.monotonic()
+    assert len(list(session.listing_many(configs))) == num
+    return num * 3600 / ((time.monotonic() - started) / SCALE)
+
+
+if __name__ == "__main__":
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    os.chdir(tempfile.mkdtemp())  # auction.log をリポジトリに作らない
+    for kwargs in ({}, {"reuse_static": True}, {"prefetch": True}, {"prefetch": True, "reuse_static": True}):
+        mode = ", ".join(f"{k}={v}" for k, v in kwargs.items()) or "default (prefetch=False, reuse_static=False)"
+        print(f"{mode}: {items_per_hour(num, **kwargs):.0f} 件/時")
@@ -0,0 +1,49 @@
+import os
+import sys
+import types
+
+# リポジトリは lib/ として配置して lib.<モジュール> で import する前提のため、
+# チェックアウトしたディレクトリを lib パッケージとして登録する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "lib" not in sys.modules:
+    lib = types.ModuleType("lib")
+    lib.__path__ = [ROOT]
+    sys.modules["lib"] = lib
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_item(directory, image_array, label_array, name="a_000000"):
+    """
+    元画像とラベル画像 ({name}.jpg, {name}_label.png) を書き出し、元画像のパスを返す。
+
+    :param image_array: 元画像 (H, W, 3) の uint8 配列
+    :param label_array: ラベル画像 (h, w, 3 または 4) の uint8 配列 (元画像と縦横比を合わせる)
+    """
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    image_path = os.path.join(str(directory), f"{name}.jpg")
+    Image.fromarray(image_array).save(image_path, quality=95)
+    Image.fromarray(label_array).save(image_path.replace(".jpg", "_label.png"))
+    return image_path
+
+
+def synthetic_item(height=600, width=400, label_scale=2, seed=0):
+    """
+    ノイズの元画像と、3色のラベル領域を持つ (1/label_scale の解像度の) ラベル画像を作る。
+
+    :return: (元画像の配列, ラベル画像の配列)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    label = np.zeros((height // label_scale, width // label_scale, 4), dtype=np.uint8)
+    h, w = label.shape[:2]
+    label[h // 8:h // 4, w // 8:w // 2] = (0, 255, 0, 255)
+    label[h // 2:h // 2 + h // 10, w // 3:w // 3 + w // 5] = (255, 0, 255, 255)
+    label[h * 3 // 4:h * 7 // 8, w // 2:w * 7 // 8] = (0, 0, 255, 255)
+    # 許容誤差 (tolerance=2) 以内にずれた色と、範囲外の色
+    label[h // 8, w // 8:w // 2] = (2, 253, 1, 255)
+    label[h * 7 // 8, w // 2:w * 7 // 8] = (0, 0, 252, 255)
+    return image, label
@@ -0,0 +1,65 @@
+"""
+テスト用のトランスポートアダプタ (ネットワークに出ず、決められた順にレスポンスか例外を返す)。
+
+    adapter = ScriptedAdapter([unsent_error(), 200])
+    session.mount("https://", adapter)
+"""
+import requests
+import urllib3
+from requests.adapters import BaseAdapter
+
+
+def unsent_error():
+    """接続確立前の失敗 (サーバーに届いていないことが確実なエラー)"""
+    return requests.exceptions.ConnectionError(
+        urllib3.exceptions.MaxRetryError(None, "/", urllib3.exceptions.NewConnectionError(None, "Connection refused"))
+    )
+
+
+def sent_error():
+    """送信後の失敗 (サーバーに届いたか分からないエラー)"""
+    return requests.exceptions.ReadTimeout("Read timed out")
+
+
+class ScriptedAdapter(BaseAdapter):
+    def __init__(self, script):
+        """
+        :param script: 送信ごとに返すステータスコード (int) か送出する例外のリスト
+        """
+        super().__init__()
+        self.script = list(script)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        response = requests.Response()
+        response.status_code = step
+        response.url = request.url
+        response.request = request
+        response.headers["Content-Type"] = "text/plain"
+        response._content = b""
+        return response
+
+    def close(self):
+        pass
+
+
+def make_session(ledger, script, account="test"):
+    """
+    待ち時間なしのレート制限・リトライ設定で SafeSession を作り、https:// に ScriptedAdapter をつなぐ。
+    YahooAuctionTrade と同じく、レスポンスフックで raise_for_status する。
+
+    :return: (SafeSession, ScriptedAdapter)
+    """
+    from lib.auction import RateLimiter, SafeSession
+
+    rate_limiter = RateLimiter(read_rate=1000, read_burst=1000, write_rate=1000, write_burst=1000, backoff_base=0)
+    session = SafeSession(ledger=ledger, rate_limiter=rate_limiter, account=account)
+    session.retry_policies = {method: {**policy, "multiplier": 0} for method, policy in session.retry_policies.items()}
+    session.hooks["response"].append(lambda response, **kwargs: response.raise_for_status())
+    adapter = ScriptedAdapter(script)
+    session.mount("https://", adapter)
+    return session, adapter
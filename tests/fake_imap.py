@@ -0,0 +1,179 @@
+"""
+テスト用のローカル IMAP サーバー (IMAPNewMailCheckerByUID が使うコマンドだけを実装した最小限のもの)。
+
+    server = FakeIMAPServer(idle=True)
+    server.add_message("支払いが完了しました")
+    checker = IMAPNewMailCheckerByUID(..., server="127.0.0.1", port=server.port, use_ssl=False)
+"""
+import re
+import socketserver
+import threading
+
+
+class FakeIMAPServer:
+    def __init__(self, idle=True, uidvalidity=1):
+        """
+        :param idle: CAPABILITY で IDLE を返すか
+        :param uidvalidity: SELECT で返す UIDVALIDITY
+        """
+        self.idle = idle
+        self.uidvalidity = uidvalidity
+        self.messages = {}  # uid -> RFC822 のバイト列
+        self.commands = []
+        # True の場合、IDLE の継続応答と未通知の EXISTS を1回の write で送る
+        self.exists_with_continuation = False
+        # True の場合、UID SEARCH の応答の途中で未通知の EXISTS を送る
+        self.exists_during_search = False
+        self._lock = threading.Lock()
+        self._sessions = []
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._handle(self)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def idle_count(self):
+        return sum(1 for command in self.commands if command.split(" ")[1:2] == ["IDLE"])
+
+    def add_message(self, subject, from_="auction-master@mail.yahoo.co.jp", body="hello", notify=True):
+        """メールを追加し、IDLE 中のセッションに EXISTS を通知する。"""
+        raw = (f"From: {from_}\r\nSubject: {subject}\r\nDate: Mon, 1 Jan 2024 00:00:00 +0000\r\n"
+               f"Content-Type: text/plain; charset=utf-8\r\n\r\n{body}\r\n").encode()
+        with self._lock:
+            uid = max(self.messages, default=0) + 1
+            self.messages[uid] = raw
+            sessions = list(self._sessions)
+        if notify:
+            for session in sessions:
+                if session["idling"]:
+                    session["write"](f"* {len(self.messages)} EXISTS\r\n")
+        return uid
+
+    def _handle(self, handler):
+        def write(data):
+            handler.wfile.write(data if isinstance(data, bytes) else data.encode())
+            handler.wfile.flush()
+
+        # 最後に通知した EXISTS の件数
+        session = {"idling": False, "write": write, "exists": len(self.messages)}
+        with self._lock:
+            self._sessions.append(session)
+        capabilities = "IMAP4rev1 IDLE" if self.idle else "IMAP4rev1"
+        write(f"* OK [CAPABILITY {capabilities}] ready\r\n")
+        try:
+            while True:
+                line = handler.rfile.readline()
+                if not line:
+                    break
+                line = line.decode().rstrip("\r\n")
+                self.commands.append(line)
+                if session["idling"]:
+                    if line == "DONE":
+                        session["idling"] = False
+                        write(f"{session['idle_tag']} OK IDLE terminated\r\n")
+                    continue
+                tag, _, rest = line.partition(" ")
+                command, _, args = rest.partition(" ")
+                if not self._command(session, write, tag, command.upper(), args):
+                    break
+        finally:
+            with self._lock:
+                self._sessions.remove(session)
+
+    def _unseen_exists(self, session):
+        """まだ通知していない EXISTS があれば応答の行を返す。"""
+        if len(self.messages) == session["exists"]:
+            return ""
+        session["exists"] = len(self.messages)
+        return f"* {session['exists']} EXISTS\r\n"
+
+    def _command(self, session, write, tag, command, args):
+        if command == "CAPABILITY":
+            write(f"* CAPABILITY {'IMAP4rev1 IDLE' if self.idle else 'IMAP4rev1'}\r\n{tag} OK done\r\n")
+        elif command == "LOGIN":
+            write(f"{tag} OK logged in\r\n")
+        elif command == "SELECT":
+            session["exists"] = len(self.messages)
+            write(f"* {len(self.messages)} EXISTS\r\n* OK [UIDVALIDITY {self.uidvalidity}] ok\r\n"
+                  f"* OK [UIDNEXT {max(self.messages, default=0) + 1}] ok\r\n{tag} OK [READ-WRITE] done\r\n")
+        elif command in ("NOOP", "CLOSE"):
+            write(f"{self._unseen_exists(session)}{tag} OK done\r\n")
+        elif command == "LOGOUT":
+            write(f"* BYE\r\n{tag} OK done\r\n")
+            return False
+        elif command == "IDLE" and self.idle:
+            session["idling"] = True
+            session["idle_tag"] = tag
+            if self.exists_with_continuation:
+                write(f"+ idling\r\n{self._unseen_exists(session)}")
+            else:
+                write("+ idling\r\n")
+        elif command == "FETCH":
+            seq, _, _ = args.partition(" ")
+            uids = sorted(self.messages)
+            index = len(uids) if seq == "*" else int(seq)
+            write(f"* {index} FETCH (UID {uids[index - 1]})\r\n{tag} OK done\r\n")
+        elif command == "UID":
+            subcommand, _, args = args.partition(" ")
+            subcommand = subcommand.upper()
+            if subcommand == "SEARCH":
+                self._uid_search(session, write, tag, args)
+            elif subcommand == "FETCH":
+                self._uid_fetch(write, tag, args)
+            else:
+                write(f"{tag} BAD unknown command\r\n")
+        else:
+            write(f"{tag} BAD unknown command\r\n")
+        return True
+
+    def _uid_search(self, session, write, tag, args):
+        uids = sorted(self.messages)
+        match = re.search(r"UID (\d+):\*", args)
+        if match:
+            # "n:*" は n より大きい UID がなくても最大の UID を返す
+            uids = [uid for uid in uids if uid >= int(match.group(1))] or uids[-1:]
+        unseen = self._unseen_exists(session) if self.exists_during_search else ""
+        write(f"* SEARCH {' '.join(map(str, uids))}\r\n{unseen}{tag} OK done\r\n")
+
+    def _uid_fetch(self, write, tag, args):
+        uid_set, _, items = args.partition(" ")
+        items = items.upper()
+        uids = []
+        for part in uid_set.split(","):
+            if ":" in part:
+                low, high = part.split(":")
+                high = max(self.messages) if high == "*" else int(high)
+                uids += [uid for uid in sorted(self.messages) if int(low) <= uid <= high]
+            else:
+                uids.append(int(part))
+        for uid in uids:
+            if uid not in self.messages:
+                continue
+            raw = self.messages[uid]
+            header, _, body = raw.partition(b"\r\n\r\n")
+            sections = []
+            for item in re.findall(r"BODY\.PEEK\[([^\]]*)\]", items):
+                if item.startswith("HEADER"):
+                    sections.append((f"BODY[{item}]", header + b"\r\n\r\n"))
+                elif item == "TEXT":
+                    sections.append(("BODY[TEXT]", body))
+            out = f"* {sorted(self.messages).index(uid) + 1} FETCH (UID {uid}"
+            if "INTERNALDATE" in items:
+                out += ' INTERNALDATE "01-Jan-2024 00:00:00 +0000"'
+            for name, payload in sections:
+                write(f"{out} {name} {{{len(payload)}}}\r\n".encode() + payload)
+                out = ""
+            write(f"{out})\r\n")
+        write(f"{tag} OK done\r\n")
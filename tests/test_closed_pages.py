@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+
+class FakePages:
+    """落札済み一覧のページ (新しい順、1ページ page_size 行) を返す get_table の代わり"""
+
+    def __init__(self, ids, page_size=3, delay=0.0):
+        self.ids = list(ids)
+        self.page_size = page_size
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_apg(self):
+        return max(1, -(-len(self.ids) // self.page_size))
+
+    def get_table(self, url, index_col=0, apg=None, return_last_apg=False):
+        with self._lock:
+            self.calls.append(apg)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        start = (apg - 1) * self.page_size
+        ids = self.ids[start:start + self.page_size]
+        df = pd.DataFrame({"商品ID": ids, "落札者": [f"buyer_{i}" for i in ids]})
+        next_apg = apg + 1 if apg < self.last_apg else None
+        return df, next_apg, self.last_apg
+
+
+@pytest.fixture
+def make_trade(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    from lib.auction import YahooAuctionTrade
+
+    def make(pages):
+        # ネットワークやアカウント設定を使わないよう、一覧の取得に必要な属性だけを持つインスタンスを作る
+        trade = YahooAuctionTrade.__new__(YahooAuctionTrade)
+        trade._closed_df = None
+        trade._closed_fetched_at = None
+        trade._closed_max_pages = None
+        trade._closed_limit = None
+        trade.get_table = pages.get_table
+        return trade
+
+    return make
+
+
+def test_fetch_all_pages_prefetches_known_pages_concurrently(make_trade):
+    pages = FakePages([f"x{i:02d}" for i in range(15)], delay=0.05)
+    trade = make_trade(pages)
+
+    df = trade.fetch_all_pages("url", max_workers=3)
+    assert df["商品ID"].tolist() == pages.ids
+    # 1ページ目でページ数が分かり、残りの 4 ページを並列に取得する
+    assert pages.calls[0] == 1 and sorted(pages.calls) == [1, 2, 3, 4, 5]
+    assert pages.max_active == 3
+
+
+def test_fetch_all_pages_respects_max_pages(make_trade):
+    pages = FakePages([f"x{i:02d}" for i in range(15)])
+    trade = make_trade(pages)
+    df = trade.fetch_all_pages("url", max_pages=2)
+    assert df["商品ID"].tolist() == pages.ids[:6]
+    assert sorted(pages.calls) == [1, 2]
+
+
+def test_fetch_all_pages_stops_at_seen_ids(make_trade):
+    pages = FakePages([f"x{i:02d}" for i in range(15)], delay=0.01)
+    trade = make_trade(pages)
+    df = trade.fetch_all_pages("url", seen_ids={"x04", "x05", "x10"})
+    assert df["商品ID"].tolist() == ["x00", "x01", "x02", "x03"]
+    # 既知の行に到達したら打ち切り、先読みもしない
+    assert pages.calls == [1, 2]
+    assert pages.max_active == 1
+
+
+def test_incremental_closed_df_is_capped_to_max_pages(make_trade):
+    pages = FakePages([f"x{i:02d}" for i in range(15)])
+    trade = make_trade(pages)
+    assert trade.get_closed_df(max_pages=2, incremental=True)["商品ID"].tolist() == pages.ids[:6]
+
+    for n in range(3):
+        pages.ids.insert(0, f"new{n}")
+        df = trade.get_closed_df(max_pages=2, incremental=True)
+        assert df["商品ID"].tolist() == pages.ids[:6]
+    assert len(trade._closed_df) == 6
+
+
+def test_incremental_closed_df_is_refreshed_periodically(make_trade, monkeypatch):
+    import lib.auction as auction
+
+    clock = [1000.0]
+    monkeypatch.setattr(auction.time, "monotonic", lambda: clock[0])
+    pages = FakePages([f"x{i:02d}" for i in range(6)])
+    trade = make_trade(pages)
+    trade.get_closed_df(max_pages=2, incremental=True)
+
+    # 既に取得した行の状態が変わっても、incremental の取得には反映されない
+    original = pages.get_table
+
+    def changed(url, index_col=0, apg=None, return_last_apg=False):
+        df, next_apg, last_apg = original(url, index_col, apg, return_last_apg)
+        df["落札者"] = df["落札者"] + "_changed"
+        return df, next_apg, last_apg
+
+    trade.get_table = changed
+    clock[0] += 60
+    assert trade.get_closed_df(max_pages=2, incremental=True, refresh_interval=3600)["落札者"].iloc[0] == "buyer_x00"
+
+    # refresh_interval を過ぎたら全件を取得し直す
+    clock[0] += 3600
+    calls = len(pages.calls)
+    df = trade.get_closed_df(max_pages=2, incremental=True, refresh_interval=3600)
+    assert df["落札者"].iloc[0] == "buyer_x00_changed"
+    assert sorted(pages.calls[calls:]) == [1, 2]
+
+
+def test_changing_max_pages_refetches(make_trade):
+    pages = FakePages([f"x{i:02d}" for i in range(15)])
+    trade = make_trade(pages)
+    trade.get_closed_df(max_pages=1, incremental=True)
+    assert len(trade.get_closed_df(max_pages=3, incremental=True)) == 9
@@ -0,0 +1,114 @@
+import json
+import time
+
+import pytest
+import requests
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    return auction
+
+
+@pytest.fixture
+def make_store(auction, tmp_path):
+    stores = []
+
+    def make(account, **kwargs):
+        store = auction.CookieStore(account, directory=str(tmp_path / "cookies"), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        if store._timer is not None:
+            store._timer.cancel()
+
+
+def cookie(name, value):
+    return {"name": name, "value": value, "domain": ".yahoo.co.jp", "path": "/"}
+
+
+def session_cookies(auction, cookies):
+    """セッションのクッキーを serialize_cookies した値 (YahooAuctionTrade.cookie_update が渡すもの)"""
+    session = requests.Session()
+    for c in cookies:
+        session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
+    return auction.serialize_cookies(session.cookies)
+
+
+def saved(store):
+    with open(store.path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def names_values(cookies):
+    return {(c["name"], c["value"]) for c in cookies}
+
+
+def test_round_trip_two_accounts_and_changed_config(auction, make_store):
+    config = {"alice": [cookie("Y", "a1")], "bob": [cookie("Y", "b1")]}
+
+    # 初回は設定ファイルの cookies を使い、すぐにファイルを作る
+    stores = {account: make_store(account, flush_interval=3600) for account in config}
+    for account, store in stores.items():
+        assert store.load(config[account]) == config[account]
+        assert saved(store)["config_digest"] == auction.CookieStore.digest(config[account])
+
+    # 更新はまとめて、flush のときだけ書き出す
+    for value in ("a2", "a3", "a4"):
+        stores["alice"].update(session_cookies(auction, [cookie("Y", value)]))
+    stores["bob"].update(session_cookies(auction, [cookie("Y", "b2")]))
+    assert names_values(saved(stores["alice"])["cookies"]) == {("Y", "a1")}
+    assert (stores["alice"].num_updates, stores["alice"].num_flushes) == (4, 1)
+    for store in stores.values():
+        store.flush()
+    assert stores["alice"].num_flushes == 2
+
+    # 同じ設定で開き直すとファイルの cookies を使う (アカウントごとに別のファイル)
+    reopened = {account: make_store(account) for account in config}
+    assert names_values(reopened["alice"].load(config["alice"])) == {("Y", "a4")}
+    assert names_values(reopened["bob"].load(config["bob"])) == {("Y", "b2")}
+
+    # alice の設定の cookies を貼り替えると、設定を読み込んでファイルを作り直す。bob はそのまま
+    config["alice"] = [cookie("Y", "a-relogin")]
+    changed = {account: make_store(account) for account in config}
+    assert changed["alice"].load(config["alice"]) == config["alice"]
+    assert names_values(saved(changed["alice"])["cookies"]) == {("Y", "a-relogin")}
+    assert saved(changed["alice"])["config_digest"] == auction.CookieStore.digest(config["alice"])
+    assert names_values(changed["bob"].load(config["bob"])) == {("Y", "b2")}
+
+
+def test_update_is_flushed_after_interval(auction, make_store):
+    updates = [session_cookies(auction, [cookie("Y", value)]) for value in ("a2", "a3")]
+    store = make_store("alice", flush_interval=0.5)
+    store.load([cookie("Y", "a1")])
+    for cookies in updates:
+        store.update(cookies)
+    for _ in range(100):
+        if store.num_flushes == 2 and store._pending is None:
+            break
+        time.sleep(0.05)
+    assert store.num_flushes == 2
+    assert names_values(saved(store)["cookies"]) == {("Y", "a3")}
+
+
+def test_legacy_list_file_is_loaded_and_upgraded(auction, make_store):
+    store = make_store("alice", flush_interval=3600)
+    store.path.parent.mkdir(parents=True)
+    store.path.write_text(json.dumps([cookie("Y", "legacy")]))
+
+    config = [cookie("Y", "config")]
+    assert names_values(store.load(config)) == {("Y", "legacy")}
+    store.update(session_cookies(auction, [cookie("Y", "legacy")]))
+    store.flush()
+    assert saved(store)["config_digest"] == auction.CookieStore.digest(config)
+
+
+def test_file_is_used_without_config(make_store):
+    store = make_store("alice")
+    assert store.load(None) is None
+    store.load([cookie("Y", "a1")])
+    assert names_values(make_store("alice").load(None)) == {("Y", "a1")}
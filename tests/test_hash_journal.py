@@ -0,0 +1,103 @@
+import pytest
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    monkeypatch.setattr(auction, "_hash_journals", {})
+    return auction
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "processed_hashes.txt"
+
+
+def test_add_appends_one_line_per_new_hash(auction, path):
+    journal = auction.HashJournal(path)
+    journal.add("a_000001")
+    journal.add("a_000002")
+    journal.add("a_000001")
+    assert path.read_text() == "a_000001\na_000002\n"
+    assert "a_000001" in journal and "a_000003" not in journal
+    assert journal.snapshot() == {"a_000001", "a_000002"}
+
+
+def test_legacy_file_without_trailing_newline(auction, path):
+    path.write_text("a_000001\na_000002")
+    journal = auction.HashJournal(path)
+    assert journal.snapshot() == {"a_000001", "a_000002"}
+
+    journal.add("a_000003")
+    assert path.read_text() == "a_000001\na_000002\na_000003\n"
+    assert auction.HashJournal(path).snapshot() == {"a_000001", "a_000002", "a_000003"}
+
+
+def test_discard_appends_tombstone(auction, path):
+    journal = auction.HashJournal(path)
+    journal.add("a_000001")
+    journal.discard("a_000001")
+    journal.discard("a_000009")  # 登録されていないハッシュは何も書かない
+    assert path.read_text() == "a_000001\n-a_000001\n"
+    assert "a_000001" not in journal
+
+    journal.add("a_000001")
+    assert "a_000001" in auction.HashJournal(path)
+
+
+def test_other_instances_see_appends(auction, path):
+    writer = auction.HashJournal(path)
+    reader = auction.HashJournal(path)
+    assert reader.snapshot() == set()
+    writer.add("a_000001")
+    assert "a_000001" in reader
+    writer.discard("a_000001")
+    writer.add("a_000002")
+    assert reader.snapshot() == {"a_000002"}
+
+
+def test_compaction_rewrites_current_set(auction, path):
+    journal = auction.HashJournal(path, fsync=False)
+    reader = auction.HashJournal(path)
+    journal.add("a_00000f")
+    assert "a_00000f" in reader
+
+    for i in range(60):
+        journal.add(f"b_{i:06x}")
+        journal.discard(f"b_{i:06x}")
+    # 100 行を超えたところで圧縮され、現在の集合だけが残る
+    lines = path.read_text().splitlines()
+    assert len(lines) < 100
+    assert journal.snapshot() == {"a_00000f"}
+
+    journal.add("a_00000e")
+    journal.compact()
+    assert path.read_text() == "a_00000e\na_00000f\n"
+    # 置き換えられたファイルを別のインスタンスも読み直す
+    assert reader.snapshot() == {"a_00000e", "a_00000f"}
+
+
+def test_remove(auction, path):
+    journal = auction.get_hash_journal(str(path))
+    journal.add("a_000001")
+    journal.add("a_000002")
+
+    auction.remove("a_000001", str(path))
+    assert auction.get_listed(str(path)) == {"a_000002"}
+    assert path.read_text().splitlines()[-1] == "-a_000001"
+    with pytest.raises(AssertionError):
+        auction.remove("a_000001", str(path))
+
+
+def test_compaction_keeps_appends_from_other_instances(auction, path):
+    journal = auction.HashJournal(path)
+    other = auction.HashJournal(path)
+    journal.add("a_000001")
+    other.add("a_000002")
+    other.compact()
+    other.add("a_000003")
+    # journal はまだ a_000002 / a_000003 や置き換えを読んでいない
+    journal.compact()
+    assert path.read_text() == "a_000001\na_000002\na_000003\n"
+    assert other.snapshot() == journal.snapshot() == {"a_000001", "a_000002", "a_000003"}
@@ -0,0 +1,57 @@
+import numpy as np
+from PIL import ImageDraw
+
+from conftest import synthetic_item, write_item
+from lib.image_filters import FanzaMosaicFilter, Filter, LabelBlurFilter, MyImage, ResizeFilter, WatermarkFilter
+
+
+class DrawInPlaceFilter(Filter):
+    """画像とマスクをその場で書き換えるフィルタ"""
+    mutates_image = True
+    mutates_masks = True
+
+    def apply(self, image_instance):
+        ImageDraw.Draw(image_instance.image).rectangle((0, 0, 10, 10), fill=(255, 0, 0, 255))
+        ImageDraw.Draw(image_instance.label_mask).rectangle((0, 0, 10, 10), fill=255)
+
+
+def load(tmp_path):
+    return MyImage(write_item(tmp_path, *synthetic_item()), skip_resolution_check=True)
+
+
+def test_read_only_filter_shares_masks(tmp_path):
+    image = load(tmp_path)
+    filtered = image.apply_filter(FanzaMosaicFilter(0.01))
+    assert filtered.label_mask is image.label_mask
+    assert all(filtered.label_masks[k] is v for k, v in image.label_masks.items())
+    assert filtered.label_masks is not image.label_masks
+    assert filtered.image is not image.image
+
+
+def test_mutating_filter_gets_copies(tmp_path):
+    image = load(tmp_path)
+    before_image = np.array(image.image)
+    before_mask = np.array(image.label_mask)
+    filtered = image.apply_filter(DrawInPlaceFilter())
+    assert filtered.image is not image.image
+    assert filtered.label_mask is not image.label_mask
+    assert (np.array(image.image) == before_image).all()
+    assert (np.array(image.label_mask) == before_mask).all()
+    assert (np.array(filtered.image)[0, 0] == (255, 0, 0, 255)).all()
+
+
+def test_chain_matches_copying_every_step(tmp_path, monkeypatch):
+    chain = [FanzaMosaicFilter(0.01), LabelBlurFilter(), WatermarkFilter(font_path="missing.ttf"), ResizeFilter(200)]
+
+    def run():
+        image = load(tmp_path)
+        for filter_instance in chain:
+            image = image.apply_filter(filter_instance)
+        return np.array(image.image)
+
+    shared = run()
+    # 以前と同じく毎回すべてをコピーした場合と結果が変わらない
+    for filter_instance in chain:
+        monkeypatch.setattr(filter_instance, "mutates_image", True)
+        monkeypatch.setattr(filter_instance, "mutates_masks", True)
+    assert (run() == shared).all()
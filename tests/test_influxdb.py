@@ -0,0 +1,199 @@
+import gzip
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+
+class FakeInfluxDB:
+    """/api/v2/write を受け付け、届いたリクエストを記録するローカルの HTTP サーバー"""
+
+    def __init__(self):
+        self.requests = []
+        self.status_code = 204
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                url = urlparse(self.path)
+                server.requests.append({
+                    "path": url.path,
+                    "params": {k: v[0] for k, v in parse_qs(url.query).items()},
+                    "headers": dict(self.headers),
+                    "lines": body.decode("utf-8").split("\n"),
+                })
+                self.send_response(server.status_code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def influx():
+    server = FakeInfluxDB()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_client(influx):
+    from lib.influxdb import InfluxDBClient
+
+    clients = []
+
+    def make(**kwargs):
+        client = InfluxDBClient(influx.url, "token", "org", "bucket", **kwargs)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        if client._timer is not None:
+            client._timer.cancel()
+        client._buffer = []
+
+
+def sales_df(n):
+    return pd.DataFrame({
+        "売上": [1000 + i for i in range(n)],
+        "決済金額": [1100 + i for i in range(n)],
+        "落札システム利用料": [100] * n,
+        "取扱日": ["2024-01-02"] * n,
+        "account": ["main"] * n,
+    }, index=pd.Index([f"x{i}" for i in range(n)], name="オークションID"))
+
+
+def test_register_db_sends_one_gzip_post_per_dataframe(influx, make_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    from lib.auction import register_db
+
+    client = make_client()
+    register_db(client, sales_df(50))
+
+    assert len(influx.requests) == 1
+    request = influx.requests[0]
+    assert request["path"] == "/api/v2/write"
+    assert request["params"] == {"org": "org", "bucket": "bucket", "precision": "ns"}
+    assert request["headers"]["Content-Encoding"] == "gzip"
+    assert request["headers"]["Authorization"] == "Token token"
+    assert len(request["lines"]) == 50
+    timestamp = pd.Timestamp("2024-01-02").value
+    assert request["lines"][0] == (
+        f"sales_test2,product_id=x0,account=main sales=1000,payment_amount=1100,system_fee=100 {timestamp}"
+    )
+    assert client.num_requests == 1
+
+
+@pytest.mark.parametrize("rows, batch_size", [(700, 300), (600, 300), (1, 300)])
+def test_batch_size_splits_lines(influx, make_client, rows, batch_size):
+    client = make_client(batch_size=batch_size)
+    df = pd.DataFrame({"value": range(rows)})
+    client.write_dataframe("m", df)
+
+    assert len(influx.requests) == math.ceil(rows / batch_size)
+    assert [len(r["lines"]) for r in influx.requests][:-1] == [batch_size] * (len(influx.requests) - 1)
+    sent = [line for r in influx.requests for line in r["lines"]]
+    assert sent == [f"m value={i}" for i in range(rows)]
+
+
+def test_buffered_lines_are_sent_when_batch_is_full(influx, make_client):
+    client = make_client(batch_size=10, flush_interval=3600)
+    client.write_dataframe("m", pd.DataFrame({"value": range(4)}), flush=False)
+    assert influx.requests == []
+    client.write_dataframe("m", pd.DataFrame({"value": range(4, 12)}), flush=False)
+    assert len(influx.requests) == 2  # 12 行がたまったので 10 行 + 2 行
+    assert client._buffer == []
+
+
+def test_gzip_can_be_disabled(influx, make_client):
+    client = make_client(gzip_level=0)
+    client.write_dataframe("m", pd.DataFrame({"value": [1]}))
+    assert "Content-Encoding" not in influx.requests[0]["headers"]
+    assert influx.requests[0]["lines"] == ["m value=1"]
+
+
+def test_tags_and_fields_are_escaped(influx, make_client):
+    client = make_client()
+    df = pd.DataFrame({
+        "tag key": ["a,b=c d"],
+        "empty": [""],
+        "field=key": ['say "hi" \\ bye'],
+        "flag": [True],
+        "missing": [float("nan")],
+        "price": [1.5],
+    })
+    client.write_dataframe(
+        "my measurement,x", df,
+        tag_columns=["tag key", "empty"], field_columns=["field=key", "flag", "missing", "price"],
+    )
+    assert influx.requests[0]["lines"] == [
+        'my\\ measurement\\,x,tag\\ key=a\\,b\\=c\\ d field\\=key="say \\"hi\\" \\\\ bye",flag=true,price=1.5'
+    ]
+
+
+def test_failed_post_keeps_unsent_lines(influx, make_client):
+    client = make_client(batch_size=2)
+    client.add_lines(["m value=0"])
+    influx.status_code = 500
+    with pytest.raises(AssertionError):
+        client.write_dataframe("m", pd.DataFrame({"value": [1, 2]}))
+    assert len(influx.requests) == 1  # 最初のバッチで失敗し、残りは送っていない
+    assert client._buffer == ["m value=0", "m value=1", "m value=2"]
+
+    influx.status_code = 204
+    client.flush()
+    sent = [line for r in influx.requests[1:] for line in r["lines"]]
+    assert sent == ["m value=0", "m value=1", "m value=2"]
+    assert client._buffer == []
+
+
+def test_connection_error_keeps_lines():
+    import requests
+    from lib.influxdb import InfluxDBClient
+
+    client = InfluxDBClient("http://127.0.0.1:9", "token", "org", "bucket", flush_interval=3600)
+    client.add_lines(["m value=1"])
+    with pytest.raises(requests.ConnectionError):
+        client.flush()
+    assert client._buffer == ["m value=1"]
+    assert client._timer is not None  # 再送が予約されている
+    client._timer.cancel()
+    client._buffer = []
+
+
+def test_timer_flush_logs_and_retries(influx, make_client, caplog):
+    client = make_client(flush_interval=0.05)
+    influx.status_code = 500
+    client.add_lines(["m value=1"])
+
+    for _ in range(100):
+        if len(influx.requests) >= 2:
+            break
+        time.sleep(0.05)
+    influx.status_code = 204
+    for _ in range(100):
+        if not client._buffer:
+            break
+        time.sleep(0.05)
+
+    assert client._buffer == []
+    assert influx.requests[-1]["lines"] == ["m value=1"]
+    assert "InfluxDB への書き込みに失敗しました" in caplog.text
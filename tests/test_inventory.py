@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    monkeypatch.setattr(auction, "_inventories", {})
+    return auction
+
+
+def touch(path, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    os.utime(path, (mtime, mtime))
+
+
+def settle(*directories):
+    """ディレクトリの更新日時を過去にする (直近に更新されたディレクトリは毎回読み直されるため)"""
+    for directory in directories:
+        os.utime(directory, (time.time() - 60, time.time() - 60))
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "items"
+    touch(root / "a" / "a_000001.jpg", 100)
+    touch(root / "a" / "a_000001_sample.jpg", 100)
+    touch(root / "a" / "a_000001_submission.jpg", 100)
+    touch(root / "a" / "a_000001_label.png", 100)
+    touch(root / "a" / "a_000002.jpg", 200)
+    touch(root / "a" / "a_000002_sample.jpg", 200)
+    touch(root / "b" / "b_000003.jpg", 300)
+    touch(root / "b" / "b_000003_label.png", 300)
+    touch(root / "b" / "notes.txt", 300)
+    settle(root / "a", root / "b")
+    return root
+
+
+def test_query_by_tag_and_variant(auction, root):
+    index = auction.InventoryIndex(str(root))
+    assert [r["hash"] for r in index.query()] == ["b_000003", "a_000002", "a_000001"]
+    assert [r["hash"] for r in index.query(["a"])] == ["a_000002", "a_000001"]
+    assert [r["hash"] for r in index.query(variant="sample")] == ["a_000002", "a_000001"]
+    assert [r["hash"] for r in index.query(variant="submission")] == ["a_000001"]
+    assert [r["hash"] for r in index.query(variant="label")] == ["b_000003", "a_000001"]
+    assert [r["hash"] for r in index.query(["a"], variant="sample", exclude={"a_000002"})] == ["a_000001"]
+    record = index.query(["b"])[0]
+    assert record["path"] == str(root / "b" / "b_000003.jpg")
+    assert index.variant_path(record, "label") == str(root / "b" / "b_000003_label.png")
+
+
+def test_only_changed_directories_are_rescanned(auction, root):
+    index = auction.InventoryIndex(str(root))
+    assert sorted(index.refresh()) == ["a", "b"]
+    assert index.refresh() == []
+
+    touch(root / "b" / "b_000004.jpg", 400)
+    settle(root / "b")
+    assert index.refresh() == ["b"]
+    assert [r["hash"] for r in index.query(["b"])] == ["b_000004", "b_000003"]
+
+    (root / "a" / "a_000002_sample.jpg").unlink()
+    settle(root / "a")
+    assert [r["hash"] for r in index.query(variant="sample")] == ["a_000001"]
+
+    for path in (root / "b").iterdir():
+        path.unlink()
+    (root / "b").rmdir()
+    assert index.refresh() == []
+    assert {r["tag"] for r in index.query()} == {"a"}
+
+
+def test_recently_modified_directory_is_rescanned_again(auction, root):
+    index = auction.InventoryIndex(str(root))
+    index.refresh()
+    touch(root / "a" / "a_000005.jpg", 500)  # 更新日時は現在のまま
+    assert index.refresh() == ["a"]
+    assert index.refresh() == ["a"]
+    settle(root / "a")
+    index.refresh()
+    assert index.refresh() == []
+
+
+def test_same_hash_in_two_tags_is_kept_per_tag(auction, root):
+    touch(root / "c" / "a_000001.jpg", 50)
+    touch(root / "c" / "a_000001_submission.jpg", 50)
+    settle(root / "c")
+    index = auction.InventoryIndex(str(root))
+
+    records = [r for r in index.query() if r["hash"] == "a_000001"]
+    assert sorted(r["tag"] for r in records) == ["a", "c"]
+    assert [r["tag"] for r in index.query(["c"])] == ["c"]
+    assert [r["tag"] for r in index.query(variant="submission")] == ["a", "c"]
+
+    # 片方のタグから消しても、もう片方の行は残る
+    (root / "c" / "a_000001.jpg").unlink()
+    settle(root / "c")
+    assert [r["tag"] for r in index.query() if r["hash"] == "a_000001"] == ["a"]
+
+
+def test_each_root_has_its_own_database(auction, root, tmp_path):
+    other = tmp_path / "other"
+    touch(other / "z" / "z_00000f.jpg", 100)
+    settle(other / "z")
+
+    assert auction.get_inventory(str(root)).db_path != auction.get_inventory(str(other)).db_path
+    assert auction.get_inventory(str(root)) is auction.get_inventory(str(root))
+    assert auction.get_original_files(root=str(other)) == [str(other / "z" / "z_00000f.jpg")]
+    assert len(auction.get_original_files(root=str(root))) == 3
+
+
+def test_old_schema_is_rebuilt(auction, root):
+    db_path = root / ".inventory.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE items (hash TEXT PRIMARY KEY, tag TEXT NOT NULL, path TEXT NOT NULL, mtime REAL NOT NULL,"
+                 " has_label INTEGER NOT NULL, has_sample INTEGER NOT NULL, has_submission INTEGER NOT NULL)")
+    conn.execute("INSERT INTO items VALUES ('x_000000', 'x', 'x', 0, 0, 0, 0)")
+    conn.commit()
+    conn.close()
+
+    index = auction.InventoryIndex(str(root))
+    assert [r["hash"] for r in index.query()] == ["b_000003", "a_000002", "a_000001"]
+
+
+def test_index_matches_glob(auction, root):
+    pattern = str(root / "*" / "*.jpg")
+    assert auction.get_original_files(root=str(root)) == auction.get_original_files(pattern)
+
+    base_pattern = str(root / "{}" / "*.jpg")
+    for suffix in ("sample", "submission", "label"):
+        indexed = auction.get_original_files_with_tags(["a", "b"], suffix=suffix, drop_missing=True, root=str(root))
+        globbed = auction.get_original_files_with_tags(["a", "b"], base_pattern, suffix=suffix, drop_missing=True)
+        assert indexed == globbed
+    # 派生ファイルのパスは従来どおり {元画像}_{suffix}.jpg
+    assert auction.get_original_files_with_tags(["a"], suffix="label", drop_missing=True, root=str(root)) == []
+    with pytest.raises(AssertionError):
+        auction.get_original_files_with_tags(["a", "b"], suffix="sample", root=str(root))
@@ -0,0 +1,51 @@
+import math
+import os
+
+import pytest
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+COMPARED = ["商品ID", "商品名", "imgid", "imgids", "ウォッチリスト", "最高落札価格", "終了日時", "落札者", "navi", "最新のメッセージ"]
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction
+    return lib.auction
+
+
+@pytest.fixture
+def mystatus_closed():
+    with open(os.path.join(DATA_DIR, "mystatus_closed.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parity_with_legacy_parser(auction, mystatus_closed):
+    assert auction.compare_item_table_parsers(mystatus_closed, apg=1) == []
+
+    df_new, next_new = auction.parse_item_table(mystatus_closed, apg=1)
+    df_old, next_old = auction.parse_item_table_legacy(mystatus_closed, apg=1)
+    assert next_new == next_old == 2
+    for column in COMPARED:
+        assert df_new[column].isna().tolist() == df_old[column].isna().tolist(), column
+        assert df_new[column].dtype == df_old[column].dtype, column
+
+
+def test_short_rows_are_padded_with_nan(auction, mystatus_closed):
+    df, _ = auction.parse_item_table(mystatus_closed, apg=1)
+    short = df[df["商品ID"] == "c1130000003"].iloc[0]
+    assert short["最高落札価格"] == 2400
+    assert short[["落札者", "最新のメッセージ", "navi", "操作"]].isna().all()
+    # 空のセルは NaN ではなく空文字
+    assert df[df["商品ID"] == "b1130000002"].iloc[0]["ウォッチリスト"] == ""
+
+
+def test_duplicate_columns_are_kept(auction, mystatus_closed):
+    df, _ = auction.parse_item_table(mystatus_closed, apg=1)
+    assert df["操作"].tolist()[:2] == ["取引ナビ", "取引ナビ"]
+    assert df["操作.1"].tolist()[:2] == ["評価", "-"]
+
+
+def test_dedup_columns_like_read_html(auction):
+    # pd.read_html(...).columns と同じ結果
+    assert auction._dedup_columns(["a", "a", "b", "a", "a.1"]) == ["a", "a.2", "b", "a.3", "a.1"]
@@ -0,0 +1,59 @@
+import numpy as np
+from PIL import Image
+
+from conftest import synthetic_item, write_item
+from lib.image_filters import DEFAULT_LABEL_COLORS, MyImage
+
+
+def reference_masks(label, scale, tolerance=2):
+    """最近傍で拡大したラベル画像から色ごとの差分で作った (新しい実装とは独立な) マスク"""
+    upscaled = np.repeat(np.repeat(label[..., :3].astype(int), scale, axis=0), scale, axis=1)
+    return {
+        name: np.all(np.abs(upscaled - np.array(color[:3])) <= tolerance, axis=-1).astype(np.uint8) * 255
+        for name, color in DEFAULT_LABEL_COLORS.items()
+    }
+
+
+def test_masks_match_nearest_neighbour_reference(tmp_path):
+    image_array, label = synthetic_item(label_scale=2)
+    image = MyImage(write_item(tmp_path, image_array, label), skip_resolution_check=True)
+    expected = reference_masks(label, 2)
+
+    for name, mask in expected.items():
+        assert (np.array(image.label_masks[name]) == mask).all(), name
+    assert (np.array(image.label_mask) == np.bitwise_or.reduce(list(expected.values()))).all()
+
+    # 許容誤差以内の行は含まれ、範囲外の行は含まれない
+    h, w = label.shape[:2]
+    assert (np.array(image.label_masks["1"])[h // 8 * 2, w // 8 * 2:w // 2 * 2] == 255).all()
+    assert (np.array(image.label_masks["5"])[h * 7 // 8 * 2, w // 2 * 2:w * 7 // 8 * 2] == 0).all()
+
+
+def test_golden_pixel_counts(tmp_path):
+    """合成画像のマスクの画素数を固定する (実装を変えてマスクが変わった場合に気付けるように)"""
+    image = MyImage(write_item(tmp_path, *synthetic_item(label_scale=2)), skip_resolution_check=True)
+    counts = {name: int((np.array(mask) > 0).sum()) for name, mask in image.label_masks.items()}
+    assert counts == {"1": 11400, "4": 4800, "5": 11100}
+    assert int((np.array(image.label_mask) > 0).sum()) == 27300
+
+
+def test_label_resize_does_not_blend_colors(tmp_path):
+    image_array, label = synthetic_item(label_scale=3)
+    image = MyImage(write_item(tmp_path, image_array, label), skip_resolution_check=True)
+    resized = image._label_cache["label_array"].reshape(-1, 3)
+    assert {tuple(color) for color in np.unique(resized, axis=0)} <= {tuple(color) for color in np.unique(label[..., :3].reshape(-1, 3), axis=0)}
+
+
+def test_masks_are_views_of_one_plane(tmp_path):
+    image = MyImage(write_item(tmp_path, *synthetic_item()), skip_resolution_check=True)
+    masks = [image._label_cache[("mask", tuple(color[:3]), image.tolerance)] for color in DEFAULT_LABEL_COLORS.values()]
+    assert all(mask.base is masks[0].base and mask.base is not None for mask in masks)
+    # derive したインスタンスは分類をやり直さない
+    derived = image.derive(label_colors={"1": DEFAULT_LABEL_COLORS["1"]})
+    assert derived._label_cache[("mask", (0, 255, 0), 2)] is masks[0]
+
+
+def test_same_size_label_is_used_as_is(tmp_path):
+    image_array, label = synthetic_item(label_scale=1)
+    image = MyImage(write_item(tmp_path, image_array, label), skip_resolution_check=True)
+    assert (image._label_cache["label_array"] == label[..., :3]).all()
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from bench_listing import FakeTrade
+
+
+class RecordingTrade(FakeTrade):
+    def __init__(self):
+        self.events = []
+        self.crumbs = 0
+        self._lock = threading.Lock()
+
+    def post_img(self, file_path, headers, img_crumb):
+        with self._lock:
+            self.events.append(("static", img_crumb))
+        return super().post_img(file_path, headers, img_crumb)
+
+    def prepare_listing(self, file_path, category, listing_session):
+        with self._lock:
+            self.crumbs += 1
+            crumb = f"crumb{self.crumbs}"
+            self.events.append(("prepare", file_path))
+        return {"images": listing_session.get_static_images({}, crumb)}
+
+    def submit_listing(self, prepared, title_name, listing_session=None, **kwargs):
+        with self._lock:
+            self.events.append(("submit_start", title_name))
+        super().submit_listing(prepared, title_name)
+        with self._lock:
+            self.events.append(("submit_end", title_name))
+        return True
+
+
+@pytest.fixture
+def ListingSession(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    from lib.auction import ListingSession
+    return ListingSession
+
+
+def configs(num):
+    return [{"file_path": f"{i}.jpg", "title_name": f"{i}"} for i in range(num)]
+
+
+def test_default_is_sequential_with_static_upload_per_form(ListingSession):
+    trade = RecordingTrade()
+    session = ListingSession(trade)
+    assert len(list(session.listing_many(configs(3)))) == 3
+
+    # 次のフォームは前の商品の出品が終わってから開く
+    order = [event for event in trade.events if event[0] != "static"]
+    assert order == [
+        ("prepare", "0.jpg"), ("submit_start", "0"), ("submit_end", "0"),
+        ("prepare", "1.jpg"), ("submit_start", "1"), ("submit_end", "1"),
+        ("prepare", "2.jpg"), ("submit_start", "2"), ("submit_end", "2"),
+    ]
+    # 共通画像はそれぞれのフォームの img_crumb でアップロードする
+    assert [event for event in trade.events if event[0] == "static"] == [
+        ("static", "crumb1"), ("static", "crumb2"), ("static", "crumb3"),
+    ]
+
+
+def test_prefetch_and_reuse_static_when_enabled(ListingSession):
+    trade = RecordingTrade()
+    session = ListingSession(trade, prefetch=True, reuse_static=True)
+    assert len(list(session.listing_many(configs(3)))) == 3
+
+    assert [event for event in trade.events if event[0] == "static"] == [("static", "crumb1")]
+    # 2件目のフォームは1件目の出品が終わる前に開く
+    assert trade.events.index(("prepare", "1.jpg")) < trade.events.index(("submit_end", "0"))
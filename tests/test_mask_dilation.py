@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from conftest import synthetic_item, write_item
+from lib.image_filters import MyImage
+
+
+@pytest.fixture(scope="module")
+def image(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("item")
+    return MyImage(write_item(directory, *synthetic_item(label_scale=1)), skip_resolution_check=True)
+
+
+def kernel(padding, shape):
+    size = 2 * padding + 1
+    if shape == "square":
+        return np.ones((size, size), dtype=np.uint8)
+    y, x = np.ogrid[-padding:padding + 1, -padding:padding + 1]
+    return (x * x + y * y <= padding * padding).astype(np.uint8)
+
+
+def reference_dilate(mask, padding, shape):
+    """構造要素を明示した cv2.dilate (画像の外はマスク外として扱う)"""
+    return cv2.dilate(mask, kernel(padding, shape), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def expand(image, mask, padding, shape):
+    return np.asarray(image._expand_mask(PILImage.fromarray(mask, mode="L"), padding, shape))
+
+
+def test_edge_pixel_does_not_wrap_to_next_row(image):
+    # 以前の1次元畳み込みでは行の右端の画素が次の行の左端へ漏れていた
+    mask = np.zeros((9, 9), dtype=np.uint8)
+    mask[4, 8] = 255
+    expanded = expand(image, mask, 2, "square")
+    assert expanded[:, :6].max() == 0
+    assert np.array_equal(expanded[2:7, 6:] > 0, np.ones((5, 3), dtype=bool))
+    assert np.count_nonzero(expanded) == 15
+
+
+@pytest.mark.parametrize("shape", ["square", "ellipse"])
+def test_single_pixel_grows_into_structuring_element(image, shape):
+    mask = np.zeros((11, 11), dtype=np.uint8)
+    mask[5, 5] = 255
+    expanded = expand(image, mask, 2, shape)
+    assert np.array_equal(expanded[3:8, 3:8] > 0, kernel(2, shape) > 0)
+    assert np.count_nonzero(expanded) == {"square": 25, "ellipse": 13}[shape]
+
+
+@pytest.mark.parametrize("shape", ["square", "ellipse"])
+@pytest.mark.parametrize("padding", [1, 3, 7, 20])
+def test_matches_dilation_with_explicit_kernel(image, shape, padding):
+    rng = np.random.default_rng(padding)
+    mask = np.where(rng.random((120, 90)) < 0.002, 255, 0).astype(np.uint8)
+    mask[:5, :5] = 255  # 画像の角に接する領域
+    assert np.array_equal(expand(image, mask, padding, shape), reference_dilate(mask, padding, shape))
+
+
+def test_empty_mask_stays_empty(image):
+    mask = np.zeros((20, 30), dtype=np.uint8)
+    assert np.count_nonzero(expand(image, mask, 300, "square")) == 0
+
+
+def test_unknown_shape_is_rejected(image):
+    with pytest.raises(ValueError):
+        expand(image, np.zeros((5, 5), dtype=np.uint8), 1, "diamond")
+
+
+def test_derive_passes_padding_shape(image):
+    square = image.derive(padding=5)
+    ellipse = image.derive(padding=5, padding_shape="ellipse")
+    for name, mask in image.label_masks.items():
+        base = np.asarray(mask)
+        assert np.array_equal(np.asarray(square.label_masks[name]), reference_dilate(base, 5, "square"))
+        assert np.array_equal(np.asarray(ellipse.label_masks[name]), reference_dilate(base, 5, "ellipse"))
@@ -0,0 +1,52 @@
+import logging
+
+import pytest
+
+from lib.image_filters import process_images
+
+
+@pytest.mark.parametrize("max_workers, mp_context", [(1, None), (2, "fork")])
+def test_errors_are_collected_in_both_paths(tmp_path, caplog, max_workers, mp_context):
+    missing = [str(tmp_path / "a" / f"a_00000{i}.jpg") for i in range(2)]
+    with caplog.at_level(logging.ERROR, logger="lib.image_filters"):
+        results = process_images(missing, max_workers=max_workers, mp_context=mp_context)
+    assert results == {"skipped": 0, "error": 2}
+    assert sorted(record.getMessage().split(":")[0] for record in caplog.records) == [
+        f"Failed to process {path}" for path in missing
+    ]
+
+
+@pytest.mark.parametrize("max_workers, mp_context", [(1, None), (2, "fork")])
+def test_submission_and_sample_are_written(tmp_path, max_workers, mp_context):
+    from conftest import synthetic_item, write_item
+    from PIL import Image
+
+    # 最低解像度 (1536x2304) ちょうどの元画像
+    image, label = synthetic_item(height=2304, width=1536, label_scale=4)
+    paths = [write_item(tmp_path / "a", image, label, name=f"a_00000{i}") for i in range(2)]
+
+    results = process_images(paths, max_workers=max_workers, mp_context=mp_context)
+    assert results == {"skipped": 0, "processed": 2}
+    for path in paths:
+        with Image.open(path.replace(".jpg", "_submission.jpg")) as submission:
+            assert submission.size == (1536, 2304)
+        with Image.open(path.replace(".jpg", "_sample.jpg")) as sample:
+            assert max(sample.size) == 500
+
+    # 作成済みのファイルはスキップする
+    assert process_images(paths, max_workers=max_workers, mp_context=mp_context) == {"skipped": 2}
+
+
+def test_low_resolution_files_are_moved(tmp_path, monkeypatch, caplog):
+    from conftest import synthetic_item, write_item
+
+    monkeypatch.chdir(tmp_path)  # ./deleted に移動する
+    path = write_item(tmp_path / "a", *synthetic_item(), name="a_000001")
+
+    with caplog.at_level(logging.WARNING, logger="lib.image_filters"):
+        results = process_images([path], max_workers=1)
+    assert results == {"skipped": 0, "deleted": 1}
+    assert "Image resolution too low: 400x600" in caplog.text
+    # 元画像とラベル画像をまとめて移動する
+    assert sorted(p.name for p in (tmp_path / "deleted").iterdir()) == ["a_000001.jpg", "a_000001_label.png"]
+    assert list((tmp_path / "a").iterdir()) == []
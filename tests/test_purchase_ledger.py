@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+from lib.netprint import PurchaseLedger
+
+
+def write_legacy(directory, usercode, files, delete_at="2025-01-31T00:00:00", mtime=1700000000):
+    """img2url_multi が保存していた形式の JSON を書く"""
+    directory.mkdir(exist_ok=True)
+    response_data = {"files": [{"deleteAt": delete_at}] * len(files)} if delete_at else {}
+    path = directory / f"{usercode}.json"
+    path.write_text(json.dumps({"files": files, "response_data": response_data}, ensure_ascii=False))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def legacy_dir(tmp_path):
+    directory = tmp_path / "print_qr"
+    write_legacy(directory, "AAAA1111", ["data/items/a/a_000001_submission.jpg", "data/items/a/a_000002_submission.jpg"])
+    write_legacy(directory, "BBBB2222", ["data/items/b/b_000003_submission.jpg"], delete_at=None, mtime=1700000100)
+    (directory / "CCCC3333.json").write_text("{broken")
+    (directory / "AAAA1111.png").write_bytes(b"")
+    return directory
+
+
+def test_legacy_files_are_migrated_once(tmp_path, legacy_dir):
+    db_path = str(tmp_path / "purchases.db")
+    ledger = PurchaseLedger(db_path, legacy_dir=str(legacy_dir))
+    assert ledger.hashes() == {"a_000001", "a_000002", "b_000003"}
+
+    history = ledger.history()
+    assert history["usercode"].tolist() == ["AAAA1111", "AAAA1111", "BBBB2222"]
+    assert history["expire_at"].iloc[:2].tolist() == ["2025-01-31T00:00:00", "2025-01-31T00:00:00"]
+    assert history["expire_at"].isna().iloc[2]
+    assert history["purchased_at"].iloc[-1].timestamp() == 1700000100
+
+    # 取り込み済みの場合は、新しい JSON があっても取り込まない
+    write_legacy(legacy_dir, "DDDD4444", ["data/items/d/d_000004_submission.jpg"])
+    reopened = PurchaseLedger(db_path, legacy_dir=str(legacy_dir))
+    assert reopened.migrate(str(legacy_dir)) == 0
+    assert len(reopened.history()) == 3
+
+
+def test_missing_legacy_dir(tmp_path):
+    ledger = PurchaseLedger(str(tmp_path / "purchases.db"), legacy_dir=str(tmp_path / "missing"))
+    assert ledger.hashes() == set()
+
+
+def test_other_connection_sees_new_purchases(tmp_path):
+    db_path = str(tmp_path / "purchases.db")
+    reader = PurchaseLedger(db_path, legacy_dir=None)
+    writer = PurchaseLedger(db_path, legacy_dir=None)
+    assert reader.hashes() == set()
+
+    writer.record(["data/items/a/a_000001_submission.jpg", "no_hash.jpg"], "AAAA1111", buyer="buyer_a")
+    # 他の接続のコミットで data_version が変わり、読み直される
+    assert reader.hashes() == {"a_000001"}
+    assert reader.history("buyer_a")["file"].tolist() == ["data/items/a/a_000001_submission.jpg"]
+
+    reader.record(["data/items/b/b_000002_submission.jpg"], "BBBB2222")
+    assert reader.hashes() == {"a_000001", "b_000002"}
+    assert writer.hashes() == {"a_000001", "b_000002"}
+
+
+def test_same_file_and_usercode_is_recorded_once(tmp_path):
+    ledger = PurchaseLedger(str(tmp_path / "purchases.db"), legacy_dir=None)
+    ledger.record(["data/items/a/a_000001_submission.jpg"], "AAAA1111")
+    ledger.record(["data/items/a/a_000001_submission.jpg"], "AAAA1111")
+    ledger.record(["data/items/a/a_000001_submission.jpg"], "BBBB2222")
+    assert len(ledger.history()) == 2
+    assert ledger.hashes() == {"a_000001"}
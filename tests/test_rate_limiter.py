@@ -0,0 +1,55 @@
+import pytest
+import requests
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    from lib.auction import RateLimiter
+    return RateLimiter()
+
+
+def make_response(url, text="", status_code=200, content_type="text/html; charset=utf-8", history=()):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.headers["Content-Type"] = content_type
+    response._content = text.encode("utf-8")
+    response.encoding = "utf-8"
+    response.history = list(history)
+    return response
+
+
+@pytest.mark.parametrize("text", [
+    "<html><head><title>ヤフオク!</title><script>var captchaEnabled = false;</script></head></html>",
+    '<form action="/sell"><input type="hidden" name=".crumb" value="x"></form><footer>reCAPTCHA で保護</footer>',
+])
+def test_normal_page_mentioning_captcha_is_not_throttled(limiter, text):
+    assert not limiter._is_throttled(make_response("https://auctions.yahoo.co.jp/sell/jp/show/submit", text))
+
+
+def test_captcha_query_parameter_is_not_throttled(limiter):
+    assert not limiter._is_throttled(make_response("https://auctions.yahoo.co.jp/search?p=captcha"))
+
+
+@pytest.mark.parametrize("url", [
+    "https://captcha.yahoo.co.jp/verify",
+    "https://login.yahoo.co.jp/captcha/challenge?done=x",
+])
+def test_captcha_redirect_is_throttled(limiter, url):
+    redirect = make_response("https://auctions.yahoo.co.jp/sell/jp/show/submit", status_code=302)
+    assert limiter._is_throttled(make_response(url, history=[redirect]))
+    assert limiter._is_throttled(make_response("https://auctions.yahoo.co.jp/", history=[make_response(url, status_code=302)]))
+
+
+@pytest.mark.parametrize("text", [
+    "<html><head><title>画像認証</title></head></html>",
+    '<form method="post"><img src="/img"><input type="text" name="captcha_answer"></form>',
+])
+def test_captcha_page_is_throttled(limiter, text):
+    assert limiter._is_throttled(make_response("https://auctions.yahoo.co.jp/sell/jp/show/submit", text))
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_status_is_throttled(limiter, status_code):
+    assert limiter._is_throttled(make_response("https://auctions.yahoo.co.jp/", status_code=status_code))
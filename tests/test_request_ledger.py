@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+import pytest
+import requests
+
+from fake_adapter import make_session, sent_error, unsent_error
+
+CONTACT_URL = "https://contact.auctions.yahoo.co.jp/seller/submit"
+FORM = {"aid": "x123", "message": "発送しました"}
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    return auction
+
+
+@pytest.fixture
+def ledger(auction, tmp_path):
+    return auction.RequestLedger(str(tmp_path / "request_ledger.db"))
+
+
+def request_hash(session):
+    return session._generate_hash(CONTACT_URL, None, FORM, None)
+
+
+def test_second_claim_is_refused(auction, ledger, tmp_path):
+    assert ledger.claim("h", "a", "POST", CONTACT_URL)
+    assert not ledger.claim("h", "b", "POST", CONTACT_URL)
+    # 別の接続 (別プロセス) からも登録できない
+    other = auction.RequestLedger(str(tmp_path / "request_ledger.db"))
+    assert not other.claim("h", "b", "POST", CONTACT_URL)
+    assert other.get("h")["account"] == "a"
+
+
+def test_expired_claim_can_be_reclaimed(auction, tmp_path):
+    ledger = auction.RequestLedger(str(tmp_path / "expired.db"), ttl=timedelta(seconds=-1))
+    assert ledger.claim("h", "a", "POST", CONTACT_URL)
+    assert ledger.get("h") is None
+    assert ledger.claim("h", "a", "POST", CONTACT_URL)
+
+
+def test_duplicate_post_is_not_sent(ledger):
+    session, adapter = make_session(ledger, [200, 200])
+    assert session.post(CONTACT_URL, data=FORM).status_code == 200
+    assert ledger.get(request_hash(session))["status_code"] == 200
+
+    with pytest.raises(Exception, match="Duplicate POST request detected"):
+        session.post(CONTACT_URL, data=FORM)
+    assert len(adapter.requests) == 1
+
+
+def test_unsent_error_releases_claim(ledger):
+    session, adapter = make_session(ledger, [unsent_error()] * 3 + [200])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.post(CONTACT_URL, data=FORM)
+    # 届いていないことが確実なので、POST でも上限まで再試行し、登録は取り消される
+    assert len(adapter.requests) == 3
+    assert ledger.get(request_hash(session)) is None
+
+    assert session.post(CONTACT_URL, data=FORM).status_code == 200
+    assert len(adapter.requests) == 4
+
+
+def test_unsent_error_then_success_is_retried(ledger):
+    session, adapter = make_session(ledger, [unsent_error(), 200])
+    assert session.post(CONTACT_URL, data=FORM).status_code == 200
+    assert len(adapter.requests) == 2
+    assert ledger.get(request_hash(session))["status_code"] == 200
+
+
+def test_sent_but_failed_post_stays_claimed(ledger):
+    session, adapter = make_session(ledger, [sent_error(), 200])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.post(CONTACT_URL, data=FORM)
+    assert len(adapter.requests) == 1  # 再試行しない
+    record = ledger.get(request_hash(session))
+    assert record is not None and record["status_code"] is None
+
+    with pytest.raises(Exception, match="Duplicate POST request detected"):
+        session.post(CONTACT_URL, data=FORM)
+    assert len(adapter.requests) == 1
+
+
+def test_server_error_releases_claim_without_retry(ledger):
+    session, adapter = make_session(ledger, [500, 200])
+    with pytest.raises(requests.exceptions.HTTPError):
+        session.post(CONTACT_URL, data=FORM)
+    assert len(adapter.requests) == 1
+    assert ledger.get(request_hash(session)) is None
+
+
+def test_other_hosts_are_not_recorded(ledger):
+    session, adapter = make_session(ledger, [200, 200])
+    session.post("https://auctions.yahoo.co.jp/sell/submit", data=FORM)
+    session.post("https://auctions.yahoo.co.jp/sell/submit", data=FORM)
+    assert len(adapter.requests) == 2
+    assert ledger.history().empty
@@ -0,0 +1,98 @@
+import pytest
+import requests
+import urllib3
+
+from fake_adapter import make_session, sent_error, unsent_error
+
+URL = "https://auctions.yahoo.co.jp/sell/jp/show/submit"
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    return auction
+
+
+@pytest.fixture
+def session_with(auction, tmp_path):
+    ledger = auction.RequestLedger(str(tmp_path / "request_ledger.db"))
+    return lambda script: make_session(ledger, script)
+
+
+def stats_of(session, method):
+    df = session.request_stats.stats()
+    return df[df["endpoint"] == f"{method} auctions.yahoo.co.jp/sell/jp/show/submit"].iloc[0]
+
+
+def test_is_unsent_error(auction):
+    assert auction.is_unsent_error(unsent_error())
+    assert auction.is_unsent_error(requests.exceptions.ConnectTimeout())
+    assert not auction.is_unsent_error(sent_error())
+    assert not auction.is_unsent_error(requests.exceptions.ConnectionError(urllib3.exceptions.ProtocolError("aborted")))
+    assert not auction.is_unsent_error(requests.exceptions.ConnectionError())
+
+
+@pytest.mark.parametrize("failures", [
+    [500, 503],
+    [429],
+    [requests.exceptions.ConnectionError(urllib3.exceptions.ProtocolError("Connection aborted")), sent_error()],
+])
+def test_get_retries_transient_errors(session_with, failures):
+    session, adapter = session_with(failures + [200])
+    assert session.get(URL).status_code == 200
+    assert len(adapter.requests) == len(failures) + 1
+
+    stats = stats_of(session, "GET")
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (1, len(failures), 0)
+
+
+def test_get_gives_up_after_max_attempts(session_with):
+    session, adapter = session_with([500] * 5)
+    with pytest.raises(requests.exceptions.HTTPError):
+        session.get(URL)
+    assert len(adapter.requests) == 4  # RETRY_POLICIES["GET"]["max_attempts"]
+
+    stats = stats_of(session, "GET")
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (1, 3, 1)
+
+
+def test_get_does_not_retry_client_errors(session_with):
+    session, adapter = session_with([404])
+    with pytest.raises(requests.exceptions.HTTPError):
+        session.get(URL)
+    assert len(adapter.requests) == 1
+
+
+@pytest.mark.parametrize("error", [500, sent_error()])
+def test_post_is_not_retried_once_sent(session_with, error):
+    session, adapter = session_with([error, 200])
+    with pytest.raises((requests.exceptions.HTTPError, requests.exceptions.ReadTimeout)):
+        session.post(URL, data={"a": 1})
+    assert len(adapter.requests) == 1
+
+    stats = stats_of(session, "POST")
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (1, 0, 1)
+
+
+def test_post_retries_unsent_errors(session_with):
+    session, adapter = session_with([unsent_error(), unsent_error(), 200])
+    assert session.post(URL, data={"a": 1}).status_code == 200
+    assert len(adapter.requests) == 3
+
+    stats = stats_of(session, "POST")
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (1, 2, 0)
+
+
+def test_post_gives_up_after_max_attempts(session_with):
+    session, adapter = session_with([unsent_error()] * 4)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.post(URL, data={"a": 1})
+    assert len(adapter.requests) == 3  # RETRY_POLICIES["POST"]["max_attempts"]
+
+
+def test_each_attempt_consumes_rate_limit(session_with):
+    session, adapter = session_with([503, 200])
+    session.get(URL)
+    stats = session.rate_limiter.stats()
+    assert stats.loc[stats["kind"] == "read", "requests"].item() == 2
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+PAYMENT_MAIL = """\
+ヤフオク!をご利用いただきありがとうございます。
+
+落札者が以下のオークションの支払い手続きを完了しました。
+
+オークションID：x123456789
+商品名：a_0f1e2d
+取引ナビ：https://contact.auctions.yahoo.co.jp/seller/top?aid=x123456789&syid=seller&bid=buyer_a
+
+オークションID: x987654321
+商品名：a_3c4b5a
+取引ナビ：https://contact.auctions.yahoo.co.jp/seller/top?syid=seller&aid=x987654321&bid=buyer_a
+
+オークションID : 1122334455
+取引ナビ：https://contact.auctions.yahoo.co.jp/seller/top?aid=1122334455&bid=buyer_b
+
+お問い合わせ: https://support.yahoo-net.jp/?said=999 (取引とは関係のない URL)
+"""
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    return auction
+
+
+def test_extract_auction_ids_dedupes_in_order(auction):
+    assert auction.extract_auction_ids(PAYMENT_MAIL) == ["x123456789", "x987654321", "1122334455"]
+
+
+def test_extract_auction_ids_without_ids(auction):
+    assert auction.extract_auction_ids("支払いが完了しました。") == []
+
+
+class FakeTrade:
+    """ship_paid が呼ぶ get_closed_df と ship を記録する"""
+
+    def __init__(self, auction, closed_df):
+        self.trade = auction.YahooAuctionTrade.__new__(auction.YahooAuctionTrade)
+        self.trade.get_closed_df = self.get_closed_df
+        self.trade.ship = self.ship
+        self.closed_df = closed_df
+        self.closed_calls = []
+        self.ship_calls = []
+
+    def get_closed_df(self, **kwargs):
+        self.closed_calls.append(kwargs)
+        return self.closed_df
+
+    def ship(self, gift_image_candidates=None, gift_threshold=1000, buyer=None, trades=None):
+        self.ship_calls.append({"gift": gift_image_candidates, "threshold": gift_threshold, "buyer": buyer, "trades": trades})
+
+
+def closed_df():
+    return pd.DataFrame({
+        "商品ID": ["x123456789", "x987654321", "1122334455", "x555555555"],
+        "落札者": ["buyer_a", "buyer_a", "buyer_b", "buyer_c"],
+    })
+
+
+def test_ship_paid_ships_once_per_buyer(auction):
+    fake = FakeTrade(auction, closed_df())
+    fake.trade.ship_paid(PAYMENT_MAIL, ["gift.jpg"], 2000)
+
+    assert fake.closed_calls == [{"incremental": True}]
+    assert [call["buyer"] for call in fake.ship_calls] == ["buyer_a", "buyer_b"]
+    for call in fake.ship_calls:
+        assert call["trades"] is fake.closed_df
+        assert (call["gift"], call["threshold"]) == (["gift.jpg"], 2000)
+
+
+def test_ship_paid_falls_back_to_all_trades(auction):
+    fake = FakeTrade(auction, closed_df())
+    fake.trade.ship_paid("オークションID：x000000001", ["gift.jpg"])
+    assert fake.ship_calls == [{"gift": ["gift.jpg"], "threshold": 1000, "buyer": None, "trades": None}]
+
+
+def test_ship_paid_with_empty_closed_list(auction):
+    fake = FakeTrade(auction, pd.DataFrame())
+    fake.trade.ship_paid(PAYMENT_MAIL)
+    assert [call["buyer"] for call in fake.ship_calls] == [None]
@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+class FakeChecker:
+    def __init__(self, events, account, poll_results=(), start_result=True):
+        """
+        :param poll_results: poll_once が順に返す値 (尽きたら True)
+        """
+        self.events = events
+        self.account = account
+        self.poll_results = list(poll_results)
+        self.start_result = start_result
+        self.idle_timeout = 1500
+        self.polls = 0
+        self.dispatcher = ThreadPoolExecutor(max_workers=1)
+
+    def start(self, include_last_n=0, retry_failed=False):
+        return self.start_result
+
+    def poll_once(self):
+        self.polls += 1
+        return self.poll_results.pop(0) if self.poll_results else True
+
+    def supports_idle(self):
+        return True
+
+    def stop(self):
+        self.events.append(("stop", self.account))
+
+
+class FakeTrade:
+    def __init__(self, events, account, fail=False):
+        self.events = events
+        self.account = account
+        self.fail = fail
+
+    def listing_auto(self):
+        self.events.append(("listing_start", self.account))
+        time.sleep(0.05)
+        self.events.append(("listing_end", self.account))
+        if self.fail:
+            raise RuntimeError("listing failed")
+
+    def flush_cookies(self):
+        self.events.append(("flush_cookies", self.account))
+
+
+class FakePoller:
+    def __init__(self, events, account, **checker_kwargs):
+        self.account = account
+        self.checker = FakeChecker(events, account, **checker_kwargs)
+        self.yat = FakeTrade(events, account, fail=account == "bob")
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+
+@pytest.fixture
+def supervisor_module(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction_supervisor as supervisor_module
+    return supervisor_module
+
+
+@pytest.fixture
+def make_supervisor(supervisor_module, monkeypatch):
+    events = []
+    monkeypatch.setattr(supervisor_module, "get_original_files", lambda root=None: [f"{root}/a/a_000001.jpg"])
+    monkeypatch.setattr(
+        supervisor_module, "process_images",
+        lambda files, override=False, mp_context=None: events.append(("process_images", mp_context)),
+    )
+
+    def make(pollers, poll_interval=600):
+        # アカウント設定を読まないよう、フェイクの AccountPoller を持つインスタンスを作る
+        supervisor = supervisor_module.Supervisor.__new__(supervisor_module.Supervisor)
+        supervisor.poll_interval = poll_interval
+        supervisor.pollers = {account: FakePoller(events, account, **kwargs) for account, kwargs in pollers.items()}
+        supervisor.listing_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="listing")
+        return supervisor, events
+
+    return make
+
+
+def stop_after(supervisor_module, monkeypatch, calls, on_call=None):
+    """wait_for_new_mail を置き換え、calls 回目で KeyboardInterrupt を送出する"""
+    waits = []
+
+    def wait(checkers, timeout):
+        waits.append((sorted(c.account for c in checkers), timeout))
+        if on_call:
+            on_call(len(waits))
+        if len(waits) >= calls:
+            raise KeyboardInterrupt
+        return set()
+
+    monkeypatch.setattr(supervisor_module, "wait_for_new_mail", wait)
+    return waits
+
+
+def test_listing_runs_accounts_one_after_another(make_supervisor):
+    supervisor, events = make_supervisor({"alice": {}, "bob": {}, "carol": {}})
+    supervisor.listing_all()
+    supervisor.listing_executor.shutdown(wait=True)
+
+    assert events[0] == ("process_images", "spawn")
+    assert events[1:] == [
+        ("listing_start", "alice"), ("listing_end", "alice"),
+        ("listing_start", "bob"), ("listing_end", "bob"),  # bob の例外は他のアカウントを止めない
+        ("listing_start", "carol"), ("listing_end", "carol"),
+    ]
+
+
+def test_shutdown_waits_for_listing_before_flushing_cookies(supervisor_module, make_supervisor, monkeypatch):
+    supervisor, events = make_supervisor({"alice": {}, "bob": {}})
+    stop_after(supervisor_module, monkeypatch, 1, on_call=lambda n: supervisor.listing_all())
+    supervisor.mail_polling()
+
+    flushes = [i for i, event in enumerate(events) if event[0] == "flush_cookies"]
+    last_listing = max(i for i, event in enumerate(events) if event[0] == "listing_end")
+    assert len(flushes) == 2 and last_listing < min(flushes)
+    assert {("stop", "alice"), ("stop", "bob")} <= set(events)
+
+
+def test_failed_poller_is_logged_and_reconnected(supervisor_module, make_supervisor, monkeypatch, caplog):
+    supervisor, events = make_supervisor({"alice": {"poll_results": [True, False, False]}, "bob": {}}, poll_interval=0.05)
+    waits = stop_after(supervisor_module, monkeypatch, 6, on_call=lambda n: time.sleep(0.06))
+    supervisor.mail_polling()
+
+    alice = supervisor.pollers["alice"].checker
+    assert "alice メールサーバーに再接続できないため監視を止めます" in caplog.text
+    assert "alice メールサーバーに再接続し、監視を再開しました" in caplog.text
+    # 監視から外している間も他のアカウントは監視を続け、再接続できたら戻す
+    assert waits[1][0] == ["bob"]
+    assert waits[-1][0] == ["alice", "bob"]
+    assert alice.polls >= 4
+
+
+def test_account_that_cannot_start_is_skipped(supervisor_module, make_supervisor, monkeypatch, caplog):
+    supervisor, events = make_supervisor({"alice": {"start_result": False}, "bob": {}})
+    waits = stop_after(supervisor_module, monkeypatch, 2)
+    supervisor.mail_polling()
+    assert "alice メールサーバーに接続できませんでした" in caplog.text
+    assert supervisor.pollers["alice"].checker.polls == 0
+    assert all(accounts == ["bob"] for accounts, _ in waits)
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def auction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # auction.log をリポジトリに作らない
+    import lib.auction as auction
+    return auction
+
+
+@pytest.fixture
+def store(auction, tmp_path):
+    return auction.TradeStatusStore(str(tmp_path / "trade_status.db"))
+
+
+NAVI = "https://contact.auctions.yahoo.co.jp/seller/top?aid=x1"
+
+
+def test_put_writes_only_on_change(auction, store):
+    S = auction.TransactionStatus
+    assert store.put(NAVI, S.PAYMENT, False, {"crumb": "a"}, None)
+    assert not store.put(NAVI, S.PAYMENT, False, {"crumb": "a"}, None)
+    assert store.put(NAVI, S.SHIPPING, False, {"crumb": "a"}, None)
+    assert store.history(NAVI)["status"].tolist() == ["PAYMENT", "SHIPPING"]
+
+    record = store.get(NAVI)
+    assert (record["status"], record["is_matome"], record["values"]) == (S.SHIPPING, False, {"crumb": "a"})
+
+
+def test_changed_form_values_are_written(auction, store):
+    S = auction.TransactionStatus
+    store.put(NAVI, S.SHIPPING, False, {"crumb": "old"}, None)
+    updated_at = store.get(NAVI)["updated_at"]
+
+    assert store.put(NAVI, S.SHIPPING, False, {"crumb": "new"}, None)
+    record = store.get(NAVI)
+    assert record["values"] == {"crumb": "new"}
+    # ステータスは変わっていないため、履歴と updated_at はそのまま
+    assert record["updated_at"] == updated_at
+    assert len(store.history(NAVI)) == 1
+
+
+def test_checked_at_falls_back_to_updated_at_after_restart(auction, store, tmp_path):
+    S = auction.TransactionStatus
+    store.put(NAVI, S.PAYMENT, False, {}, None)
+    time.sleep(0.01)
+    store.put(NAVI, S.PAYMENT, False, {}, None)
+    record = store.get(NAVI)
+    assert record["checked_at"] > record["updated_at"]
+
+    reopened = auction.TradeStatusStore(str(tmp_path / "trade_status.db"))
+    record = reopened.get(NAVI)
+    assert record["checked_at"] == record["updated_at"]
+
+
+@pytest.mark.parametrize("status, age, fresh", [
+    ("RECEIPT", 10 ** 8, True),
+    ("INITIATED", 30, True),
+    ("INITIATED", 90, False),
+    ("PAYMENT", 30, True),
+    ("PAYMENT", 90, False),
+    ("SHIPPING", 0.5, False),
+])
+def test_ttl_per_status(auction, status, age, fresh):
+    record = {"status": auction.TransactionStatus[status], "checked_at": time.time() - age}
+    assert auction.is_status_fresh(record) is fresh
+
+
+def test_ttl_override_and_missing_record(auction):
+    S = auction.TransactionStatus
+    record = {"status": S.PAYMENT, "checked_at": time.time() - 90}
+    assert auction.is_status_fresh(record, ttl={S.PAYMENT: 120})
+    assert not auction.is_status_fresh({"status": S.RECEIPT, "checked_at": time.time()}, ttl={S.RECEIPT: 0})
+    assert not auction.is_status_fresh(None)
+
+
+def test_resolve_statuses_fetches_only_stale_records(auction, store):
+    S = auction.TransactionStatus
+    urls = {status: f"{NAVI}{status.value}" for status in S}
+    for status, url in urls.items():
+        store.put(url, status, False, {"crumb": "cached"}, None)
+
+    trade = auction.YahooAuctionTrade.__new__(auction.YahooAuctionTrade)
+    trade.status_store = store
+    fetched = []
+
+    def get_status(url, refresh=False):
+        fetched.append(url)
+        return S.SHIPPING, False, {"crumb": "fresh"}, None
+
+    trade.get_status = get_status
+    df = trade.resolve_statuses(list(urls.values()))
+    # SHIPPING は有効期間 0 のため毎回取得する
+    assert fetched == [urls[S.SHIPPING]]
+    assert df.set_index("navi").loc[urls[S.SHIPPING], "values"] == {"crumb": "fresh"}
+    assert df.set_index("navi").loc[urls[S.RECEIPT], "values"] == {"crumb": "cached"}
+
+    fetched.clear()
+    trade.resolve_statuses(list(urls.values()), refresh=True)
+    assert sorted(fetched) == sorted(urls.values())
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from fake_imap import FakeIMAPServer
+from lib.ymail import CallbackDispatcher, CallbackQueue, IMAPNewMailCheckerByUID, wait_for_new_mail
+
+
+@pytest.fixture
+def make_checker(tmp_path):
+    servers, checkers = [], []
+
+    def make(idle=True, **kwargs):
+        server = FakeIMAPServer(idle=idle)
+        servers.append(server)
+        dispatcher = CallbackDispatcher(max_workers=1, queue=CallbackQueue(str(tmp_path / f"queue{len(servers)}.db")))
+        checker = IMAPNewMailCheckerByUID(
+            email_address=f"test{len(servers)}-{time.monotonic_ns()}@example.com",
+            password="password",
+            server="127.0.0.1",
+            port=server.port,
+            use_ssl=False,
+            dispatcher=dispatcher,
+            **kwargs,
+        )
+        checkers.append(checker)
+        return server, checker
+
+    yield make
+    for checker in checkers:
+        checker.stop()
+        checker.dispatcher.shutdown(wait=True)
+    for server in servers:
+        server.close()
+
+
+def test_wakes_on_exists(make_checker):
+    server, checker = make_checker()
+    assert checker.start()
+    assert checker.supports_idle()
+
+    threading.Timer(0.3, server.add_message, args=("支払いが完了しました",)).start()
+    started = time.monotonic()
+    assert checker.wait_for_new_mail()
+    assert time.monotonic() - started < 5
+    assert checker.exists == 1
+
+
+def test_exists_buffered_with_continuation(make_checker):
+    """「+ idling」と同じセグメントで届いた EXISTS で起きる (select だけでは検知できない)"""
+    server, checker = make_checker()
+    assert checker.start()
+    server.add_message("支払いが完了しました", notify=False)
+    server.exists_with_continuation = True
+
+    started = time.monotonic()
+    assert wait_for_new_mail([checker], timeout=5) == {checker}
+    assert time.monotonic() - started < 1
+
+
+def test_exists_during_previous_command(make_checker):
+    """前回の UID SEARCH の途中で届いた EXISTS で、IDLE を張らずにすぐ起きる"""
+    server, checker = make_checker()
+    assert checker.start()
+    server.add_message("支払いが完了しました", notify=False)
+    server.exists_during_search = True
+    checker.poll_once()
+
+    started = time.monotonic()
+    assert wait_for_new_mail([checker], timeout=5) == {checker}
+    assert time.monotonic() - started < 1
+    assert server.idle_count == 0
+
+
+def test_idle_reissued_after_timeout(make_checker):
+    server, checker = make_checker(idle_timeout=0.3)
+    assert checker.start()
+
+    for _ in range(3):
+        assert not checker.wait_for_new_mail()
+        assert checker.poll_once()
+    assert server.idle_count == 3
+    assert server.commands.count("DONE") == 3
+    assert checker.connection_stats()["reconnects"] == 0
+
+    received = []
+    checker.register_callback(subject_pattern="支払い", callback=received.append, name="payment")
+    threading.Timer(0.1, server.add_message, args=("支払いが完了しました",)).start()
+    assert checker.wait_for_new_mail()
+    assert checker.poll_once()
+    checker.dispatcher.shutdown(wait=True)
+    assert [mail_msg.subject for mail_msg in received] == ["支払いが完了しました"]
+
+
+def test_falls_back_to_polling_without_idle(make_checker):
+    server, checker = make_checker(idle=False, poll_interval=0.3)
+    assert checker.start()
+    assert not checker.supports_idle()
+
+    received = []
+    checker.register_callback(subject_pattern="支払い", callback=received.append, name="payment")
+    server.add_message("支払いが完了しました")
+    started = time.monotonic()
+    assert not checker.wait_for_new_mail()
+    assert time.monotonic() - started >= 0.3
+    assert checker.poll_once()
+    checker.dispatcher.shutdown(wait=True)
+    assert server.idle_count == 0
+    assert [mail_msg.body.strip() for mail_msg in received] == ["hello"]
+
+
+def test_uidvalidity_change_is_logged(make_checker, caplog):
+    server, checker = make_checker()
+    assert checker.start()
+    server.uidvalidity = 2
+    checker.reconnect(delay=0)
+    assert checker.uidvalidity == 2
+    assert "UIDVALIDITY changed: 1 -> 2" in caplog.text
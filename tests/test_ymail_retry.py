@@ -0,0 +1,77 @@
+import time
+
+from fake_imap import FakeIMAPServer
+from lib.ymail import CallbackDispatcher, CallbackQueue, IMAPNewMailCheckerByUID
+
+
+def run_checker(server, db_path, callback, **start_kwargs):
+    checker = IMAPNewMailCheckerByUID(
+        email_address=f"retry-{time.monotonic_ns()}@example.com",
+        password="password",
+        server="127.0.0.1",
+        port=server.port,
+        use_ssl=False,
+        dispatcher=CallbackDispatcher(max_workers=1, queue=CallbackQueue(db_path)),
+    )
+    checker.register_callback(subject_pattern="支払い", callback=callback, name="payment")
+    assert checker.start(**start_kwargs)
+    return checker
+
+
+def test_failed_callback_is_retried(tmp_path):
+    server = FakeIMAPServer()
+    db_path = str(tmp_path / "queue.db")
+    calls = []
+
+    def flaky(mail_msg):
+        calls.append(mail_msg.uid)
+        if len(calls) == 1:
+            raise RuntimeError("ship failed")
+
+    # 1回目は失敗して failed のまま残る
+    checker = run_checker(server, db_path, flaky)
+    uid = server.add_message("支払いが完了しました")
+    checker.poll_once()
+    checker.stop()
+    checker.dispatcher.shutdown(wait=True)
+    assert [job["uid"] for job in checker.dispatcher.queue.failed(checker.source)] == [uid]
+
+    # 再起動しただけでは再実行しない
+    checker = run_checker(server, db_path, flaky)
+    checker.poll_once()
+    checker.dispatcher.shutdown(wait=True)
+    checker.stop()
+    assert calls == [uid]
+
+    # -n で読み直すと失敗したものを再実行する
+    checker = run_checker(server, db_path, flaky, include_last_n=1)
+    checker.poll_once()
+    checker.dispatcher.shutdown(wait=True)
+    checker.stop()
+    assert calls == [uid, uid]
+    assert checker.dispatcher.queue.failed(checker.source) == []
+    server.close()
+
+
+def test_retry_failed_while_running(tmp_path):
+    server = FakeIMAPServer()
+    calls = []
+
+    def flaky(mail_msg):
+        calls.append(mail_msg.uid)
+        if len(calls) == 1:
+            raise RuntimeError("ship failed")
+
+    checker = run_checker(server, str(tmp_path / "queue.db"), flaky)
+    uid = server.add_message("支払いが完了しました")
+    checker.poll_once()
+    deadline = time.monotonic() + 5
+    while not checker.dispatcher.queue.failed(checker.source) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert checker.retry_failed() == 1
+    checker.dispatcher.shutdown(wait=True)
+    checker.stop()
+    assert calls == [uid, uid]
+    assert checker.retry_failed() == 0
+    server.close()
@@ -1,13 +1,25 @@
 import imaplib
 import email
+import json
+import logging
+import select
+import sqlite3
+import ssl
+import statistics
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from email.header import decode_header
 import re
 import time
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from email.message import Message
 from typing import List, Optional
 import fcntl
 
+logger = logging.getLogger(__name__)
+
 def safe_decode(value):
     """安全にデコードする関数"""
     if isinstance(value, bytes):
@@ -31,6 +43,7 @@ class MailMessage:
     cc: Optional[str] = ""
     body: str = ""
     attachments: List[Attachment] = field(default_factory=list)
+    received_at: Optional[float] = None  # サーバーの受信日時 (INTERNALDATE, UNIX 時刻)
 
     @staticmethod
     def from_email_message(uid: int, msg: Message) -> 'MailMessage':
@@ -103,6 +116,240 @@ def get_attachments(msg) -> List[Attachment]:
             attachments.append(Attachment(filename=filename, content_type=content_type, size=size))
     return attachments
 
+def uid_set(uids) -> str:
+    """UID のリストを "1:3,5,7:9" 形式の集合に変換する。"""
+    uids = sorted(set(uids))
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+def _fetch_result(meta: bytes, literals: dict):
+    uid = re.search(rb"UID (\d+)", meta)
+    if uid:
+        yield int(uid.group(1)), meta, literals
+
+class CallbackQueue:
+    """
+    コールバックの実行待ちを保存する永続キュー (SQLite, WALモード)。
+    取得済みでまだ処理していないメールが、プロセスが落ちても失われないようにする。
+    メールボックスごと (UIDVALIDITY ごと) の処理済み UID のチェックポイントも同じトランザクションで保存する。
+    """
+
+    def __init__(self, db_path="mail_queue.db"):
+        """
+        :param db_path: SQLite ファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                callback TEXT NOT NULL,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (source, uidvalidity, uid, callback)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                source TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source, uidvalidity)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+    def enqueue_many(self, source: str, uidvalidity: int, items, last_uid: int = None) -> List[dict]:
+        """
+        (uid, コールバック名, MailMessage) をまとめて1つのトランザクションで保存する。
+        既に保存済みの組み合わせは無視する。
+
+        :param last_uid: 指定した場合、同じトランザクションでチェックポイントをこの UID まで進める
+        :return: 新しく保存したジョブのリスト
+        """
+        now = time.time()
+        jobs = []
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                for uid, callback, mail_msg in items:
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO jobs (source, uidvalidity, uid, callback, message, status, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)",
+                        (source, uidvalidity, uid, callback, json.dumps(asdict(mail_msg), ensure_ascii=False), now, now)
+                    )
+                    if cursor.rowcount:
+                        jobs.append({"id": cursor.lastrowid, "source": source, "uid": uid,
+                                     "callback": callback, "mail_msg": mail_msg})
+                if last_uid is not None:
+                    self.conn.execute("""
+                        INSERT INTO checkpoints (source, uidvalidity, last_uid, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(source, uidvalidity) DO UPDATE SET
+                            last_uid = MAX(last_uid, excluded.last_uid),
+                            updated_at = excluded.updated_at
+                    """, (source, uidvalidity, last_uid, now))
+        return jobs
+
+    def get_checkpoint(self, source: str, uidvalidity: int) -> Optional[int]:
+        """保存済みのチェックポイント (処理済みの最大 UID) を返す。なければ None。"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT last_uid FROM checkpoints WHERE source = ? AND uidvalidity = ?", (source, uidvalidity)
+            ).fetchone()
+        return row[0] if row else None
+
+    def unfinished(self, source: str) -> List[dict]:
+        """前回のプロセスで処理が終わっていないジョブを古い順に返す。"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, uid, callback, message FROM jobs WHERE source = ? AND status IN ('pending', 'running') ORDER BY id",
+                (source,)
+            ).fetchall()
+        jobs = []
+        for job_id, uid, callback, message in rows:
+            data = json.loads(message)
+            data["attachments"] = [Attachment(**attachment) for attachment in data["attachments"]]
+            jobs.append({"id": job_id, "source": source, "uid": uid, "callback": callback, "mail_msg": MailMessage(**data)})
+        return jobs
+
+    def failed(self, source: str) -> List[dict]:
+        """失敗したジョブ (自動では再実行しない) を古い順に返す。"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, uid, callback, error, updated_at FROM jobs WHERE source = ? AND status = 'failed' ORDER BY id",
+                (source,)
+            ).fetchall()
+        return [{"id": job_id, "uid": uid, "callback": callback, "error": error, "updated_at": updated_at}
+                for job_id, uid, callback, error, updated_at in rows]
+
+    def requeue_failed(self, source: str, uidvalidity: int = None, min_uid: int = None) -> List[int]:
+        """
+        失敗したジョブを実行待ち (pending) に戻す。
+        :param uidvalidity: 指定した場合、この UIDVALIDITY のジョブだけを戻す
+        :param min_uid: 指定した場合、この UID 以降のジョブだけを戻す
+        :return: 戻したジョブの id のリスト
+        """
+        where = "source = ? AND status = 'failed'"
+        params = [source]
+        if uidvalidity is not None:
+            where += " AND uidvalidity = ?"
+            params.append(uidvalidity)
+        if min_uid is not None:
+            where += " AND uid >= ?"
+            params.append(min_uid)
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                job_ids = [row[0] for row in self.conn.execute(f"SELECT id FROM jobs WHERE {where} ORDER BY id", params)]
+                self.conn.execute(
+                    f"UPDATE jobs SET status = 'pending', error = NULL, updated_at = ? WHERE {where}", [time.time()] + params
+                )
+        return job_ids
+
+    def set_status(self, job_id: int, status: str, error: str = None):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+
+class CallbackDispatcher:
+    """
+    コールバックをワーカースレッドで実行するクラス。
+    コールバックごとの同時実行数の上限と、同じキーのジョブを順番に1つずつ実行する制御を行う。
+    """
+
+    def __init__(self, max_workers=4, queue: CallbackQueue = None):
+        """
+        :param max_workers: ワーカースレッドの数
+        :param queue: 永続キュー (None の場合は mail_queue.db を使う)
+        """
+        self.queue = queue or CallbackQueue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mail-callback")
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._waiting = deque()
+        self._running = {}
+        self._active_keys = set()
+
+    def register(self, source: str, name: str, func, max_concurrency=1, key=None):
+        """
+        :param source: メールボックスを表す文字列 (アカウント/メールボックス)
+        :param name: コールバック名 (永続キューに保存する)
+        :param func: MailMessage を受け取る関数
+        :param max_concurrency: このコールバックの同時実行数の上限
+        :param key: MailMessage から直列化のキーを返す関数 (None の場合は source とコールバック名)
+        """
+        self._handlers[(source, name)] = {
+            "func": func,
+            "max_concurrency": max_concurrency,
+            "key": key or (lambda mail_msg: f"{source}:{name}"),
+        }
+
+    def submit(self, jobs: List[dict]):
+        """永続キューに保存済みのジョブを実行待ちに加える。"""
+        with self._lock:
+            self._waiting.extend(jobs)
+        self._schedule()
+
+    def _schedule(self):
+        with self._lock:
+            blocked_keys = set()
+            for job in list(self._waiting):
+                handler = self._handlers.get((job["source"], job["callback"]))
+                if handler is None:
+                    continue
+                key = handler["key"](job["mail_msg"])
+                # 同じキーの先行ジョブが待っている間は追い越さない
+                if key in self._active_keys or key in blocked_keys \
+                        or self._running.get(handler["func"], 0) >= handler["max_concurrency"]:
+                    blocked_keys.add(key)
+                    continue
+                self._waiting.remove(job)
+                self._active_keys.add(key)
+                self._running[handler["func"]] = self._running.get(handler["func"], 0) + 1
+                self.executor.submit(self._run, job, handler, key)
+
+    def _run(self, job, handler, key):
+        self.queue.set_status(job["id"], "running")
+        try:
+            handler["func"](job["mail_msg"])
+            self.queue.set_status(job["id"], "done")
+        except Exception:
+            # 発送などの副作用があるため自動では再実行しない (retry_failed か -n で再実行する)
+            error = traceback.format_exc()
+            logger.error(f"Callback {job['callback']} failed ({job['source']} uid={job['uid']}):\n{error}")
+            self.queue.set_status(job["id"], "failed", error)
+        finally:
+            with self._lock:
+                self._active_keys.discard(key)
+                self._running[handler["func"]] -= 1
+            self._schedule()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._waiting) + sum(self._running.values())
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
 class IMAPNewMailCheckerByUID:
     """
     UID ベースで“新規”メールだけを定期的に取得し、正規表現フィルタがヒットしたら
@@ -118,7 +365,24 @@ class IMAPNewMailCheckerByUID:
         port: int = 993,
         poll_interval: int = 60,
         mailbox: str = "INBOX",
+        use_idle: bool = True,
+        idle_timeout: int = 25 * 60,
+        use_ssl: bool = True,
+        timeout: int = 60,
+        health_check_interval: int = 60,
+        fetch_batch_size: int = 100,
+        dispatcher: CallbackDispatcher = None,
     ):
+        """
+        :param poll_interval: ポーリング間隔 (秒)。IDLE が使えない場合に使う
+        :param use_idle: サーバーが対応していれば IDLE で新着を待つ
+        :param idle_timeout: IDLE を張り直す間隔 (秒)。サーバーの29分の制限より短くする
+        :param use_ssl: False の場合は平文で接続する (ローカルの IMAP サーバーでの確認用)
+        :param timeout: ソケットのタイムアウト (秒)
+        :param health_check_interval: 最後の通信からこの秒数が経っていたら NOOP で接続を確認する
+        :param fetch_batch_size: 1回の UID FETCH で取得するメールの最大件数
+        :param dispatcher: コールバックを実行する CallbackDispatcher (None の場合は専用のものを作る)
+        """
         self.email_address = email_address
         self.password = password
         self.server = server
@@ -128,16 +392,87 @@ class IMAPNewMailCheckerByUID:
         self.last_uid = 0
         self.callbacks = []
         self.mailbox = mailbox
+        self.use_idle = use_idle
+        self.idle_timeout = idle_timeout
+        self.use_ssl = use_ssl
+        self._idle_tag = None
+        # メール受信からコールバック開始までの遅延 (秒)
+        self.latencies = deque(maxlen=1000)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connected_at = None
+        self.last_activity = None
+        self.num_connects = 0
+        self.num_reconnects = 0
+        self.fetch_batch_size = fetch_batch_size
+        self._owns_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher or CallbackDispatcher()
+        self.source = f"{email_address}/{mailbox}"
+        self.uidvalidity = None
+        self.uidnext = None
+        self.exists = 0
 
     def connect(self):
         """IMAP サーバーに接続して認証を行う。"""
         try:
-            self.mail = imaplib.IMAP4_SSL(self.server, self.port)
+            imap_class = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+            self.mail = imap_class(self.server, self.port, timeout=self.timeout)
             self.mail.login(self.email_address, self.password)
-            self.mail.select(self.mailbox)
+            typ, data = self.mail.select(self.mailbox)
+            # SELECT の応答からメールボックスの状態を取得する (SEARCH ALL は使わない)
+            self.exists = int(data[0]) if typ == "OK" and data and data[0] else 0
+            # SELECT の EXISTS は untagged_responses に残るため、新着の通知と区別できるよう取り除く
+            self.mail.untagged_responses.pop("EXISTS", None)
+            uidvalidity = int(self.mail.response("UIDVALIDITY")[1][0] or 0)
+            uidnext = self.mail.response("UIDNEXT")[1][0]
+            self.uidnext = int(uidnext) if uidnext else None
         except Exception as e:
             print(f"Connection failed: {e}")
             self.mail = None
+            return
+        if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+            # UID が振り直されたため、以前の last_uid は使えない
+            logger.warning(f"UIDVALIDITY changed: {self.uidvalidity} -> {uidvalidity}")
+            self.last_uid = self._initial_uid(uidvalidity, 0)
+        self.uidvalidity = uidvalidity
+        if self.num_connects:
+            self.num_reconnects += 1
+        self.num_connects += 1
+        self.connected_at = self.last_activity = time.monotonic()
+
+    def reconnect(self, delay=5):
+        """接続を閉じてからつなぎ直す。"""
+        self.close()
+        time.sleep(delay)
+        self.connect()
+
+    def ensure_connected(self) -> bool:
+        """
+        接続を確認し、必要な場合だけつなぎ直す。
+        未接続なら接続し、最後の通信から health_check_interval 秒以上経っていれば NOOP で確認する。
+        :return: 接続できている場合 True
+        """
+        if not self.mail:
+            self.connect()
+            return self.mail is not None
+        if time.monotonic() - self.last_activity >= self.health_check_interval:
+            try:
+                typ, _ = self.mail.noop()
+                if typ != "OK":
+                    raise imaplib.IMAP4.abort(f"NOOP failed: {typ}")
+                self.last_activity = time.monotonic()
+            except (imaplib.IMAP4.abort, OSError):
+                self.reconnect()
+        return self.mail is not None
+
+    def connection_stats(self) -> dict:
+        """接続の継続時間 (秒)・接続回数・再接続回数を返す。"""
+        return {
+            "connected": self.mail is not None,
+            "uptime": time.monotonic() - self.connected_at if self.mail and self.connected_at else 0.0,
+            "connects": self.num_connects,
+            "reconnects": self.num_reconnects,
+        }
 
     def close(self):
         """IMAP セッションを閉じる。"""
@@ -152,76 +487,129 @@ class IMAPNewMailCheckerByUID:
                 pass
             self.mail = None
 
-    def _get_current_max_uid(self) -> int:
+    def _initial_uid(self, uidvalidity: int, include_last_n: int = 0) -> int:
         """
-        INBOX 内の最大 UID を取得して返す。
+        監視を開始する UID (この UID より後を処理する) を返す。
+        チェックポイントがあればそこから再開し、なければ最新のメールから始める。
+        include_last_n が指定されていれば、直近 n 件も処理対象にする (処理済みのものはキューで除かれる)。
         """
-        typ, data = self.mail.uid('search', None, "ALL")
+        checkpoint = self.dispatcher.queue.get_checkpoint(self.source, uidvalidity)
+        if include_last_n > 0 and self.exists:
+            # シーケンス番号で n 件前のメールの UID を1回の FETCH で調べる
+            seq = max(1, self.exists - include_last_n + 1)
+            typ, data = self.mail.fetch(str(seq), "(UID)")
+            match = re.search(rb"UID (\d+)", data[0]) if typ == "OK" and data and data[0] else None
+            if match:
+                start = int(match.group(1)) - 1
+                return start if checkpoint is None else min(checkpoint, start)
+        if checkpoint is not None:
+            return checkpoint
+        if self.uidnext:
+            return self.uidnext - 1
+        # UIDNEXT が返されないサーバーでは最新のメールの UID を調べる
+        typ, data = self.mail.fetch("*", "(UID)") if self.exists else (None, None)
+        match = re.search(rb"UID (\d+)", data[0]) if typ == "OK" and data and data[0] else None
+        return int(match.group(1)) if match else 0
+
+    HEADER_FIELDS = "FROM TO CC SUBJECT DATE MESSAGE-ID"
+    MIME_FIELDS = "MIME-VERSION CONTENT-TYPE CONTENT-TRANSFER-ENCODING"
+
+    def _search_new_uids(self) -> List[int]:
+        """self.last_uid より新しい UID を昇順で返す。"""
+        criteria = f"UID {self.last_uid + 1}:*"
+        typ, data = self.mail.uid('search', None, criteria)
+        self.last_activity = time.monotonic()
         if typ != "OK" or not data or not data[0]:
-            return 0
-        uid_list = data[0].split()  # [b'1', b'2', ...]
-        int_uids = [int(x) for x in uid_list]
-        return max(int_uids) if int_uids else 0
+            return []
+        # "UID n:*" は新着がなくても最大 UID を返すため、last_uid 以下は除く
+        return sorted(uid for uid in map(int, data[0].split()) if uid > self.last_uid)
+
+    def _fetch(self, uids: List[int], items: str):
+        """
+        UID の集合を1回の UID FETCH で取得し、メールごとに (uid, 応答のテキスト部分, {セクション: リテラル}) を返す。
+        """
+        typ, msg_data = self.mail.uid('fetch', uid_set(uids), items)
+        self.last_activity = time.monotonic()
+        if typ != "OK" or not msg_data:
+            return
+        meta, literals = b"", {}
+        for response_part in msg_data:
+            prefix = response_part[0] if isinstance(response_part, tuple) else response_part
+            if prefix is None:
+                continue
+            if re.match(rb"\d+ \(", prefix) and meta:
+                # 次のメールの応答が始まった
+                yield from _fetch_result(meta, literals)
+                meta, literals = b"", {}
+            meta += prefix
+            if isinstance(response_part, tuple):
+                section = re.search(rb"(BODY\[[^\]]*\])[^\[]*$", prefix)
+                literals[section.group(1).decode() if section else ""] = response_part[1]
+        if meta:
+            yield from _fetch_result(meta, literals)
+
+    def iter_new_messages(self, batch_size: int = None):
+        """
+        新着メールのヘッダを batch_size 件ずつまとめて取得し、MailMessage のリストを順に返す。
+        1回の UID FETCH で受信日時と必要なヘッダだけを取得する。
+        """
+        if not self.ensure_connected():
+            return
+        batch_size = batch_size or self.fetch_batch_size
+        new_uids = self._search_new_uids()
+        for i in range(0, len(new_uids), batch_size):
+            batch = []
+            items = f"(UID INTERNALDATE BODY.PEEK[HEADER.FIELDS ({self.HEADER_FIELDS})])"
+            for uid, meta, literals in self._fetch(new_uids[i:i + batch_size], items):
+                msg = email.message_from_bytes(next(iter(literals.values()), b""))
+                mail_msg = MailMessage.from_email_message(uid, msg)
+                internal_date = imaplib.Internaldate2tuple(meta)
+                mail_msg.received_at = time.mktime(internal_date) if internal_date else None
+                batch.append(mail_msg)
+            batch.sort(key=lambda mail_msg: mail_msg.uid)
+            yield batch
 
     def fetch_new_messages(self) -> List[MailMessage]:
         """
         前回取得した最大 UID (self.last_uid) より新しいメールを取得し、
         (ヘッダだけ埋まった) MailMessage のリストを返す。
         """
-        if not self.mail:
-            return []
-        self.connect()
-        if not self.mail:
-            return []
-        criteria = f"UID {self.last_uid + 1}:*"
-        typ, data = self.mail.uid('search', None, criteria)
-        if typ != "OK" or not data or not data[0]:
-            return []
+        return [mail_msg for batch in self.iter_new_messages() for mail_msg in batch]
 
-        new_uids = data[0].split()  # [b'102', b'103', ...]
-        new_messages = []
-        for uid_bytes in new_uids:
-            uid = int(uid_bytes)
-            if uid <= self.last_uid:
+    def fetch_bodies(self, mail_msgs: List[MailMessage]):
+        """
+        複数のメールの本文と添付ファイル情報を1回の UID FETCH で取得して MailMessage に設定する。
+        メール全体ではなく、MIME 関連のヘッダと BODY.PEEK[TEXT] だけを取得する。
+        """
+        if not mail_msgs or not self.ensure_connected():
+            return
+        by_uid = {mail_msg.uid: mail_msg for mail_msg in mail_msgs}
+        items = f"(UID BODY.PEEK[HEADER.FIELDS ({self.MIME_FIELDS})] BODY.PEEK[TEXT])"
+        for uid, meta, literals in self._fetch(list(by_uid), items):
+            if uid not in by_uid:
                 continue
-
-            # ヘッダだけ取得
-            typ2, msg_data = self.mail.uid('fetch', str(uid), '(BODY.PEEK[HEADER])')
-            if typ2 == "OK":
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        raw_email = response_part[1]
-                        msg = email.message_from_bytes(raw_email)
-                        mail_msg = MailMessage.from_email_message(uid, msg)
-                        new_messages.append(mail_msg)
-
-        return new_messages
+            header = next((v for k, v in literals.items() if "HEADER" in k), b"")
+            text = next((v for k, v in literals.items() if "TEXT" in k), b"")
+            # ヘッダの末尾の空行は HEADER.FIELDS の応答に含まれる
+            msg = email.message_from_bytes(header.rstrip(b"\r\n") + b"\r\n\r\n" + text)
+            by_uid[uid].body = get_text_body(msg)
+            by_uid[uid].attachments = get_attachments(msg)
 
     def fetch_body_and_attachments(self, uid: int, mail_msg: MailMessage):
         """
         指定した UID のメール本文と添付ファイル情報を取得して MailMessage に設定する。
         """
-        if not self.mail:
-            self.connect()
-            if not self.mail:
-                return
-
-        typ, msg_data = self.mail.uid('fetch', str(uid), '(RFC822)')
-        if typ == 'OK' and msg_data:
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    raw_email = response_part[1]
-                    msg = email.message_from_bytes(raw_email)
-                    mail_msg.body = get_text_body(msg)
-                    mail_msg.attachments = get_attachments(msg)
-                    break
+        self.fetch_bodies([mail_msg])
 
     def register_callback(
         self,
         from_pattern: str = None,
         subject_pattern: str = None,
         body_pattern: str = None,
-        callback=None
+        callback=None,
+        name: str = None,
+        max_concurrency: int = 1,
+        key=None,
     ):
         """
         新しいコールバックを登録する。
@@ -229,17 +617,40 @@ class IMAPNewMailCheckerByUID:
         :param subject_pattern: 件名の正規表現パターン (str または None)
         :param body_pattern: 本文の正規表現パターン (str または None)
         :param callback: 条件にマッチした場合に実行するコールバック関数
+        :param name: 永続キューに保存するコールバック名 (省略時は関数名)
+        :param max_concurrency: このコールバックの同時実行数の上限
+        :param key: MailMessage から直列化のキーを返す関数 (省略時はアカウントとコールバックごとに直列)
         """
         from_regex = re.compile(from_pattern, re.IGNORECASE) if from_pattern else None
         subject_regex = re.compile(subject_pattern, re.IGNORECASE) if subject_pattern else None
         body_regex = re.compile(body_pattern, re.IGNORECASE) if body_pattern else None
 
+        name = name or (getattr(callback, "__name__", None) or f"callback{len(self.callbacks)}")
+        assert all(cb['name'] != name for cb in self.callbacks), f"callback name already registered: {name}"
         self.callbacks.append({
             'from_regex': from_regex,
             'subject_regex': subject_regex,
             'body_regex': body_regex,
-            'callback': callback
+            'callback': callback,
+            'name': name,
         })
+        if callback:
+            self.dispatcher.register(self.source, name, self._with_latency(callback), max_concurrency, key)
+
+    def _with_latency(self, callback):
+        def run(mail_msg):
+            if mail_msg.received_at is not None:
+                self.latencies.append(time.time() - mail_msg.received_at)
+            return callback(mail_msg)
+        return run
+
+    def _match_headers(self, cb, mail_msg: MailMessage) -> bool:
+        # FROM と SUBJECT が指定されていればマッチするか
+        if cb['from_regex'] and not cb['from_regex'].search(mail_msg.from_):
+            return False
+        if cb['subject_regex'] and not cb['subject_regex'].search(mail_msg.subject):
+            return False
+        return True
 
     def check_and_run_callback(self):
         """
@@ -247,82 +658,286 @@ class IMAPNewMailCheckerByUID:
         条件にマッチしたら本文と添付ファイルを取得したうえでコールバックを呼ぶ (本文つきの MailMessage を渡す)。
         
         ※ ここがポイント:
+          - ヘッダ (FROM/SUBJECT) はまとめて取得し、ヘッダがマッチしたメールだけ本文をまとめて取得する
           - body_pattern がある場合は本文をチェック
           - body_pattern が「ない」場合も自動的に本文マッチとみなし、本文を取得してコールバックに渡す。
+          - fetch_batch_size 件ごとに処理するため、すべてのメールをメモリ上に持たない
+          - コールバックは永続キューに保存してから CallbackDispatcher のワーカーで実行し、
+            保存が終わってから last_uid を進める (ここでは完了を待たない)
         """
-        new_msgs = self.fetch_new_messages()
-        max_uid_in_batch = self.last_uid
+        for batch in self.iter_new_messages():
+            # ヘッダがマッチしたコールバックがあるメールだけ本文を取得する
+            matched = [
+                mail_msg for mail_msg in batch
+                if any(self._match_headers(cb, mail_msg) for cb in self.callbacks)
+            ]
+            self.fetch_bodies(matched)
+
+            items = []
+            for mail_msg in matched:
+                for cb in self.callbacks:
+                    if not self._match_headers(cb, mail_msg):
+                        continue
+                    if cb['body_regex'] is not None and not cb['body_regex'].search(mail_msg.body):
+                        continue  # 本文マッチしないので次の callback へ
 
-        for mail_msg in new_msgs:
-            body_fetched = False  # このメールの本文はまだ取得していない
+                    # ここまで来たら「すべての条件」をクリア
+                    if cb['callback']:
+                        items.append((mail_msg.uid, cb['name'], mail_msg))
 
-            for cb in self.callbacks:
-                # 1) FROM が指定＆マッチするか
-                if cb['from_regex'] and not cb['from_regex'].search(mail_msg.from_):
-                    continue
+            jobs = self.dispatcher.queue.enqueue_many(
+                self.source, self.uidvalidity, items, last_uid=batch[-1].uid if batch else None
+            )
+            if batch and batch[-1].uid > self.last_uid:
+                self.last_uid = batch[-1].uid
+            self.dispatcher.submit(jobs)
 
-                # 2) SUBJECT が指定＆マッチするか
-                if cb['subject_regex'] and not cb['subject_regex'].search(mail_msg.subject):
-                    continue
 
-                # 3) body_pattern があるかないかで分岐
-                #    - ある → 本文を fetch してパターンマッチを確認
-                #    - ない → 自動的にマッチ扱いだが、callback に本文つき MailMessage を渡す必要があるので、本文を fetch
-                if cb['body_regex'] is not None:
-                    # body_pattern が存在する → チェックする
-                    if not body_fetched:
-                        self.fetch_body_and_attachments(mail_msg.uid, mail_msg)
-                        body_fetched = True
+    def supports_idle(self) -> bool:
+        """IDLE で新着を待てるかを返す。"""
+        return self.use_idle and self.mail is not None and "IDLE" in self.mail.capabilities
 
-                    if not cb['body_regex'].search(mail_msg.body):
-                        continue  # 本文マッチしないので次の callback へ
-                else:
-                    # body_pattern が存在しない → 自動的に本文マッチ扱い
-                    if not body_fetched:
-                        self.fetch_body_and_attachments(mail_msg.uid, mail_msg)
-                        body_fetched = True
-
-                # ここまで来たら「すべての条件」をクリア
-                if cb['callback']:
-                    cb['callback'](mail_msg)
-
-            if mail_msg.uid > max_uid_in_batch:
-                max_uid_in_batch = mail_msg.uid
+    def pending_exists(self) -> bool:
+        """
+        直前のコマンド (UID SEARCH/FETCH, NOOP など) の途中で届いた EXISTS を取り出す。
+        imaplib はこれを untagged_responses に溜めるだけなので、IDLE を張る前に確認しないと見落とす。
+        :return: EXISTS が届いていた場合 True
+        """
+        data = self.mail.untagged_responses.pop("EXISTS", None)
+        if not data:
+            return False
+        self.exists = int(data[-1])
+        return True
 
-        if max_uid_in_batch > self.last_uid:
-            self.last_uid = max_uid_in_batch
+    def idle_start(self) -> bool:
+        """
+        IDLE を開始する。
+        サーバーは継続応答 (+) の前に未通知の EXISTS を送ることがあるため、それも確認する。
+        :return: IDLE の開始までに EXISTS を受け取った場合 True
+        """
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b" IDLE\r\n")
+        notified = False
+        while True:
+            response = self.mail.readline()
+            if not response:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if response.startswith(b"+"):
+                break
+            if not response.startswith(b"*"):
+                raise imaplib.IMAP4.abort(f"IDLE rejected: {response!r}")
+            notified = self._parse_exists(response) or notified
+        self._idle_tag = tag
+        return notified
+
+    def idle_pending(self) -> bool:
+        """
+        select では検知できない読み込み済みのデータがあるかを返す。
+        imaplib はバッファつきの self.mail.file 経由で読むため、「+ idling」と同じセグメントで届いた
+        EXISTS は Python 側のバッファに残る。ソケットをノンブロッキングにしてバッファを覗く
+        (TLS 層に復号済みのデータもここで読み込まれる)。
+        """
+        sock = self.mail.sock
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(self.mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
 
+    def _parse_exists(self, line: bytes) -> bool:
+        match = re.match(rb"\* (\d+) EXISTS", line)
+        if match:
+            self.exists = int(match.group(1))
+        return match is not None
 
-    def run(self, include_last_n=0):
-        """ロックを取得してから実行する。"""
+    def idle_read(self) -> bool:
+        """
+        IDLE 中の応答を1行読む。
+        :return: 新着 (EXISTS) の通知だった場合 True
+        """
+        line = self.mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        return self._parse_exists(line)
+
+    def idle_done(self):
+        """IDLE を終了し、完了応答まで読み捨てる。"""
+        if self._idle_tag is None:
+            return
+        tag, self._idle_tag = self._idle_tag, None
+        self.mail.send(b"DONE\r\n")
+        while True:
+            line = self.mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if line.startswith(tag):
+                break
+        self.last_activity = time.monotonic()
+
+    def wait_for_new_mail(self) -> bool:
+        """
+        IDLE が使える場合は新着の通知か idle_timeout まで、使えない場合は poll_interval だけ待つ。
+        :return: 新着の通知を受け取った場合 True
+        """
+        return self in wait_for_new_mail([self], self.idle_timeout if self.supports_idle() else self.poll_interval)
+
+    def latency_stats(self) -> dict:
+        """メール受信からコールバック開始までの遅延 (秒) の統計を返す。"""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {"count": 0}
+        return {
+            "count": len(latencies),
+            "mean": statistics.mean(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        }
+
+    def start(self, include_last_n=0, retry_failed=False) -> bool:
+        """
+        ロックを取得して接続し、監視を開始する UID を決める。
+        :param include_last_n: 直近 n 件のメールも処理対象にする (その範囲で失敗したコールバックも再実行する)
+        :param retry_failed: True の場合、失敗したすべてのコールバックを再実行する
+        :return: 接続できた場合 True
+        """
         lock_file_path = f'/tmp/{self.email_address}.lock'
-        lock_file = open(lock_file_path, 'w')
+        self._lock_file = open(lock_file_path, 'w')
         try:
-            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)  # ロックを取得
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)  # ロックを取得
         except IOError:
+            self._lock_file.close()
+            self._lock_file = None
             raise Exception("Another instance is already running.")
 
         self.connect()
         if not self.mail:
+            self.stop()
+            return False
+        self.last_uid = self._initial_uid(self.uidvalidity, include_last_n)
+        if retry_failed:
+            self.dispatcher.queue.requeue_failed(self.source)
+        elif include_last_n > 0:
+            # 直近 n 件の読み直しは処理済みのジョブをキューで除くため、失敗したものはここで実行待ちに戻す
+            self.dispatcher.queue.requeue_failed(self.source, self.uidvalidity, min_uid=self.last_uid + 1)
+        # 前回のプロセスで処理が終わらなかったコールバックを再開する
+        self.dispatcher.submit(self.dispatcher.queue.unfinished(self.source))
+        return True
+
+    def retry_failed(self) -> int:
+        """
+        失敗したコールバックを実行待ちに戻して再実行する (監視中に呼んでよい)。
+        :return: 再実行するジョブの件数
+        """
+        job_ids = set(self.dispatcher.queue.requeue_failed(self.source))
+        if job_ids:
+            logger.info(f"{self.source}: retrying {len(job_ids)} failed callback(s)")
+            self.dispatcher.submit([job for job in self.dispatcher.queue.unfinished(self.source) if job["id"] in job_ids])
+        return len(job_ids)
+
+    def poll_once(self) -> bool:
+        """
+        新着メールを1回確認する。接続切れの場合は再接続する。
+        :return: 監視を続けられる場合 True
+        """
+        if not self.ensure_connected():
+            return False
+        try:
+            self.check_and_run_callback()
+        except (imaplib.IMAP4.abort, OSError):
+            # 接続切れ・タイムアウトの場合だけつなぎ直す
+            self.reconnect()
+            if not self.mail:
+                return False
+        return True
+
+    def stop(self):
+        """接続を閉じてロックを解放する。"""
+        self.close()
+        if getattr(self, "_lock_file", None):
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)  # ロックを解放
+            self._lock_file.close()
+            self._lock_file = None
+
+    def run(self, include_last_n=0, retry_failed=False):
+        """ロックを取得してから実行する。"""
+        if not self.start(include_last_n, retry_failed):
             return
-        current_max_uid = self._get_current_max_uid()
-        self.last_uid = max(0, current_max_uid - include_last_n)
 
         try:
-            while True:
-                try:
-                    self.check_and_run_callback()
-                except imaplib.IMAP4.abort:
-                    # 接続切れをリカバリ
-                    self.close()
-                    time.sleep(5)
-                    self.connect()
-                    if not self.mail:
-                        break
-                time.sleep(self.poll_interval)
+            while self.poll_once():
+                self.wait_for_new_mail()
         except KeyboardInterrupt:
             pass
         finally:
-            self.close()
-            fcntl.flock(lock_file, fcntl.LOCK_UN)  # ロックを解放
-            lock_file.close()
\ No newline at end of file
+            self.stop()
+            if self._owns_dispatcher:
+                # 実行中のコールバックが終わるまで待つ (未実行のものは次回の起動時に再開する)
+                self.dispatcher.shutdown(wait=True)
+
+
+def wait_for_new_mail(checkers, timeout):
+    """
+    複数の IMAPNewMailCheckerByUID の新着をまとめて待つ。
+    IDLE に対応しているものは IDLE を張ってソケットを select で監視し、
+    いずれかに新着の通知が来るか timeout 秒が経つまで待つ。
+
+    :param checkers: 待つ対象の IMAPNewMailCheckerByUID のリスト
+    :param timeout: 最大の待ち時間 (秒)
+    :return: 新着の通知を受け取った (または接続に異常があった) checker の集合
+    """
+    notified = set()
+    idling = []
+    for checker in checkers:
+        if checker.mail is not None and checker.pending_exists():
+            # 前回の確認中に届いた新着は IDLE を張らずにすぐ確認する
+            notified.add(checker)
+            continue
+        if not checker.supports_idle():
+            continue
+        try:
+            if checker.idle_start():
+                notified.add(checker)
+            idling.append(checker)
+        except (imaplib.IMAP4.error, OSError):
+            checker._idle_tag = None
+            checker.close()
+            notified.add(checker)
+    if not idling:
+        if not notified:
+            time.sleep(timeout)
+        return notified
+
+    deadline = time.monotonic() + timeout
+    try:
+        while not notified:
+            ready = [checker for checker in idling if checker.idle_pending()]
+            if not ready:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sockets = {checker.mail.socket(): checker for checker in idling}
+                readable, _, _ = select.select(list(sockets), [], [], remaining)
+                if not readable:
+                    break
+                ready = [sockets[sock] for sock in readable]
+            for checker in ready:
+                try:
+                    if checker.idle_read():
+                        notified.add(checker)
+                except (imaplib.IMAP4.error, OSError):
+                    checker._idle_tag = None
+                    checker.close()
+                    notified.add(checker)
+                    idling.remove(checker)
+    finally:
+        for checker in idling:
+            try:
+                checker.idle_done()
+            except (imaplib.IMAP4.error, OSError):
+                checker.close()
+                notified.add(checker)
+    return notified